@@ -9,23 +9,21 @@ PROJECT_ROOT = CURR_DIR.parent                      # корень проект
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.append(str(PROJECT_ROOT))
 
-# --- безопасный импорт safe_crop из двух возможных мест ---
-try:
-    from utils.image_tools import safe_crop
-except Exception:
-    try:
-        from utils.image_tools import safe_crop
-    except Exception:
-        safe_crop = None  # обработаем дальше в коде
-
 # --- стандартные импорты ---
 import json
+import time
+import zipfile
 from io import BytesIO
 from PIL import Image
 import streamlit as st
 
 # --- наш пайплайн ---
 from src.pipeline import run_pipeline
+from src.engines import get_engines
+from src.jobs import JobRunner, QUEUED, RUNNING, DONE, ERROR
+from src.uploads import UploadStore, UploadTooLarge, result_key
+from src.search_index import SearchIndex
+from src.batch import iter_documents, job_row, qa_summary, to_jsonl, to_csv, to_ocrpack
 
 
 # ============= СТИЛИЗАЦИЯ =============
@@ -156,8 +154,54 @@ if "result" not in st.session_state:
     st.session_state.result = None
 if "pages" not in st.session_state:
     st.session_state.pages = None
-if "processing" not in st.session_state:
-    st.session_state.processing = False
+if "job_ids" not in st.session_state:
+    st.session_state.job_ids = []
+if "shown_job" not in st.session_state:
+    st.session_state.shown_job = None
+if "loaded_job" not in st.session_state:
+    st.session_state.loaded_job = None
+
+
+@st.cache_resource(show_spinner="Загрузка моделей OCR...")
+def warm_engines():
+    # модели грузятся один раз на процесс и делятся между всеми сессиями;
+    # одновременные инференсы ограничены пулом Paddle, документы — допуском по памяти
+    return get_engines()
+
+
+@st.cache_resource
+def get_job_runner() -> JobRunner:
+    # один фоновый пул на процесс, общий для всех сессий
+    return JobRunner(run_pipeline, max_workers=int(os.getenv("OCR_JOB_WORKERS", "2")),
+                     result_cache=get_upload_store(), on_done=get_search_index().add_job)
+
+
+@st.cache_resource
+def get_search_index() -> SearchIndex:
+    # индекс готовых документов пополняется по мере их завершения (JobRunner on_done)
+    # не в tmp_upload: там janitor удаляет файлы по TTL и квоте
+    path = Path(os.getenv("SEARCH_DB", str(PROJECT_ROOT / "data" / "index.sqlite")))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return SearchIndex(str(path))
+
+
+@st.cache_resource
+def get_upload_store() -> UploadStore:
+    # файлы по хэшу содержимого, лимит размера, janitor с квотой на диск
+    store = UploadStore(
+        PROJECT_ROOT / "tmp_upload",
+        max_bytes=int(os.getenv("UPLOAD_MAX_MB", "200")) << 20,
+        quota_bytes=int(os.getenv("UPLOAD_QUOTA_MB", "2048")) << 20,
+        ttl=float(os.getenv("UPLOAD_TTL_HOURS", "6")) * 3600,
+        in_use=lambda: [str(j.path) for j in get_job_runner().jobs() if j.active],
+    )
+    store.start_janitor()
+    return store
+
+
+warm_engines()
+uploads = get_upload_store()
+runner = get_job_runner()
 
 st.markdown("---")
 
@@ -193,76 +237,188 @@ with col2:
 
     with st.expander("🔧 Расширенные настройки"):
         confidence_threshold = st.slider("Порог уверенности OCR", 0.5, 1.0, 0.8, 0.05)
-        preproc_mode = st.selectbox("Профиль препроцессинга", ["soft", "binary"], index=0)  # 👈 вставить здесь
+        preproc_mode = st.selectbox("Профиль препроцессинга", ["auto", "soft", "binary"], index=0,
+                                    help="auto — профиль подбирается по качеству каждой страницы")
+        adaptive_pass = st.checkbox("Второй проход по слабым строкам", value=True,
+                                    help="Перечитывает только строки с низкой уверенностью")
         enable_postprocessing = st.checkbox("Включить постобработку", value=True)
         extract_tables = st.checkbox("Извлекать таблицы", value=False)
 
 if f:
-    if not st.session_state.processing:
-        process_button = st.button("🚀 Обработать документ", type="primary", use_container_width=True)
-    else:
-        st.markdown('<div class="processing">⏳ Обработка документа...</div>', unsafe_allow_html=True)
-        process_button = False
+    process_button = st.button("🚀 Обработать документ", type="primary", use_container_width=True)
 else:
     st.info("👆 Загрузите файл для начала обработки")
     process_button = False
 
-if process_button and f and not st.session_state.processing:
-    st.session_state.processing = True
-
-    tmp = PROJECT_ROOT / "tmp_upload" / f.name
-    tmp.parent.mkdir(parents=True, exist_ok=True)
-    tmp.write_bytes(f.read())
-
-    hint = None if doc_type == "auto" else doc_type
-
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-
+if process_button and f:
     try:
-        status_text.text("🔄 Инициализация пайплайна...")
-        progress_bar.progress(10)
-
-        status_text.text("📄 Загрузка и предобработка документа...")
-        progress_bar.progress(30)
-
-        status_text.text("🔍 Распознавание текста (OCR)...")
-        progress_bar.progress(60)
-
-        result, pages = run_pipeline(
-            tmp,
-            hint,
+        # потоковая запись в файл с именем по хэшу содержимого
+        f.seek(0)
+        stored = uploads.store(f, f.name, size_hint=getattr(f, "size", None))
+    except UploadTooLarge as e:
+        stored = None
+        st.error(f"❌ {e}")
+
+    if stored is not None:
+        hint = None if doc_type == "auto" else doc_type
+        params = dict(
+            doc_type_hint=hint,
             conf_threshold=confidence_threshold,
-            preproc_mode=preproc_mode
+            preproc_mode=preproc_mode,
+            adaptive=adaptive_pass,
         )
-        status_text.text("⚙️ Постобработка и извлечение полей...")
-        progress_bar.progress(80)
-
-        status_text.text("✅ Завершение обработки...")
-        progress_bar.progress(100)
-
-        st.session_state.result = result or {}
-        st.session_state.pages = pages or []
-        st.session_state.processing = False
-
-        progress_bar.empty()
-        status_text.empty()
-
-        st.markdown("""
-        <div class="success-card">
-            <h3>🎉 Документ успешно обработан!</h3>
-            <p>Смотрите результаты ниже: данные, разделы, инспектор и экспорт.</p>
-        </div>
-        """, unsafe_allow_html=True)
+        job = runner.submit(stored.path, name=f.name, key=result_key(stored.sha256, params), **params)
+        if job.id not in st.session_state.job_ids:
+            st.session_state.job_ids.append(job.id)
+        if stored.reused:
+            st.info("♻️ Этот файл уже загружался — используется готовый результат")
+
+# ======= ОЧЕРЕДЬ =======
+my_jobs = runner.jobs(st.session_state.job_ids)
+if my_jobs:
+    st.markdown("### ⏳ Очередь обработки")
+    for job in reversed(my_jobs):
+        if job.status == QUEUED:
+            st.markdown(f'<div class="processing">🕒 {job.name} — в очереди</div>', unsafe_allow_html=True)
+        elif job.status == RUNNING:
+            total = job.pages_total or "?"
+            st.progress(job.progress, text=f"🔍 {job.name}: страница {job.pages_done}/{total} · {job.elapsed:.0f} с")
+            if job.partial:
+                with st.expander(f"Уже распознано страниц: {len(job.partial)}", expanded=False):
+                    for i, items in enumerate(job.partial):
+                        st.markdown(f"**Страница {i + 1}**")
+                        st.text("\n".join(o.get("text", "") for o in items) or "— пусто —")
+        elif job.status == ERROR:
+            st.error(f"❌ {job.name}: ошибка при обработке: {job.error}")
+        else:
+            jc1, jc2 = st.columns([4, 1])
+            with jc1:
+                st.markdown(f"✅ **{job.name}** — {job.elapsed:.1f} с")
+            with jc2:
+                if st.button("Показать", key=f"show_{job.id}", use_container_width=True):
+                    st.session_state.shown_job = job.id
+
+    done_ids = [j.id for j in my_jobs if j.status == DONE]
+    if done_ids and st.session_state.shown_job not in done_ids:
+        st.session_state.shown_job = done_ids[-1]
+
+# результат подгружаем один раз при смене документа — ручные правки полей не затираются
+if st.session_state.shown_job and st.session_state.shown_job != st.session_state.loaded_job:
+    job = runner.get(st.session_state.shown_job)
+    if job is not None and job.status == DONE:
+        st.session_state.result = job.result or {}
+        # в сессии держим только сжатые превью; bbox рисуются по запросу
+        st.session_state.pages = job.previews
+        st.session_state.loaded_job = job.id
+
+# ======= ПАКЕТНАЯ ОБРАБОТКА =======
+if "batch_ids" not in st.session_state:
+    st.session_state.batch_ids = []
+
+with st.expander("📦 Пакетная обработка (много файлов или ZIP)", expanded=bool(st.session_state.batch_ids)):
+    batch_files = st.file_uploader(
+        "Файлы пакета",
+        type=["pdf", "jpg", "jpeg", "png", "zip"],
+        accept_multiple_files=True,
+        key="batch_uploader",
+        help="Можно выбрать несколько файлов или один ZIP-архив; настройки — как для одного документа",
+    )
+    bc1, bc2 = st.columns([3, 1])
+    with bc1:
+        batch_button = st.button("📦 Обработать пакет", disabled=not batch_files, use_container_width=True)
+    with bc2:
+        if st.button("🧹 Очистить", disabled=not st.session_state.batch_ids, use_container_width=True):
+            st.session_state.batch_ids = []
+
+    if batch_button and batch_files:
+        hint = None if doc_type == "auto" else doc_type
+        params = dict(
+            doc_type_hint=hint,
+            conf_threshold=confidence_threshold,
+            preproc_mode=preproc_mode,
+            adaptive=adaptive_pass,
+        )
+        for bf in batch_files:
+            try:
+                for doc_name, fh in iter_documents(bf, bf.name):
+                    stored = uploads.store(fh, doc_name)
+                    # превью страниц в пакете не нужны — только JSON
+                    job = runner.submit(stored.path, name=doc_name, previews=False,
+                                        key=result_key(stored.sha256, params), **params)
+                    if job.id not in st.session_state.batch_ids:
+                        st.session_state.batch_ids.append(job.id)
+            except (UploadTooLarge, zipfile.BadZipFile) as e:
+                st.error(f"❌ {bf.name}: {e}")
+
+    batch_jobs = runner.jobs(st.session_state.batch_ids)
+    if batch_jobs:
+        n_done = sum(j.status == DONE for j in batch_jobs)
+        n_err = sum(j.status == ERROR for j in batch_jobs)
+        st.progress((n_done + n_err) / len(batch_jobs),
+                    text=f"Готово {n_done} из {len(batch_jobs)}" + (f" · ошибок: {n_err}" if n_err else ""))
+        st.dataframe([job_row(j) for j in batch_jobs], use_container_width=True, hide_index=True)
+        if n_done:
+            qa = qa_summary(batch_jobs)
+            if qa["needs_review"]:
+                st.warning(f"⚠️ На перепроверку: {qa['needs_review']} из {qa['documents']} — " + ", ".join(qa["files"][:20]))
+
+        ex1, ex2, ex3 = st.columns(3)
+        with ex1:
+            st.download_button(
+                "📄 Скачать пакет (JSONL)",
+                data=to_jsonl(batch_jobs).encode("utf-8"),
+                file_name="ocr2_batch.jsonl",
+                mime="application/x-ndjson",
+                use_container_width=True,
+            )
+        with ex2:
+            st.download_button(
+                "📊 Скачать поля пакета (CSV)",
+                data=to_csv(batch_jobs).encode("utf-8"),
+                file_name="ocr2_batch_fields.csv",
+                mime="text/csv",
+                use_container_width=True,
+            )
+        with ex3:
+            st.download_button(
+                "🗜️ Скачать пакет (MessagePack)",
+                data=to_ocrpack(batch_jobs),
+                file_name="ocr2_batch.ocrpack",
+                mime="application/octet-stream",
+                help="Читается src/result_store.ResultLog; в JSONL: python -m src.result_store unpack",
+                use_container_width=True,
+            )
 
-    except Exception as e:
-        st.session_state.processing = False
-        progress_bar.empty()
-        status_text.empty()
-        st.error(f"❌ Ошибка при обработке: {str(e)}")
+# ======= ПОИСК =======
+with st.expander("🔎 Поиск по обработанным документам"):
+    search_index = get_search_index()
+    sq = st.text_input(
+        "IBAN, ИИН/БИН, дата, сумма, `invoice_no: …` или слова из текста",
+        key="search_query",
+        help="Поле угадывается по виду запроса; иначе — полнотекстовый поиск по строкам OCR и разделам",
+    )
+    if sq:
+        t0 = time.perf_counter()
+        hits = search_index.query(sq, limit=20)
+        st.caption(f"Найдено: {len(hits)} · {1000 * (time.perf_counter() - t0):.1f} мс · "
+                   f"в индексе {search_index.stats()['docs']} док.")
+        for h in hits:
+            hc1, hc2 = st.columns([4, 1])
+            with hc1:
+                m = h.matches[0] if h.matches else {}
+                what = m.get("snippet") or f"{m.get('field')}={m.get('value')}"
+                st.markdown(f"**{h.file}** · {h.doc_type or '—'}{' · ⚠️' if h.needs_review else ''}  \n{what}")
+            with hc2:
+                if st.button("Показать", key=f"hit_{h.doc}", use_container_width=True):
+                    cached = uploads.get_result(h.key)
+                    if cached is None:
+                        st.warning("Результат уже удалён из кеша загрузок (UPLOAD_TTL_HOURS)")
+                    else:
+                        st.session_state.result = cached
+                        st.session_state.pages = None
 
 # ======= РЕЗУЛЬТАТЫ =======
-if st.session_state.result and not st.session_state.processing:
+if st.session_state.result:
     st.markdown("---")
     st.markdown("## 📊 Результаты обработки")
 
@@ -274,6 +430,15 @@ if st.session_state.result and not st.session_state.processing:
     line_items = result.get("lineItems") or []
     sections = result.get("sections") or []
 
+    dup = (result.get("meta") or {}).get("dedup")
+    if dup:
+        if dup.get("reused"):
+            src = (dup.get("pages") or dup.get("text") or {}).get("key", "")
+            st.info(f"♻️ Дубликат уже обработанного документа ({src[:12]}…): результат взят из индекса.")
+        else:
+            m = dup.get("pages") or dup.get("text") or {}
+            st.info(f"🔁 Похож на {m.get('key', '')[:12]}… ({m.get('kind')}, расстояние {m.get('distance')}) — проверьте, не дубль ли.")
+
     fields_count = len(fields)
     text_length = len(text)
     line_items_count = len(line_items)
@@ -292,6 +457,11 @@ if st.session_state.result and not st.session_state.processing:
         avg_conf = 0.95
         st.metric("Средняя уверенность", f"{avg_conf:.1%}")
 
+    dc = (result.get("meta") or {}).get("doc_class")
+    if dc:
+        how = {"classifier": "классификатор", "donut": "Donut", "hint": "задан вручную"}.get(dc.get("source"), dc.get("source"))
+        st.caption(f"Тип документа: **{result.get('docType')}** ({how}, уверенность {dc.get('confidence', 0):.0%})")
+
     tab1, tab2, tab3, tab4, tab5 = st.tabs([
         "📄 Предпросмотр",
         "📋 Данные",
@@ -305,9 +475,9 @@ if st.session_state.result and not st.session_state.processing:
         st.subheader("Страницы документа")
         if pages:
             cols = st.columns(min(3, max(1, len(pages))))
-            for i, page in enumerate(pages):
+            for i in range(len(pages)):
                 with cols[i % len(cols)]:
-                    st.image(page, caption=f"Страница {i + 1}", use_column_width=True)
+                    st.image(pages.overlay(i), caption=f"Страница {i + 1}", use_column_width=True)
         else:
             st.info("Изображения страниц не доступны")
 
@@ -323,6 +493,11 @@ if st.session_state.result and not st.session_state.processing:
             else:
                 st.info("Ключевые поля не найдены")
 
+            failed = [c for c in result.get("validation") or [] if not c.get("ok") and not c.get("info")]
+            if failed:
+                st.warning("⚠️ Проверки не пройдены: " + "; ".join(
+                    f"{c['rule']}" + (f" ({c['details']})" if c.get("details") else "") for c in failed))
+
             st.subheader("📚 Разделы документа")
             if sections:
                 for s in sections:
@@ -399,16 +574,12 @@ if st.session_state.result and not st.session_state.processing:
                     try:
                         item = ocr_items[sel]
                         bbox = item.get("bbox")
-                        page_img = pages[page_pos]
-                        if safe_crop is None:
-                            st.warning("safe_crop не найден. Проверь импорт utils.image_tools или src.utils.image_tools.")
+                        crop = pages.crop(page_pos, bbox) if bbox else None
+                        if crop is None:
+                            st.warning("Невалидный bbox для кропа")
                         else:
-                            crop = safe_crop(page_img, bbox) if bbox else None
-                            if crop is None:
-                                st.warning("Невалидный bbox для кропа")
-                            else:
-                                st.markdown("**Фрагмент изображения:**")
-                                st.image(crop, caption=f"bbox: {bbox}")
+                            st.markdown("**Фрагмент изображения:**")
+                            st.image(crop, caption=f"bbox: {bbox}")
                     except Exception as e:
                         st.error(f"Ошибка при обрезке изображения: {e}")
 
@@ -486,7 +657,7 @@ if st.session_state.result and not st.session_state.processing:
             st.success("✅ Поля успешно обновлены!")
             st.rerun()
 
-elif not st.session_state.processing:
+else:
     # Placeholder — когда нет результатов
     st.markdown("""
     <div class="info-card">
@@ -500,3 +671,8 @@ elif not st.session_state.processing:
         </ul>
     </div>
     """, unsafe_allow_html=True)
+
+# пока в очереди есть активные документы этой сессии — опрашиваем прогресс
+if any(j.active for j in my_jobs + batch_jobs):
+    time.sleep(1.0)
+    st.rerun()
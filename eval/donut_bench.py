@@ -0,0 +1,139 @@
+# eval/donut_bench.py
+from __future__ import annotations
+import argparse
+import csv
+import gc
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from PIL import Image
+
+from src.preprocess import pdf_to_images
+from src.vt_donut import MODES, DonutEngine
+
+# Сравнение режимов DonutEngine (fp32 / int8 / onnx) на своих документах:
+# время загрузки, задержка classify() (медиана, p90), совпадение с fp32 и точность
+# по разметке, если она есть. С --infer дополнительно меряется старый путь
+# infer("Extract key fields", 256 токенов) — во сколько раз дешевле classify().
+#
+#   python -m eval.donut_bench samples/ --modes fp32,int8 --labels labels.csv
+#   python -m eval.donut_bench a.pdf b.png --modes fp32,int8,onnx --input-size 1280x960 --json out.json
+#
+# labels: CSV «имя_файла,тип» или JSON {"имя_файла": "тип"} (receipt | statement | contract).
+
+EXTS = {".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp"}
+
+
+def _files(inputs: Sequence[str]) -> List[Path]:
+    out: List[Path] = []
+    for s in inputs:
+        p = Path(s)
+        out.extend(sorted(f for f in p.rglob("*") if f.suffix.lower() in EXTS) if p.is_dir() else [p])
+    return out
+
+
+def _first_page(path: Path) -> Image.Image:
+    if path.suffix.lower() == ".pdf":
+        return pdf_to_images(path, dpi=200)[0]
+    with Image.open(path) as im:
+        return im.convert("RGB")
+
+
+def _labels(path: Optional[str]) -> Dict[str, str]:
+    if not path:
+        return {}
+    p = Path(path)
+    if p.suffix.lower() == ".json":
+        return {Path(k).name: v for k, v in json.loads(p.read_text(encoding="utf-8")).items()}
+    with p.open(encoding="utf-8", newline="") as f:
+        return {Path(r[0]).name: r[1].strip() for r in csv.reader(f) if len(r) >= 2}
+
+
+def _pct(xs: List[float], q: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))] if xs else 0.0
+
+
+def bench_mode(mode: str, pages: Dict[str, Image.Image], *, threads: Optional[int],
+               input_size: Optional[str], repeat: int, infer: bool) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    eng = DonutEngine(mode=mode, threads=threads, input_size=input_size)
+    load_s = time.perf_counter() - t0
+    eng.classify(next(iter(pages.values())))  # прогрев
+
+    answers: Dict[str, Dict[str, Any]] = {}
+    ms: List[float] = []
+    infer_ms: List[float] = []
+    for name, img in pages.items():
+        for _ in range(repeat):
+            t = time.perf_counter()
+            answers[name] = eng.classify(img)
+            ms.append((time.perf_counter() - t) * 1000)
+        if infer:
+            t = time.perf_counter()
+            eng.infer(img)
+            infer_ms.append((time.perf_counter() - t) * 1000)
+    real_mode = eng.mode  # onnx без optimum откатывается в fp32
+    del eng
+    gc.collect()
+    return {
+        "mode": real_mode,
+        "load_s": round(load_s, 2),
+        "classify_ms_median": round(statistics.median(ms), 1),
+        "classify_ms_p90": round(_pct(ms, 0.9), 1),
+        "infer_ms_median": round(statistics.median(infer_ms), 1) if infer_ms else None,
+        "answers": answers,
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m eval.donut_bench",
+                                 description="Точность и задержка режимов DonutEngine против fp32")
+    ap.add_argument("inputs", nargs="+", help="файлы или папки (берётся первая страница)")
+    ap.add_argument("--modes", default="fp32,int8", help=f"через запятую из {','.join(MODES)}")
+    ap.add_argument("--labels", help="CSV/JSON с эталонным типом документа")
+    ap.add_argument("--threads", type=int)
+    ap.add_argument("--input-size", help="напр. 1280x960")
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--infer", action="store_true", help="мерить и старый infer() на 256 токенов")
+    ap.add_argument("--json", help="сохранить полный отчёт")
+    a = ap.parse_args(argv)
+
+    modes = [m.strip() for m in a.modes.split(",") if m.strip()]
+    if "fp32" in modes:  # эталон для совпадений — первым
+        modes.remove("fp32")
+        modes.insert(0, "fp32")
+    pages = {f.name: _first_page(f) for f in _files(a.inputs)}
+    if not pages:
+        print("нет входных файлов", file=sys.stderr)
+        return 1
+    labels = _labels(a.labels)
+
+    report: List[Dict[str, Any]] = []
+    for mode in modes:
+        r = bench_mode(mode, pages, threads=a.threads, input_size=a.input_size, repeat=a.repeat, infer=a.infer)
+        base = report[0]["answers"] if report and report[0]["mode"] == "fp32" else None
+        if base is not None:
+            r["agree_fp32"] = round(sum(
+                r["answers"][n]["document_type"] == base[n]["document_type"] for n in pages) / len(pages), 3)
+        known = [n for n in pages if n in labels]
+        if known:
+            r["accuracy"] = round(sum(r["answers"][n]["document_type"] == labels[n] for n in known) / len(known), 3)
+        report.append(r)
+        print(f"{r['mode']:>5}  load {r['load_s']:6.1f}s  classify {r['classify_ms_median']:8.1f}ms "
+              f"(p90 {r['classify_ms_p90']:.1f})"
+              + (f"  infer {r['infer_ms_median']:.1f}ms" if r["infer_ms_median"] is not None else "")
+              + (f"  agree_fp32 {r['agree_fp32']:.3f}" if "agree_fp32" in r else "")
+              + (f"  acc {r['accuracy']:.3f}" if "accuracy" in r else ""))
+
+    if a.json:
+        Path(a.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,138 @@
+# eval/ocr_parity.py
+from __future__ import annotations
+import argparse
+import json
+import resource
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from eval.metrics import cer
+from src.ocr_paddle import BACKENDS, PaddleEngine
+from src.preprocess import pdf_to_arrays
+
+# Паритет бэкендов PaddleEngine: paddle (эталон) против onnx / openvino на своих страницах.
+# Строки PaddleEngine.run сопоставляются по IoU bbox ≥ 0.5; считаются доля сопоставленных
+# строк в обе стороны, CER между текстами, доля совпавших точно, |Δconf|, время загрузки
+# и страницы. Код выхода 1, если паритет хуже порогов — годится как проверка в CI.
+#
+#   python -m eval.ocr_parity samples/ --backends paddle,onnx
+#   python -m eval.ocr_parity samples/ --backends onnx --repeat 3   # только скорость и память
+#
+# Память: ru_maxrss процесса — для честного сравнения запускайте по одному бэкенду.
+
+EXTS = {".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp"}
+
+
+def _pages(inputs: Sequence[str], max_pages: int) -> Dict[str, np.ndarray]:
+    out: Dict[str, np.ndarray] = {}
+    for s in inputs:
+        p = Path(s)
+        for f in sorted(x for x in p.rglob("*") if x.suffix.lower() in EXTS) if p.is_dir() else [p]:
+            if f.suffix.lower() == ".pdf":
+                for i, arr in enumerate(pdf_to_arrays(f)[:max_pages]):
+                    out[f"{f.name}#{i + 1}"] = arr
+            else:
+                with Image.open(f) as im:
+                    out[f.name] = np.array(im.convert("RGB"))
+    return out
+
+
+def _iou(a: Sequence[int], b: Sequence[int]) -> float:
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def match_lines(ref: List[Dict[str, Any]], hyp: List[Dict[str, Any]], min_iou: float = 0.5) -> List[Tuple[int, int]]:
+    """Жадное сопоставление строк по убыванию IoU."""
+    pairs = sorted(((_iou(r["bbox"], h["bbox"]), i, j)
+                    for i, r in enumerate(ref) if r.get("bbox")
+                    for j, h in enumerate(hyp) if h.get("bbox")), reverse=True)
+    used_r, used_h, out = set(), set(), []
+    for iou, i, j in pairs:
+        if iou < min_iou:
+            break
+        if i not in used_r and j not in used_h:
+            used_r.add(i)
+            used_h.add(j)
+            out.append((i, j))
+    return out
+
+
+def compare(ref: List[Dict[str, Any]], hyp: List[Dict[str, Any]]) -> Dict[str, float]:
+    m = match_lines(ref, hyp)
+    cers = [cer(ref[i]["text"], hyp[j]["text"]) for i, j in m]
+    return {
+        "ref_lines": len(ref),
+        "hyp_lines": len(hyp),
+        "recall": len(m) / max(1, len(ref)),
+        "precision": len(m) / max(1, len(hyp)),
+        "cer": float(np.mean(cers)) if cers else 0.0,
+        "exact": sum(c == 0 for c in cers) / max(1, len(cers)),
+        "conf_diff": float(np.mean([abs(ref[i]["conf"] - hyp[j]["conf"]) for i, j in m])) if m else 0.0,
+    }
+
+
+def run_backend(backend: str, pages: Dict[str, np.ndarray], repeat: int) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    eng = PaddleEngine(backend=backend)  # включая импорт рантайма и загрузку моделей
+    load_s = time.perf_counter() - t0
+    eng.run(next(iter(pages.values())))  # прогрев
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    ms: List[float] = []
+    for name, arr in pages.items():
+        for _ in range(repeat):
+            t = time.perf_counter()
+            out[name] = eng.run(arr)
+            ms.append((time.perf_counter() - t) * 1000)
+    return {"backend": backend, "load_s": round(load_s, 2), "page_ms_median": round(float(np.median(ms)), 1),
+            "page_ms_p90": round(float(np.percentile(ms, 90)), 1), "lines": out}
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m eval.ocr_parity", description="Паритет и скорость бэкендов PaddleEngine")
+    ap.add_argument("inputs", nargs="+", help="файлы или папки со страницами")
+    ap.add_argument("--backends", default="paddle,onnx", help=f"первый — эталон; из {','.join(BACKENDS)}")
+    ap.add_argument("--max-pages", type=int, default=2, help="страниц из каждого PDF")
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--min-recall", type=float, default=0.97)
+    ap.add_argument("--max-cer", type=float, default=0.02)
+    ap.add_argument("--json", help="сохранить полный отчёт")
+    a = ap.parse_args(argv)
+
+    pages = _pages(a.inputs, a.max_pages)
+    if not pages:
+        print("нет входных файлов", file=sys.stderr)
+        return 1
+    runs = [run_backend(b.strip(), pages, a.repeat) for b in a.backends.split(",") if b.strip()]
+    ok = True
+    report: Dict[str, Any] = {"pages": len(pages), "backends": [], "max_rss_mb": None}
+    for r in runs:
+        row = {k: v for k, v in r.items() if k != "lines"}
+        if r is not runs[0]:
+            per_page = {n: compare(runs[0]["lines"][n], r["lines"][n]) for n in pages}
+            agg = {k: round(float(np.mean([p[k] for p in per_page.values()])), 4)
+                   for k in ("recall", "precision", "cer", "exact", "conf_diff")}
+            row.update(vs=runs[0]["backend"], **agg)
+            row["worst"] = sorted(per_page, key=lambda n: (per_page[n]["recall"], -per_page[n]["cer"]))[:5]
+            ok &= agg["recall"] >= a.min_recall and agg["precision"] >= a.min_recall and agg["cer"] <= a.max_cer
+        report["backends"].append(row)
+        print(f"{r['backend']:>8}  load {r['load_s']:6.2f}s  page {r['page_ms_median']:8.1f}ms (p90 {r['page_ms_p90']:.1f})"
+              + (f"  recall {row['recall']:.3f}  precision {row['precision']:.3f}  cer {row['cer']:.4f}"
+                 f"  exact {row['exact']:.3f}  Δconf {row['conf_diff']:.3f}" if "vs" in row else ""))
+    report["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    print(f"max RSS {report['max_rss_mb']} MB" + ("" if ok else "  — ПАРИТЕТ НЕ ДОСТИГНУТ"))
+    if a.json:
+        Path(a.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,195 @@
+# src/amounts.py
+from __future__ import annotations
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import re
+
+# Разделители разрядов: пробел, NBSP, узкий NBSP, тонкий пробел, апостроф (OCR и Excel).
+# Точка/запятая тоже бывают разрядными: «1.234.567,89», «1,234,567.89».
+_GROUP = "[    '’]"
+
+# Число в записи суммы: с группами по 3 цифры или без групп; десятичная часть — 1–2 цифры
+# после последней точки/запятой; «12.03.2024» числом не считается. Регулярка начинается
+# с цифры (а не с просмотра назад), поэтому строки без цифр проходятся почти даром.
+# Цифры, приклеенные к буквам («KZ12», «A4»), числом не считаются.
+NUMBER = (
+    r"\d(?<![\w.,]\d)(?:\d{0,2}(?:(?:" + _GROUP + r"|[.,])\d{3})+|\d*)(?:[.,]\d{1,2})?(?!\d|[.,]\d)"
+)
+
+# Валюта: символ или код до числа, символ/код/слово после
+CURRENCY_WORDS: Dict[str, str] = {
+    "₸": "KZT", "kzt": "KZT", "тенге": "KZT", "тг": "KZT", "tg": "KZT",
+    "₽": "RUB", "rub": "RUB", "руб": "RUB",
+    "$": "USD", "usd": "USD", "долл": "USD",
+    "€": "EUR", "eur": "EUR", "евро": "EUR",
+}
+_CUR_AFTER = r"₸|тенге|тг\.?|kzt|tg\b|руб\w*\.?|₽|rub|\$|usd|долл\w*\.?|€|eur|евро"
+_CUR_BEFORE = r"₸|\$|€|₽|kzt|usd|eur|rub"
+
+RE_NUMBER = re.compile(NUMBER)
+_RE_CUR_POST = re.compile(r"(?i)\s*(" + _CUR_AFTER + r")")
+_RE_CUR_PRE = re.compile(r"(?i)(" + _CUR_BEFORE + r")\s?$")
+RE_CURRENCY = re.compile(r"(?i)" + _CUR_AFTER + r"|\b(?:kzt|usd|eur|rub)\b")
+_SEPS = re.compile(r"[.,]")
+_SPACES = re.compile(_GROUP)
+
+# --- суммы прописью ---
+_WORD_VALUES: Dict[str, int] = {
+    "ноль": 0, "один": 1, "одна": 1, "одно": 1, "два": 2, "две": 2, "три": 3, "четыре": 4,
+    "пять": 5, "шесть": 6, "семь": 7, "восемь": 8, "девять": 9, "десять": 10,
+    "одиннадцать": 11, "двенадцать": 12, "тринадцать": 13, "четырнадцать": 14, "пятнадцать": 15,
+    "шестнадцать": 16, "семнадцать": 17, "восемнадцать": 18, "девятнадцать": 19,
+    "двадцать": 20, "тридцать": 30, "сорок": 40, "пятьдесят": 50, "шестьдесят": 60,
+    "семьдесят": 70, "восемьдесят": 80, "девяносто": 90,
+    "сто": 100, "двести": 200, "триста": 300, "четыреста": 400, "пятьсот": 500,
+    "шестьсот": 600, "семьсот": 700, "восемьсот": 800, "девятьсот": 900,
+}
+_SCALES: Tuple[Tuple[str, int], ...] = (("тысяч", 10 ** 3), ("миллион", 10 ** 6), ("миллиард", 10 ** 9))
+_WORD = (
+    "|".join(sorted(_WORD_VALUES, key=len, reverse=True))
+    + r"|тысяч[аи]?|миллион(?:а|ов)?|миллиард(?:а|ов)?"
+)
+RE_WORDS = re.compile(
+    r"(?i)(?<![а-яё])(?P<words>(?:" + _WORD + r")(?:\s+(?:" + _WORD + r"))*)(?![а-яё])"
+    r"\s*\)?\s*(?P<cur>тенге|руб\w*|долл\w*|евро)?"
+    r"(?:\s*(?P<minor>\d{1,2})\s*(?:тиын\w*|коп\w*|цент\w*))?"
+)
+
+
+@dataclass(frozen=True)
+class Amount:
+    value: str                 # каноническая запись: «-1234567.89», дробь — как в документе
+    currency: Optional[str]    # ISO-код или None
+    start: int = -1
+    end: int = -1
+    words: bool = False        # сумма прописью
+
+    def decimal(self) -> Decimal:
+        return Decimal(self.value)
+
+
+def _negative(text: str, at: int) -> bool:
+    """Минус прямо перед числом и не внутри слова/диапазона («KZ-12», «5-00» — не минус)."""
+    return at > 0 and text[at - 1] in "-−" and (at < 2 or not text[at - 2].isalnum())
+
+
+@lru_cache(maxsize=1 << 16)
+def _canon(tok: str, neg: bool = False) -> Optional[str]:
+    """Токен RE_NUMBER → «1234567.89». Десятичный разделитель — последняя точка/запятая перед 1–2 цифрами."""
+    if tok.isdigit():
+        return ("-" if neg else "") + (tok.lstrip("0") or "0")
+    s = _SPACES.sub("", tok)
+    frac = ""
+    seps = list(_SEPS.finditer(s))
+    if seps and len(s) - seps[-1].end() <= 2:
+        frac = s[seps[-1].end():]
+        s = s[:seps[-1].start()]
+    s = _SEPS.sub("", s).lstrip("0") or "0"
+    if not s.isdigit():
+        return None
+    return ("-" if neg else "") + s + ("." + frac if frac else "")
+
+
+@lru_cache(maxsize=1024)
+def currency_code(s: Optional[str]) -> Optional[str]:
+    """Символ/код/слово валюты → ISO-код («₸», «тенге», «тг.» → KZT, «руб.» → RUB)."""
+    if not s:
+        return None
+    m = RE_CURRENCY.search(s)
+    if not m:
+        return None
+    w = m.group(0).lower().rstrip(".")
+    for k, code in CURRENCY_WORDS.items():
+        if w.startswith(k):
+            return code
+    return None
+
+
+def scan_amounts(text: str) -> Iterator[Amount]:
+    """Все числа строки, с валютой рядом (если есть): «₸ 1 500», «1 500 тенге», «-200,00 руб.»."""
+    text = text or ""
+    for m in RE_NUMBER.finditer(text):
+        a, b = m.span()
+        v = _canon(m.group(0), _negative(text, a))
+        if v is None:
+            continue
+        cur = _RE_CUR_POST.match(text, b) or _RE_CUR_PRE.search(text, max(0, a - 5), a)
+        yield Amount(v, currency_code(cur.group(1)) if cur else None, a, b)
+
+
+def scan_lines(lines: Iterable[str], *, with_currency: bool = True) -> List[Tuple[int, Amount]]:
+    """Кандидаты сумм по строкам OCR: (номер строки, сумма). Строки без цифр не разбираются."""
+    out: List[Tuple[int, Amount]] = []
+    for i, ln in enumerate(lines):
+        if not ln or not any(c.isdigit() for c in ln):
+            continue
+        out.extend((i, a) for a in scan_amounts(ln) if a.currency or not with_currency)
+    return out
+
+
+def words_to_int(s: str) -> Optional[int]:
+    """«один миллион пятьсот тысяч» → 1500000. None, если встретилось не числительное."""
+    total, cur, seen = 0, 0, False
+    for w in s.lower().split():
+        if w in _WORD_VALUES:
+            cur += _WORD_VALUES[w]
+            seen = True
+            continue
+        for stem, scale in _SCALES:
+            if w.startswith(stem):
+                total += (cur or 1) * scale
+                cur, seen = 0, True
+                break
+        else:
+            return None
+    return total + cur if seen else None
+
+
+def words_amounts(text: str) -> List[Amount]:
+    """
+    Суммы прописью: «(один миллион пятьсот тысяч) тенге 00 тиын». Без валюты после слов
+    берутся только записи с «тысяч/миллион…» — иначе «три экземпляра» стало бы суммой.
+    """
+    out: List[Amount] = []
+    for m in RE_WORDS.finditer(text or ""):
+        words, cur = m.group("words"), m.group("cur")
+        if not cur and not any(stem in words.lower() for stem, _ in _SCALES):
+            continue
+        n = words_to_int(words)
+        if n is None:
+            continue
+        v = str(n) + (f".{int(m.group('minor')):02d}" if m.group("minor") else "")
+        out.append(Amount(v, currency_code(cur or ""), m.start("words"), m.end(), words=True))
+    return out
+
+
+@lru_cache(maxsize=1 << 16)
+def parse_number(s: Optional[str]) -> Optional[str]:
+    """
+    Первое число строки в канонической записи: «1.234.567,89» → «1234567.89»,
+    «12 345,67 ₸» → «12345.67», «$1,234.50» → «1234.50». Если цифр нет — сумма прописью.
+    """
+    if not s:
+        return None
+    m = RE_NUMBER.search(s)
+    if m:
+        return _canon(m.group(0), _negative(s, m.start()))
+    w = words_amounts(s)
+    return w[0].value if w else None
+
+
+def parse_amount(s: Optional[str]) -> Optional[Amount]:
+    """Первая сумма строки с валютой (если указана рядом); иначе сумма прописью."""
+    for a in scan_amounts(s or ""):
+        return a
+    w = words_amounts(s or "")
+    return w[0] if w else None
+
+
+def same_amount(a: Optional[str], b: Optional[str]) -> bool:
+    try:
+        return a is not None and b is not None and Decimal(a) == Decimal(b)
+    except InvalidOperation:
+        return False
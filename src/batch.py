@@ -0,0 +1,91 @@
+# src/batch.py
+from __future__ import annotations
+from pathlib import Path, PurePosixPath
+from typing import Any, BinaryIO, Dict, Iterator, List, Sequence, Tuple
+import csv
+import io
+import json
+import zipfile
+
+from src.jobs import Job
+from src.post_validate import validate_batch
+from src.result_store import dumps as pack_results
+
+SUPPORTED_SUFFIXES = {".pdf", ".jpg", ".jpeg", ".png"}
+FIELD_COLUMNS = ["amount", "currency", "date", "iban", "bic", "iin_bin", "invoice_no", "payer", "receiver"]
+
+
+def iter_documents(fileobj: BinaryIO, name: str) -> Iterator[Tuple[str, BinaryIO]]:
+    """
+    Разворачивает загрузку в документы: обычный файл → сам файл,
+    ZIP → поддерживаемые файлы из архива (читаются потоково, без распаковки на диск).
+    """
+    if Path(name).suffix.lower() != ".zip":
+        yield name, fileobj
+        return
+    with zipfile.ZipFile(fileobj) as zf:
+        for info in zf.infolist():
+            member = PurePosixPath(info.filename)
+            if info.is_dir() or member.name.startswith(".") or "__MACOSX" in member.parts:
+                continue
+            if member.suffix.lower() not in SUPPORTED_SUFFIXES:
+                continue
+            with zf.open(info) as fh:
+                yield member.name, fh
+
+
+def job_row(job: Job) -> Dict[str, Any]:
+    """Строка живой таблицы пакета: статус, время, тип и извлечённые поля."""
+    res = job.result or {}
+    fields = res.get("fields") or {}
+    row: Dict[str, Any] = {
+        "file": job.name,
+        "status": job.status,
+        "pages": f"{job.pages_done}/{job.pages_total}" if job.pages_total else "",
+        "time_s": round(job.elapsed, 1) if job.started else None,
+        "docType": res.get("docType", ""),
+    }
+    for k in FIELD_COLUMNS:
+        row[k] = fields.get(k, "")
+    if "validation" in res:
+        failed = [c["rule"] for c in res.get("validation") or [] if not c.get("ok") and not c.get("info")]
+        row["qa"] = ", ".join(failed) if failed else "ok"
+    if job.error:
+        row["error"] = job.error[:200]
+    return row
+
+
+def to_jsonl(jobs: Sequence[Job]) -> str:
+    """Один документ на строку: {"file", "status", "result"} — только завершённые."""
+    lines: List[str] = []
+    for j in jobs:
+        if j.result is None and not j.error:
+            continue
+        rec = {"file": j.name, "status": j.status, "result": j.result, "error": j.error}
+        lines.append(json.dumps(rec, ensure_ascii=False))
+    return "\n".join(lines) + ("\n" if lines else "")
+
+
+def to_ocrpack(jobs: Sequence[Job]) -> bytes:
+    """То же, что to_jsonl, но журналом MessagePack (src/result_store.py): меньше и быстрее читается."""
+    return pack_results([{"file": j.name, "key": j.key, "status": j.status, "result": j.result}
+                         for j in jobs if j.result is not None])
+
+
+def qa_summary(jobs: Sequence[Job]) -> Dict[str, Any]:
+    """Пакетная проверка завершённых документов (src/post_validate.validate_batch) + имена файлов на перепроверку."""
+    done = [j for j in jobs if j.result is not None]
+    rep = validate_batch([j.result for j in done])
+    review = rep.needs_review
+    return {**rep.summary(), "files": [j.name for j, bad in zip(done, review) if bad]}
+
+
+def to_csv(jobs: Sequence[Job]) -> str:
+    """Плоская таблица полей по всем документам пакета."""
+    s = io.StringIO()
+    cols = ["file", "status", "docType", *FIELD_COLUMNS, "qa", "error"]
+    w = csv.DictWriter(s, fieldnames=cols, extrasaction="ignore")
+    w.writeheader()
+    for j in jobs:
+        w.writerow({**job_row(j), "error": j.error or ""})
+    return s.getvalue()
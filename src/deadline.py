@@ -0,0 +1,34 @@
+# src/deadline.py
+from __future__ import annotations
+from typing import Optional
+import math
+import time
+
+
+class Deadline:
+    """
+    Бюджет времени документа. Передаётся по цепочке вызовов: каждый этап берёт
+    таймаут не больше оставшегося и не начинает работу, если времени уже нет.
+    seconds=None — без ограничения.
+    """
+
+    def __init__(self, seconds: Optional[float] = None) -> None:
+        self.at = None if seconds is None else time.monotonic() + max(0.0, seconds)
+
+    def remaining(self) -> float:
+        return math.inf if self.at is None else max(0.0, self.at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def timeout(self, cap: float) -> float:
+        """Таймаут одного вызова: не больше cap и не больше остатка бюджета."""
+        return min(cap, self.remaining())
+
+    def sub(self, seconds: Optional[float]) -> "Deadline":
+        """Вложенный бюджет этапа: не больше seconds и не позже родительского."""
+        child = Deadline(seconds)
+        if self.at is not None and (child.at is None or self.at < child.at):
+            child.at = self.at
+        return child
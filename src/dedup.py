@@ -0,0 +1,388 @@
+# src/dedup.py
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple, Union
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from src.result_store import packb, unpackb
+
+if TYPE_CHECKING:
+    import os
+
+# Дедупликация документов до тяжёлой обработки.
+#
+# Страница → два dHash по миниатюре с обрезанными полями: грубый 64-битный (поиск)
+# и точный 256-битный (подтверждение). Текст OCR → 64-битный simhash по тройкам слов
+# и дайджест последовательности чисел. Поиск — multi-index hashing: 64 бита режутся
+# на 4 полосы по 16; при расстоянии Хэмминга ≤ 3 хотя бы одна полоса совпадает точно,
+# поэтому кандидаты находятся 4 спусками по индексу SQLite — доли миллисекунды и на
+# миллионах хэшей.
+#
+# Миниатюра не отличает пересканированную копию от другой выписки того же шаблона
+# (различаются только числа), поэтому готовый результат отдаётся лишь для того же
+# файла (sha256) или для того же текста с теми же числами — и только если он получен
+# с теми же параметрами пайплайна (params); похожие страницы и похожий текст с другими
+# числами только помечаются.
+
+BANDS = 4
+BAND_BITS = 64 // BANDS
+MAX_DIST = 3           # гарантированный радиус поиска по грубому хэшу/simhash
+FINE_MAX_DIST = 12     # из 256 бит: пересканированная копия или документ того же шаблона
+TEXT_REUSE_DIST = 12   # simhash при совпавших числах: опечатки OCR в коротком документе дают до ~10 бит
+MIN_NUMBERS = 5        # меньше чисел — дайджест ничего не доказывает
+MEMORY_MAX_RESULTS = 256  # ":memory:": сколько последних результатов держать (LRU), отпечатки — все
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    sha256 TEXT,
+    n_pages INTEGER NOT NULL,
+    simhash INTEGER,
+    digits TEXT,
+    params TEXT,             -- дайджест параметров пайплайна, с которыми получен result
+    created REAL,
+    used REAL,               -- последнее обращение к result (вытеснение LRU)
+    result BLOB
+);
+CREATE INDEX IF NOT EXISTS docs_sha ON docs(sha256);
+CREATE INDEX IF NOT EXISTS docs_digits ON docs(digits) WHERE digits IS NOT NULL;
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    doc INTEGER NOT NULL REFERENCES docs(id) ON DELETE CASCADE,
+    pno INTEGER NOT NULL,
+    coarse INTEGER NOT NULL,
+    fine BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_doc ON pages(doc);
+CREATE TABLE IF NOT EXISTS bands (
+    kind INTEGER NOT NULL,   -- 0: страница (pages.id), 1: текст (docs.id)
+    band INTEGER NOT NULL,
+    val INTEGER NOT NULL,
+    ref INTEGER NOT NULL,
+    PRIMARY KEY (kind, band, val, ref)
+) WITHOUT ROWID;
+"""
+
+_WORD = re.compile(r"\w+")
+_DIGITS = re.compile(r"\d+")
+PathLike = Union[str, "os.PathLike[str]"]
+
+
+# --- хэши ---
+def area_resize(gray: np.ndarray, w: int, h: int) -> np.ndarray:
+    """Среднее по прямоугольным ячейкам (как INTER_AREA), без cv2/PIL."""
+    H, W = gray.shape
+    ys = np.linspace(0, H, h + 1).astype(int)[:-1]
+    xs = np.linspace(0, W, w + 1).astype(int)[:-1]
+    s = np.add.reduceat(np.add.reduceat(gray.astype(np.float32), ys, axis=0), xs, axis=1)
+    cnt = np.outer(np.diff(np.append(ys, H)), np.diff(np.append(xs, W)))
+    return s / cnt
+
+
+def page_thumb(img: np.ndarray, side: int = 256) -> np.ndarray:
+    """Серая миниатюра с обрезанными белыми полями: сдвиг скана на поле не меняет хэш."""
+    gray = img if img.ndim == 2 else img[..., :3].mean(axis=2)
+    H, W = gray.shape
+    k = max(1, int(max(H, W) / side))
+    small = area_resize(gray, max(1, W // k), max(1, H // k)) if k > 1 else gray.astype(np.float32)
+    ink = small < 200
+    rows, cols = np.flatnonzero(ink.any(axis=1)), np.flatnonzero(ink.any(axis=0))
+    if len(rows) > 1 and len(cols) > 1:
+        small = small[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    return small
+
+
+def dhash_bits(thumb: np.ndarray, size: int) -> np.ndarray:
+    """dHash: знак горизонтального градиента на сетке size×size → size² бит."""
+    if thumb.shape[0] < size or thumb.shape[1] < size + 1:
+        thumb = np.kron(thumb, np.ones((size, size + 1), dtype=thumb.dtype))  # крошечная страница
+    g = area_resize(thumb, size + 1, size)
+    return (g[:, 1:] > g[:, :-1]).ravel()
+
+
+def _to_int64(bits: np.ndarray) -> int:
+    """64 бита → знаковое целое (SQLite INTEGER)."""
+    return int(np.packbits(bits).view(">i8")[0])
+
+
+def page_hashes(img: np.ndarray) -> Tuple[int, bytes]:
+    """(грубый 64-битный dHash, точный 256-битный dHash) страницы."""
+    t = page_thumb(img)
+    return _to_int64(dhash_bits(t, 8)), np.packbits(dhash_bits(t, 16)).tobytes()
+
+
+def simhash(text: str, *, shingle: int = 3) -> Optional[int]:
+    """64-битный simhash текста по тройкам слов (цифры остаются: выписки одного шаблона различаются ими)."""
+    words = _WORD.findall((text or "").casefold())
+    if not words:
+        return None
+    grams = [" ".join(words[i:i + shingle]) for i in range(max(1, len(words) - shingle + 1))]
+    digests = b"".join(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest() for g in grams)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(len(grams), 64)
+    return _to_int64(bits.sum(axis=0) * 2 > len(grams))
+
+
+def digits_digest(text: str) -> Optional[str]:
+    """Дайджест всех чисел текста по порядку: суммы, IBAN, даты. Одна цифра иначе — другой документ."""
+    nums = _DIGITS.findall(text or "")
+    if len(nums) < MIN_NUMBERS:
+        return None
+    return hashlib.blake2b(" ".join(nums).encode("ascii"), digest_size=16).hexdigest()
+
+
+def hamming(a: int, b: int) -> int:
+    return ((a ^ b) & 0xFFFFFFFFFFFFFFFF).bit_count()
+
+
+def hamming_bytes(a: bytes, b: bytes) -> int:
+    return int(np.unpackbits(np.frombuffer(a, np.uint8) ^ np.frombuffer(b, np.uint8)).sum())
+
+
+def _bands(h: int) -> List[int]:
+    u = h & 0xFFFFFFFFFFFFFFFF
+    return [(u >> (BAND_BITS * i)) & ((1 << BAND_BITS) - 1) for i in range(BANDS)]
+
+
+def file_sha256(path: PathLike) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@dataclass
+class Fingerprint:
+    sha256: Optional[str]
+    pages: List[Tuple[int, bytes]]
+    simhash: Optional[int] = None
+    digits: Optional[str] = None
+
+    def set_text(self, text: str) -> None:
+        self.simhash, self.digits = simhash(text), digits_digest(text)
+
+
+@dataclass
+class Match:
+    key: str
+    kind: str                       # "file" | "pages" | "text"
+    distance: List[int] = field(default_factory=list)  # по страницам (точный хэш) или [simhash]
+    same_digits: bool = False       # для "text": все числа документа совпали
+    same_params: bool = True        # найденный результат получен с теми же параметрами пайплайна
+    result: Optional[Dict[str, Any]] = None
+
+    @property
+    def reusable(self) -> bool:
+        """Можно отдать готовый результат: тот же файл или тот же текст с теми же числами и параметрами."""
+        return self.same_params and (self.kind == "file" or (self.kind == "text" and self.same_digits))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"key": self.key, "kind": self.kind, "distance": self.distance, "same_digits": self.same_digits,
+                "same_params": self.same_params}
+
+
+def fingerprint(pages: Sequence[np.ndarray], *, sha256: Optional[str] = None) -> Fingerprint:
+    return Fingerprint(sha256=sha256, pages=[page_hashes(p) for p in pages])
+
+
+class DedupIndex:
+    """
+    Индекс отпечатков обработанных документов (SQLite; ":memory:" — на время процесса).
+    Хранит результат (MessagePack + zlib), чтобы дубликат мог вернуть его без OCR и LLM.
+    Результатов хранится не больше max_results (давно не использованные вытесняются,
+    отпечатки остаются — дубликат по-прежнему помечается); по умолчанию для ":memory:"
+    это MEMORY_MAX_RESULTS, для файла — без ограничения (0).
+
+        fp = fingerprint(pages, sha256=file_sha256(path))
+        m = idx.find_pages(fp, params=p)   # тот же файл (с результатом при тех же params) или похожие страницы
+        fp.set_text(ocr_text)
+        t = idx.find_text(fp, params=p)    # тот же текст: с теми же числами и params — с результатом
+        idx.add(key, fp, result, params=p)
+
+    params — дайджест параметров пайплайна (src.uploads.params_digest): результат,
+    полученный с другим порогом, профилем препроцессинга или подсказкой типа, не отдаётся.
+    """
+
+    def __init__(self, path: PathLike = ":memory:", *, store_results: bool = True,
+                 max_results: Optional[int] = None) -> None:
+        self.path = str(path)
+        self.store_results = store_results
+        self.max_results = (MEMORY_MAX_RESULTS if self.path == ":memory:" else 0) if max_results is None else max_results
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        if self.path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        """Столбцы, добавленные после первых версий схемы (старые файлы DEDUP_DB)."""
+        cols = {r[1] for r in self._db.execute("PRAGMA table_info(docs)")}
+        for name, decl in (("params", "TEXT"), ("used", "REAL")):
+            if name not in cols:
+                self._db.execute(f"ALTER TABLE docs ADD COLUMN {name} {decl}")
+
+    # --- запись ---
+    def add(self, key: str, fp: Fingerprint, result: Optional[Dict[str, Any]] = None, *,
+            params: Optional[str] = None) -> int:
+        blob = zlib.compress(packb(result), 3) if result is not None and self.store_results else None
+        now = time.time()
+        with self._lock:
+            db = self._db
+            db.execute("BEGIN")
+            try:
+                self._remove(key)
+                doc = db.execute(
+                    "INSERT INTO docs(key, sha256, n_pages, simhash, digits, params, created, used, result) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, fp.sha256, len(fp.pages), fp.simhash, fp.digits, params, now, now, blob)).lastrowid
+                bands: List[Tuple[int, int, int, int]] = []
+                for pno, (coarse, fine) in enumerate(fp.pages):
+                    pid = db.execute("INSERT INTO pages(doc, pno, coarse, fine) VALUES (?, ?, ?, ?)",
+                                     (doc, pno, coarse, fine)).lastrowid
+                    bands.extend((0, b, v, pid) for b, v in enumerate(_bands(coarse)))
+                if fp.simhash is not None:
+                    bands.extend((1, b, v, doc) for b, v in enumerate(_bands(fp.simhash)))
+                db.executemany("INSERT OR IGNORE INTO bands(kind, band, val, ref) VALUES (?, ?, ?, ?)", bands)
+                if blob is not None and self.max_results > 0:
+                    db.execute("UPDATE docs SET result = NULL WHERE id IN (SELECT id FROM docs WHERE result IS NOT NULL "
+                               "ORDER BY used DESC, id DESC LIMIT -1 OFFSET ?)", (self.max_results,))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return doc
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._remove(key)
+            self._db.execute("COMMIT")
+
+    def _remove(self, key: str) -> None:
+        # полосы не связаны внешним ключом (ref — то страница, то документ), чистим явно
+        db = self._db
+        row = db.execute("SELECT id FROM docs WHERE key = ?", (key,)).fetchone()
+        if not row:
+            return
+        pids = [(r[0],) for r in db.execute("SELECT id FROM pages WHERE doc = ?", row)]
+        db.executemany("DELETE FROM bands WHERE kind = 0 AND ref = ?", pids)
+        db.execute("DELETE FROM bands WHERE kind = 1 AND ref = ?", row)
+        db.execute("DELETE FROM docs WHERE id = ?", row)
+
+    # --- поиск ---
+    def _candidates(self, kind: int, h: int) -> List[int]:
+        q = "SELECT ref FROM bands WHERE kind = ? AND band = ? AND val = ?"
+        refs: Dict[int, None] = {}
+        for b, v in enumerate(_bands(h)):
+            for (ref,) in self._db.execute(q, (kind, b, v)):
+                refs[ref] = None
+        return list(refs)
+
+    def _result(self, doc: int) -> Optional[Dict[str, Any]]:
+        row = self._db.execute("SELECT result FROM docs WHERE id = ?", (doc,)).fetchone()
+        if not row or row[0] is None:
+            return None
+        self._db.execute("UPDATE docs SET used = ? WHERE id = ?", (time.time(), doc))
+        return unpackb(zlib.decompress(row[0]))
+
+    def find_pages(self, fp: Fingerprint, *, params: Optional[str] = None, fine_max: int = FINE_MAX_DIST,
+                   with_result: bool = True) -> Optional[Match]:
+        """
+        Документ с тем же файлом (sha256; результат — только если он получен с теми же params)
+        или с похожими страницами: столько же страниц, каждая в радиусе MAX_DIST по грубому
+        хэшу и fine_max по точному (без результата).
+        """
+        if not fp.pages:
+            return None
+        with self._lock:
+            if fp.sha256:
+                rows = self._db.execute("SELECT id, key, params FROM docs WHERE sha256 = ? ORDER BY id DESC",
+                                        (fp.sha256,)).fetchall()
+                if rows:
+                    same = [r for r in rows if r[2] == params]
+                    doc, key, _ = (same or rows)[0]
+                    return Match(key, "file", [0] * len(fp.pages), same_params=bool(same),
+                                 result=self._result(doc) if with_result and same else None)
+            # кандидаты по первой странице, затем проверка остальных страниц того же документа
+            coarse0, fine0 = fp.pages[0]
+            cands = self._candidates(0, coarse0)
+            if not cands:
+                return None
+            q = (f"SELECT p.doc, d.key, p.coarse, p.fine FROM pages p JOIN docs d ON d.id = p.doc "
+                 f"WHERE p.id IN ({','.join('?' * len(cands))}) AND p.pno = 0 AND d.n_pages = ?")
+            best: Optional[Tuple[int, int, str, List[int]]] = None
+            for doc, key, coarse, fine in self._db.execute(q, (*cands, len(fp.pages))).fetchall():
+                if hamming(coarse, coarse0) > MAX_DIST or hamming_bytes(fine, fine0) > fine_max:
+                    continue
+                dists = [hamming_bytes(fine, fine0)]
+                rest = self._db.execute("SELECT coarse, fine FROM pages WHERE doc = ? AND pno > 0 ORDER BY pno",
+                                        (doc,)).fetchall()
+                for (c, f), (c2, f2) in zip(rest, fp.pages[1:]):
+                    d = hamming_bytes(f, f2)
+                    if hamming(c, c2) > MAX_DIST or d > fine_max:
+                        break
+                    dists.append(d)
+                else:
+                    if best is None or sum(dists) < best[0]:
+                        best = (sum(dists), doc, key, dists)
+            if best is None:
+                return None
+            return Match(best[2], "pages", best[3])
+
+    def find_text(self, fp: Fingerprint, *, exclude: Optional[str] = None, params: Optional[str] = None,
+                  with_result: bool = True) -> Optional[Match]:
+        """
+        Тот же текст в другом файле (записи с тем же sha256 и ключом exclude пропускаются).
+        Сначала точный поиск по дайджесту чисел (индекс) с мягким порогом simhash — это тот
+        же документ, результат отдаётся, если он получен с теми же params. Иначе — ближайший
+        по simhash в радиусе MAX_DIST (полосы) без результата: похожий документ, только пометка.
+        """
+        if fp.simhash is None:
+            return None
+
+        def other(key: str, sha: Optional[str]) -> bool:
+            return key != exclude and not (fp.sha256 and sha == fp.sha256)
+
+        with self._lock:
+            if fp.digits:
+                rows = self._db.execute("SELECT id, key, sha256, simhash, params FROM docs WHERE digits = ? "
+                                        "ORDER BY id DESC LIMIT 16", (fp.digits,)).fetchall()
+                near = [r for r in rows if other(r[1], r[2]) and r[3] is not None
+                        and hamming(r[3], fp.simhash) <= TEXT_REUSE_DIST]
+                if near:
+                    same = [r for r in near if r[4] == params]
+                    doc, key, _, h, _ = (same or near)[0]
+                    return Match(key, "text", [hamming(h, fp.simhash)], same_digits=True, same_params=bool(same),
+                                 result=self._result(doc) if with_result and same else None)
+            cands = self._candidates(1, fp.simhash)
+            if not cands:
+                return None
+            q = f"SELECT key, sha256, simhash FROM docs WHERE id IN ({','.join('?' * len(cands))})"
+            scored = [(hamming(h, fp.simhash), key) for key, sha, h in self._db.execute(q, cands)
+                      if h is not None and other(key, sha)]
+            scored = [x for x in scored if x[0] <= MAX_DIST]
+        if not scored:
+            return None
+        d, key = min(scored)
+        return Match(key, "text", [d])
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            one = lambda sql: self._db.execute(sql).fetchone()[0]  # noqa: E731
+            return {"docs": one("SELECT count(*) FROM docs"), "pages": one("SELECT count(*) FROM pages"),
+                    "results": one("SELECT count(*) FROM docs WHERE result IS NOT NULL")}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,336 @@
+# src/doc_classifier.py
+from __future__ import annotations
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+import zlib
+
+import numpy as np
+
+from src.amounts import RE_NUMBER
+from src.dedup import area_resize, page_thumb
+from src.result_store import iter_results
+
+# Тип документа по дешёвым признакам первой страницы — за миллисекунды, без нейросети:
+#   ключевые слова OCR (отдельно — в шапке страницы), хешированный мешок слов,
+#   статистика разметки (строки, цифры, колонки, пропорции) и миниатюра (плотность
+#   «чернил» 4×4). Модель — многоклассовая логистическая регрессия на numpy,
+#   обучается локально по готовым результатам (python -m src.doc_classifier train).
+# Без обученной модели работает априорная: веса только на ключевых словах.
+# Неуверенные случаи (ниже DOC_CLASSIFIER_MIN_CONF) конвейер может отдать Donut.
+
+DOC_TYPES: Tuple[str, ...] = ("receipt", "statement", "contract")
+FEATURES_VERSION = 1
+
+# Ключевое слово → тип, за который оно «голосует» в априорной модели
+KEYWORDS: Dict[str, Tuple[str, str]] = {
+    "договор": (r"договор", "contract"),
+    "стороны": (r"сторон[аыуе]\b|именуем", "contract"),
+    "предмет": (r"предмет\s+договора", "contract"),
+    "обязанности": (r"обязанност|ответственност", "contract"),
+    "подписи": (r"подписи\s+сторон|реквизиты\s+(?:и\s+подписи\s+)?сторон", "contract"),
+    "срок": (r"срок\s+действия|вступает\s+в\s+силу|расторжен", "contract"),
+    "выписка": (r"выписк", "statement"),
+    "остаток": (r"остаток|сальдо", "statement"),
+    "дебет": (r"дебет", "statement"),
+    "кредит": (r"\bкредит\b", "statement"),
+    "оборот": (r"оборот", "statement"),
+    "период": (r"за\s+период|период\s+с\b|с\s+\d{2}\.\d{2}\.\d{4}\s+по\b", "statement"),
+    "лицевой": (r"лицево[гй]\w*\s+сч[её]т|номер\s+сч[её]та", "statement"),
+    "чек": (r"\bчек\b", "receipt"),
+    "кассовый": (r"кассов", "receipt"),
+    "фискальный": (r"фискальн|\bккм\b|\bзнм\b|\bрнм\b|\bофд\b", "receipt"),
+    "итого": (r"итого", "receipt"),
+    "оплата": (r"наличн|сдача|безналичн|банковская\s+карта", "receipt"),
+    "счёт_на_оплату": (r"сч[её]т\s+на\s+оплату|сч[её]т-фактур", "receipt"),
+    "квитанция": (r"квитанц", "receipt"),
+    "платёж": (r"плат[её]жн\w*\s+поручени|перевод", "receipt"),
+}
+_KW = [(k, re.compile(rx, re.I), t) for k, (rx, t) in KEYWORDS.items()]
+_WORD = re.compile(r"[^\W\d_]{3,}")
+HASH_DIM = 256
+N_LAYOUT = 10
+N_THUMB = 19
+TITLE_SHARE = 0.2  # «шапка» — верхние 20% страницы
+
+
+@dataclass
+class Prediction:
+    doc_type: str
+    confidence: float
+    probs: Dict[str, float] = field(default_factory=dict)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"type": self.doc_type, "confidence": round(self.confidence, 3),
+                "probs": {k: round(v, 3) for k, v in self.probs.items()}}
+
+
+def thumb_features(img: np.ndarray) -> List[float]:
+    """Плотность «чернил» 4×4 по содержимому (без белых полей), общая плотность, пропорции страницы и содержимого."""
+    H, W = img.shape[:2]
+    step = max(1, max(H, W) // 512)  # прореживание до серого: полный скан в float — сотни мс
+    t = page_thumb(img[::step, ::step], side=128)
+    ink = 1.0 - area_resize(t, 4, 4) / 255.0
+    out = ink.ravel().tolist() + [
+        1.0 - float(t.mean()) / 255.0,
+        float(np.log(max(H, 1) / max(W, 1))),
+        float(np.log(t.shape[0] / max(t.shape[1], 1))),
+    ]
+    return [round(v, 3) for v in out]
+
+
+def _page_size(items: Sequence[Dict[str, Any]], size: Optional[Sequence[int]]) -> Tuple[float, float]:
+    if size:
+        return float(size[0]) or 1.0, float(size[1]) or 1.0
+    boxes = [o["bbox"] for o in items if o.get("bbox")]
+    if not boxes:
+        return 1.0, 1.0
+    return float(max(b[2] for b in boxes)) or 1.0, float(max(b[3] for b in boxes)) or 1.0
+
+
+def features(items: Sequence[Dict[str, Any]], size: Optional[Sequence[int]] = None,
+             thumb: Optional[Sequence[float]] = None) -> np.ndarray:
+    """
+    Вектор признаков по строкам OCR первой страницы (text/bbox/conf, как в debug.ocr),
+    размеру страницы (w, h) и thumb_features(). Без size он оценивается по bbox,
+    без миниатюры её признаки нулевые (последний признак — флаг «миниатюра есть»).
+    """
+    W, H = _page_size(items, size)
+    texts = [str(o.get("text") or "") for o in items]
+    text = "\n".join(texts)
+    title = "\n".join(t for o, t in zip(items, texts) if o.get("bbox") and o["bbox"][1] < TITLE_SHARE * H) \
+        or "\n".join(texts[:5])
+
+    kw = np.array([len(rx.findall(text)) for _, rx, _ in _KW], dtype=np.float32)
+    kw_title = np.array([1.0 if rx.search(title) else 0.0 for _, rx, _ in _KW], dtype=np.float32)
+
+    bow = np.zeros(HASH_DIM, dtype=np.float32)
+    for w in _WORD.findall(text.lower()):
+        bow[zlib.crc32(w.encode("utf-8")) % HASH_DIM] += 1.0
+    bow = np.log1p(bow)
+    nrm = float(np.linalg.norm(bow))
+    if nrm:
+        bow /= nrm
+
+    n = len(items)
+    boxes = np.array([o["bbox"] for o in items if o.get("bbox")], dtype=np.float32).reshape(-1, 4)
+    layout = np.zeros(N_LAYOUT, dtype=np.float32)
+    if n:
+        chars = sum(len(t) for t in texts)
+        layout[0] = np.log1p(n)
+        layout[1] = chars / n / 40.0
+        layout[2] = sum(any(c.isdigit() for c in t) for t in texts) / n
+        layout[3] = sum(bool(RE_NUMBER.search(t)) and ("," in t or "." in t) for t in texts) / n
+        layout[4] = float(np.mean([o.get("conf") or 0.0 for o in items]))
+        letters = [c for c in text if c.isalpha()]
+        layout[5] = sum(c.isupper() for c in letters) / max(1, len(letters))
+    if len(boxes):
+        layout[6] = float(np.mean(boxes[:, 2] - boxes[:, 0])) / W
+        layout[7] = float(boxes[:, 3].max() - boxes[:, 1].min()) / H
+        layout[8] = len(np.unique((boxes[:, 0] / W * 10).astype(int))) / 10.0  # «колонки» по левым краям
+        layout[9] = float(np.log(H / W))
+
+    th = np.zeros(N_THUMB + 1, dtype=np.float32)
+    if thumb is not None and len(thumb) == N_THUMB:
+        th[:N_THUMB] = thumb
+        th[N_THUMB] = 1.0
+    return np.concatenate([np.log1p(kw), kw_title, bow, layout, th])
+
+
+N_FEATURES = 2 * len(KEYWORDS) + HASH_DIM + N_LAYOUT + N_THUMB + 1
+
+
+def _softmax(z: np.ndarray) -> np.ndarray:
+    z = z - z.max(axis=-1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+class DocClassifier:
+    """Логистическая регрессия: softmax((x - mean) / std · W + b)."""
+
+    def __init__(self, classes: Sequence[str], W: np.ndarray, b: np.ndarray,
+                 mean: Optional[np.ndarray] = None, std: Optional[np.ndarray] = None, *, trained: bool = True) -> None:
+        self.classes = list(classes)
+        self.W = W.astype(np.float32)
+        self.b = b.astype(np.float32)
+        self.mean = np.zeros(W.shape[0], np.float32) if mean is None else mean.astype(np.float32)
+        self.std = np.ones(W.shape[0], np.float32) if std is None else std.astype(np.float32)
+        self.trained = trained
+
+    @classmethod
+    def prior(cls) -> "DocClassifier":
+        """Без обучения: каждое ключевое слово голосует за свой тип, в шапке — сильнее."""
+        W = np.zeros((N_FEATURES, len(DOC_TYPES)), np.float32)
+        k = len(KEYWORDS)
+        for i, (_, _, t) in enumerate(_KW):
+            W[i, DOC_TYPES.index(t)] = 1.5
+            W[k + i, DOC_TYPES.index(t)] = 2.0
+        b = np.array([0.3 if t == "receipt" else 0.0 for t in DOC_TYPES], np.float32)
+        return cls(DOC_TYPES, W, b, trained=False)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "DocClassifier":
+        with np.load(path, allow_pickle=False) as z:
+            if int(z["version"]) != FEATURES_VERSION or z["W"].shape[0] != N_FEATURES:
+                raise ValueError(f"{path}: модель для другой версии признаков, переобучите")
+            return cls([str(c) for c in z["classes"]], z["W"], z["b"], z["mean"], z["std"])
+
+    def save(self, path: str | Path) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(path, version=FEATURES_VERSION, classes=np.array(self.classes),
+                            W=self.W, b=self.b, mean=self.mean, std=self.std)
+
+    def proba(self, X: np.ndarray) -> np.ndarray:
+        return _softmax(((X - self.mean) / self.std) @ self.W + self.b)
+
+    def predict_features(self, x: np.ndarray) -> Prediction:
+        p = self.proba(x[None, :])[0]
+        i = int(p.argmax())
+        return Prediction(self.classes[i], float(p[i]), dict(zip(self.classes, p.tolist())))
+
+    def predict(self, items: Sequence[Dict[str, Any]], size: Optional[Sequence[int]] = None,
+                thumb: Optional[Sequence[float]] = None) -> Prediction:
+        return self.predict_features(features(items, size, thumb))
+
+    @classmethod
+    def fit(cls, X: np.ndarray, y: Sequence[str], *, l2: float = 1e-3, epochs: int = 400,
+            lr: float = 0.5) -> "DocClassifier":
+        """Полный градиентный спуск по кросс-энтропии; на тысячах документов — секунды."""
+        classes = sorted(set(y))
+        Y = np.eye(len(classes), dtype=np.float32)[[classes.index(t) for t in y]]
+        mean = X.mean(axis=0)
+        std = X.std(axis=0)
+        std[std < 1e-6] = 1.0
+        Xs = (X - mean) / std
+        W = np.zeros((X.shape[1], len(classes)), np.float32)
+        b = np.zeros(len(classes), np.float32)
+        # веса классов обратно частоте: редкий тип не тонет в чеках
+        cw = (len(y) / (len(classes) * Y.sum(axis=0)))[None, :]
+        for _ in range(epochs):
+            G = (_softmax(Xs @ W + b) - Y) * (Y * cw).sum(axis=1, keepdims=True) / len(y)
+            W -= lr * (Xs.T @ G + l2 * W)
+            b -= lr * G.sum(axis=0)
+        return cls(classes, W, b, mean, std)
+
+
+def load_default() -> DocClassifier:
+    """DOC_CLASSIFIER (по умолчанию models/doc_classifier.npz), если файла нет — априорная модель."""
+    path = os.getenv("DOC_CLASSIFIER", "models/doc_classifier.npz")
+    if Path(path).exists():
+        try:
+            return DocClassifier.load(path)
+        except Exception as e:
+            logging.warning("DocClassifier %s не загружен (%s), работает априорная модель", path, e)
+    return DocClassifier.prior()
+
+
+# --- обучение по готовым результатам ---
+
+def example(result: Dict[str, Any]) -> Optional[np.ndarray]:
+    """Признаки из сохранённого результата: debug.ocr первой непустой страницы + meta.doc_class."""
+    pages = (result.get("debug") or {}).get("ocr") or []
+    dc = (result.get("meta") or {}).get("doc_class") or {}
+    page = dc.get("page")
+    items = pages[page] if isinstance(page, int) and page < len(pages) else next((p for p in pages if p), None)
+    if not items:
+        return None
+    return features(items, dc.get("size"), dc.get("thumb"))
+
+
+def _labels(path: Optional[str]) -> Dict[str, str]:
+    if not path:
+        return {}
+    p = Path(path)
+    if p.suffix.lower() == ".json":
+        return {Path(k).name: v for k, v in json.loads(p.read_text(encoding="utf-8")).items()}
+    with p.open(encoding="utf-8", newline="") as f:
+        return {Path(r[0]).name: r[1].strip() for r in csv.reader(f) if len(r) >= 2}
+
+
+def dataset(paths: Sequence[str], labels: Optional[Dict[str, str]] = None,
+            trust_doctype: bool = False) -> Tuple[np.ndarray, List[str], List[str]]:
+    """
+    (X, y, имена) из JSON/JSONL/.ocrpack. Метка — из labels (по имени файла или ключу),
+    иначе docType, если он задан вручную (meta.doc_class.source == "hint"),
+    с trust_doctype — любой docType.
+    """
+    labels = labels or {}
+    X: List[np.ndarray] = []
+    y: List[str] = []
+    names: List[str] = []
+    for res, key, file in iter_results(paths):
+        name = Path(file).name if file else key
+        label = labels.get(name) or labels.get(key)
+        if label is None:
+            src = ((res.get("meta") or {}).get("doc_class") or {}).get("source")
+            if src == "hint" or trust_doctype:
+                label = res.get("docType")
+        x = example(res) if label else None
+        if x is not None:
+            X.append(x)
+            y.append(label)
+            names.append(name)
+    return (np.stack(X) if X else np.zeros((0, N_FEATURES), np.float32)), y, names
+
+
+def evaluate(model: DocClassifier, X: np.ndarray, y: Sequence[str]) -> Dict[str, Any]:
+    pred = [model.classes[i] for i in model.proba(X).argmax(axis=1)] if len(y) else []
+    confusion: Dict[str, Dict[str, int]] = {}
+    for t, p in zip(y, pred):
+        confusion.setdefault(t, {}).setdefault(p, 0)
+        confusion[t][p] += 1
+    return {"n": len(y), "accuracy": round(sum(t == p for t, p in zip(y, pred)) / max(1, len(y)), 3),
+            "confusion": confusion}
+
+
+def _split(n: int, holdout: float, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    idx = np.random.default_rng(seed).permutation(n)
+    k = int(round(n * holdout))
+    return idx[k:], idx[:k]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.doc_classifier",
+                                 description="Классификатор типа документа: обучение и проверка")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name, hlp in (("train", "обучить по результатам и сохранить"), ("eval", "точность модели на результатах")):
+        p = sub.add_parser(name, help=hlp)
+        p.add_argument("paths", nargs="+", help="JSON/JSONL/.ocrpack")
+        p.add_argument("--labels", help="CSV «файл,тип» или JSON {файл: тип}")
+        p.add_argument("--trust-doctype", action="store_true", help="брать любой docType как метку")
+        p.add_argument("--model", default=None, help="путь к .npz (по умолчанию DOC_CLASSIFIER)")
+    sub.choices["train"].add_argument("--holdout", type=float, default=0.2)
+    a = ap.parse_args(argv)
+
+    model_path = a.model or os.getenv("DOC_CLASSIFIER", "models/doc_classifier.npz")
+    X, y, _ = dataset(a.paths, _labels(a.labels), a.trust_doctype)
+    if len(set(y)) < (1 if a.cmd == "eval" else 2):
+        print("мало размеченных документов (нужно ≥2 типов; см. --labels / --trust-doctype)", file=sys.stderr)
+        return 1
+    if a.cmd == "eval":
+        model = DocClassifier.load(model_path) if Path(model_path).exists() else DocClassifier.prior()
+        out: Dict[str, Any] = evaluate(model, X, y)
+    else:
+        tr, te = _split(len(y), a.holdout)
+        yt = [y[i] for i in tr]
+        out = {"prior": evaluate(DocClassifier.prior(), X[te], [y[i] for i in te])}
+        if len(te) and len(set(yt)) > 1:
+            out["holdout"] = evaluate(DocClassifier.fit(X[tr], yt), X[te], [y[i] for i in te])
+        model = DocClassifier.fit(X, y)  # итоговая модель — на всех данных
+        model.save(model_path)
+        out["saved"] = model_path
+    json.dump(out, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
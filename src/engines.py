@@ -0,0 +1,178 @@
+# src/engines.py
+from __future__ import annotations
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Iterator, Optional
+import logging
+import os
+import queue
+import threading
+import time
+
+from src.ocr_paddle import PaddleEngine
+from src.post_llm import LLMClient
+from src.post_ocr_corrector import PostCorrector
+from src.dedup import DedupIndex
+from src.doc_classifier import DocClassifier, load_default
+
+if TYPE_CHECKING:
+    from src.vt_donut import DonutEngine
+
+
+def available_memory_mb() -> Optional[float]:
+    """Свободная память (MemAvailable) в МБ; None — если узнать нельзя."""
+    try:
+        with open("/proc/meminfo", "r", encoding="ascii") as fh:
+            for line in fh:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+class PaddlePool:
+    """
+    Ограниченный пул экземпляров PaddleEngine.
+
+    Предиктор Paddle не потокобезопасен, поэтому одновременных инференсов ровно столько,
+    сколько экземпляров (OCR_PADDLE_INSTANCES, по умолчанию 1); остальные запросы ждут
+    в очереди. Ядра делятся между экземплярами (cpu_threads), чтобы суммарно не
+    превышать число ядер. Экземпляры создаются лениво.
+    """
+
+    def __init__(self, size: int, *, lang: str = "ru") -> None:
+        self.size = max(1, size)
+        self.lang = lang
+        cores = os.cpu_count() or 1
+        self.cpu_threads = max(1, cores // self.size)
+        self._free: "queue.Queue[PaddleEngine]" = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.waiting = 0
+
+    def _maybe_grow(self) -> None:
+        with self._lock:
+            if self._created >= self.size or not self._free.empty():
+                return
+            self._created += 1
+        try:
+            self._free.put(PaddleEngine(lang=self.lang, cpu_threads=self.cpu_threads))
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def warm(self) -> None:
+        """Создать первый экземпляр заранее (загрузка моделей при старте сервера)."""
+        self._maybe_grow()
+
+    @contextmanager
+    def acquire(self, timeout: Optional[float] = None) -> Iterator[PaddleEngine]:
+        self._maybe_grow()
+        with self._lock:
+            self.waiting += 1
+        try:
+            eng = self._free.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("Нет свободного экземпляра PaddleOCR") from None
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        try:
+            yield eng
+        finally:
+            self._free.put(eng)
+
+
+class MemoryAdmission:
+    """
+    Допуск документов в обработку по свободной памяти.
+    Если свободно меньше min_free_mb — новый документ ждёт (не больше max_wait),
+    уже идущие при этом не трогаем. В одновременной обработке — не больше max_docs.
+    """
+
+    def __init__(self, min_free_mb: float, max_docs: int, *, poll: float = 0.5, max_wait: float = 300.0) -> None:
+        self.min_free_mb = min_free_mb
+        self._slots = threading.BoundedSemaphore(max(1, max_docs))
+        self.poll = poll
+        self.max_wait = max_wait
+
+    @contextmanager
+    def admit(self) -> Iterator[None]:
+        deadline = time.monotonic() + self.max_wait
+        if not self._slots.acquire(timeout=self.max_wait):
+            raise TimeoutError("Очередь документов переполнена")
+        try:
+            while True:
+                free = available_memory_mb()
+                if free is None or free >= self.min_free_mb or time.monotonic() >= deadline:
+                    if free is not None and free < self.min_free_mb:
+                        logging.warning("Admitting document with low memory: %.0f MB free", free)
+                    break
+                time.sleep(self.poll)
+            yield
+        finally:
+            self._slots.release()
+
+
+@dataclass
+class Engines:
+    paddle: PaddlePool
+    donut_lock: threading.Lock
+    llm: LLMClient
+    corrector: PostCorrector
+    admission: MemoryAdmission
+    classifier: DocClassifier
+    classifier_min_conf: float = 0.6
+    donut_fallback: bool = True
+    donut: Optional[DonutEngine] = None
+    dedup: Optional[DedupIndex] = None
+
+    def get_donut(self) -> DonutEngine:
+        """Donut (torch + transformers) грузится при первом неуверенном документе, а не на старте."""
+        with self.donut_lock:
+            if self.donut is None:
+                from src.vt_donut import DonutEngine
+                self.donut = DonutEngine()
+            return self.donut
+
+
+_engines: Optional[Engines] = None
+_engines_lock = threading.Lock()
+
+
+def get_engines() -> Engines:
+    """
+    Общие «тёплые» движки на процесс: модели загружаются один раз и делятся между
+    всеми вызовами run_pipeline (и всеми сессиями Streamlit).
+    Настройки: OCR_PADDLE_INSTANCES, OCR_BACKEND (paddle | onnx | openvino), OCR_MAX_DOCS, OCR_MIN_FREE_MB, DEDUP_MODE, DEDUP_DB,
+    DEDUP_MAX_RESULTS, DOC_CLASSIFIER, DOC_CLASSIFIER_MIN_CONF, DOC_TYPE_FALLBACK (donut | none).
+    """
+    global _engines
+    if _engines is None:
+        with _engines_lock:
+            if _engines is None:
+                paddle = PaddlePool(int(os.getenv("OCR_PADDLE_INSTANCES", "1")), lang="ru")
+                paddle.warm()
+                _engines = Engines(
+                    paddle=paddle,
+                    donut_lock=threading.Lock(),
+                    classifier=load_default(),
+                    classifier_min_conf=float(os.getenv("DOC_CLASSIFIER_MIN_CONF", "0.6")),
+                    donut_fallback=os.getenv("DOC_TYPE_FALLBACK", "donut") == "donut",
+                    llm=LLMClient(),
+                    corrector=PostCorrector(enable_headings=True, enable_terms=True),
+                    admission=MemoryAdmission(
+                        min_free_mb=float(os.getenv("OCR_MIN_FREE_MB", "1024")),
+                        max_docs=int(os.getenv("OCR_MAX_DOCS", str(max(2, os.cpu_count() or 1)))),
+                    ),
+                    dedup=(None if os.getenv("DEDUP_MODE", "reuse") == "off"
+                           else DedupIndex(os.getenv("DEDUP_DB", ":memory:"),
+                                           max_results=int(os.environ["DEDUP_MAX_RESULTS"])
+                                           if os.getenv("DEDUP_MAX_RESULTS") else None)),
+                )
+    return _engines
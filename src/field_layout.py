@@ -0,0 +1,147 @@
+# src/field_layout.py
+from __future__ import annotations
+from datetime import date
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import re
+
+from src.field_rules import RE_NOT_TOTAL, FieldCandidate, parse_value
+
+Box = Tuple[int, int, int, int]
+
+# Метки полей: ищутся в начале строки OCR, значение — остаток строки, бокс справа или строка ниже
+LABELS: Dict[str, re.Pattern] = {
+    # голое «сумма» не метка итога: «Сумма НДС», «Сумма скидки» стоят рядом с «Итого к оплате»;
+    # «Итого НДС» — тоже не итог документа
+    "amount": re.compile(r"(?i)^\W*(итог(?:овая)?\s*сумма|итого(?:\s*к\s*оплате)?|сумма\s*к\s*оплате|к\s*оплате|total|amount)\b"),
+    "currency": re.compile(r"(?i)^\W*(валюта|currency)\b"),
+    "date": re.compile(r"(?i)^\W*(дата(?:\s*документа|\s*операции|\s*платежа)?|date)\b"),
+    "iban": re.compile(r"(?i)^\W*(iban|иик|р/с|расч[её]тный\s*сч[её]т)"),
+    "bic": re.compile(r"(?i)^\W*(бик|bic|swift)\b"),
+    "iin_bin": re.compile(r"(?i)^\W*(иин/бин|бин/иин|иин|бин|iin|bin)\b"),
+    "invoice_no": re.compile(r"(?i)^\W*(сч[её]т(?:-фактура|\s*на\s*оплату)?\s*№|номер\s*сч[её]та|invoice(?:\s*no\.?)?)"),
+    "payer": re.compile(r"(?i)^\W*(плательщик|payer|покупатель|заказчик)\b"),
+    "receiver": re.compile(r"(?i)^\W*(получатель|receiver|beneficiary|продавец|поставщик|исполнитель)\b"),
+}
+
+# Бонус/штраф к оценке в зависимости от того, где нашлось значение
+_PLACEMENT = {"inline": 0.03, "right": 0.03, "below": -0.03}
+
+
+class PageIndex:
+    """
+    Сеточный индекс строк OCR одной страницы (ячейка bucket px).
+    Соседей метки (справа в той же строке, ниже) ищем только в ячейках
+    нужной области — без перебора всех боксов страницы.
+    """
+
+    def __init__(self, items: Sequence[Dict[str, Any]], *, bucket: int = 96) -> None:
+        self.items = items
+        self.bucket = bucket
+        self.boxes: Dict[int, Box] = {}
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        heights: List[int] = []
+        for i, it in enumerate(items):
+            bb = it.get("bbox")
+            if not bb or len(bb) != 4 or not (it.get("text") or "").strip():
+                continue
+            b = tuple(int(v) for v in bb)
+            self.boxes[i] = b
+            heights.append(max(1, b[3] - b[1]))
+            for c in self._cells(b):
+                self._grid.setdefault(c, []).append(i)
+        heights.sort()
+        self.line_h = heights[len(heights) // 2] if heights else 24
+
+    def _cells(self, b: Box) -> Iterator[Tuple[int, int]]:
+        k = self.bucket
+        for cx in range(max(0, b[0]) // k, max(0, b[2]) // k + 1):
+            for cy in range(max(0, b[1]) // k, max(0, b[3]) // k + 1):
+                yield cx, cy
+
+    def query(self, region: Box) -> List[int]:
+        out, seen = [], set()
+        for c in self._cells(region):
+            for i in self._grid.get(c, ()):
+                if i not in seen:
+                    seen.add(i)
+                    out.append(i)
+        return out
+
+    def right_of(self, i: int, *, max_dx: Optional[int] = None) -> List[int]:
+        """Боксы той же строки правее метки, ближайшие первыми."""
+        x1, y1, x2, y2 = self.boxes[i]
+        h = max(1, y2 - y1)
+        max_dx = max_dx or 25 * self.line_h
+        found = []
+        for j in self.query((x2 - h, y1, x2 + max_dx, y2)):
+            if j == i:
+                continue
+            b = self.boxes[j]
+            overlap = min(y2, b[3]) - max(y1, b[1])
+            if b[0] >= x2 - h and overlap >= 0.5 * min(h, b[3] - b[1]):
+                found.append((b[0] - x2, j))
+        return [j for _, j in sorted(found)]
+
+    def below(self, i: int, *, lines: float = 2.0) -> List[int]:
+        """Строки под меткой (до lines высот строки), выровненные с ней по левому краю или пересекающиеся по x."""
+        x1, y1, x2, y2 = self.boxes[i]
+        h = max(1, y2 - y1)
+        found = []
+        for j in self.query((x1 - 2 * h, y2 - h // 2, x2 + 10 * h, y2 + int(lines * self.line_h))):
+            if j == i:
+                continue
+            b = self.boxes[j]
+            if b[1] < y2 - h // 2:
+                continue
+            if min(x2, b[2]) - max(x1, b[0]) > 0 or abs(b[0] - x1) <= 2 * h:
+                found.append((b[1] - y2, b[0], j))
+        return [j for _, _, j in sorted(found)]
+
+
+def _label_hits(page: Sequence[Dict[str, Any]], fields: Sequence[str]) -> Iterator[Tuple[int, str, str]]:
+    """(индекс строки, поле, текст после метки) для всех меток на странице."""
+    for i, it in enumerate(page):
+        t = it.get("text") or ""
+        for f in fields:
+            m = LABELS[f].match(t)
+            if m and not (f == "amount" and RE_NOT_TOTAL.match(t, m.end())):
+                yield i, f, t[m.end():]
+
+
+def extract_layout_fields(
+    ocr_pages: Sequence[Sequence[Dict[str, Any]]],
+    *,
+    fields: Optional[Sequence[str]] = None,
+    today: Optional[date] = None,
+) -> Dict[str, FieldCandidate]:
+    """
+    Ключ-значение по геометрии OCR: метка поля → значение в той же строке,
+    в боксе справа или в строке ниже. У кандидата есть page и bbox источника.
+    """
+    fields = [f for f in (fields or LABELS) if f in LABELS]
+    best: Dict[str, FieldCandidate] = {}
+    for pi, page in enumerate(ocr_pages):
+        hits = list(_label_hits(page, fields))
+        if not hits:
+            continue
+        index = PageIndex(page)
+        for i, f, rest in hits:
+            tries: List[Tuple[str, str, int]] = [("inline", rest, i)]
+            if i in index.boxes:
+                tries += [("right", page[j]["text"], j) for j in index.right_of(i)[:2]]
+                tries += [("below", page[j]["text"], j) for j in index.below(i)[:2]]
+            for where, value_text, j in tries:
+                c = parse_value(f, value_text, today=today)
+                if c is None or c.score < 0.5:
+                    continue
+                c.score = round(min(0.99, c.score + _PLACEMENT[where]), 3)
+                c.source, c.page = "layout", pi
+                bb = page[j].get("bbox")
+                c.bbox = list(bb) if bb else None
+                prev = best.get(f)
+                # «итого» внизу документа обычно финальное — при равенстве берём более позднее
+                if prev is None or c.score > prev.score or (f == "amount" and c.score == prev.score):
+                    best[f] = c
+                break
+    return best
+
@@ -0,0 +1,339 @@
+# src/field_rules.py
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, List, Optional
+import re
+
+from src.amounts import NUMBER, RE_CURRENCY, parse_number, scan_amounts, same_amount, words_amounts
+
+# Порог, начиная с которого правило считается уверенным и LLM для поля не зовём
+RULES_MIN_SCORE = 0.85
+
+ALL_FIELDS = ["amount", "currency", "date", "iban", "bic", "iin_bin", "invoice_no", "payer", "receiver"]
+
+# Какие поля обязательны, чтобы документ не ушёл в LLM
+REQUIRED_FIELDS: Dict[str, List[str]] = {
+    "receipt": ["amount", "currency", "date"],
+    "statement": ["iban", "amount", "currency", "date"],
+    "contract": ["date", "amount", "currency", "payer", "receiver"],
+}
+
+RU_MONTHS = {
+    "января": 1, "февраля": 2, "марта": 3, "апреля": 4, "мая": 5, "июня": 6,
+    "июля": 7, "августа": 8, "сентября": 9, "октября": 10, "ноября": 11, "декабря": 12,
+}
+
+RE_IBAN = re.compile(r"\bKZ\d{2}[0-9A-Z]{16}\b", re.I)
+RE_BIC = re.compile(r"\b[A-Z]{4}KZ[A-Z0-9]{2}(?:[A-Z0-9]{3})?\b|\b[A-Z]{6}[A-Z0-9]{2}(?:[A-Z0-9]{3})?\b")
+RE_BIC_LABEL = re.compile(r"(?i)(?:бик|bic|swift)[\s/:A-Za-z]{0,12}?([A-Z]{6}[A-Z0-9]{2}(?:[A-Z0-9]{3})?)\b")
+RE_IIN = re.compile(r"\b\d{12}\b")
+RE_IIN_LABEL = re.compile(r"(?i)(?:иин|бин|iin|bin)\s*[:/№]?\s*(?:иин|бин)?\s*[:№]?\s*(\d{12})\b")
+RE_AMOUNT_TOTAL = re.compile(
+    r"(?i)(итог(?:овая)?\s*сумма|итого(?:\s*к\s*оплате)?|сумма\s*к\s*оплате|к\s*оплате|total|amount|sum)"
+    r"\D{0,40}?(" + NUMBER + ")")
+RE_AMOUNT_CUR = re.compile(r"(?i)(" + NUMBER + r")\s*(тенге|₸|kzt)")
+RE_DECIMAL_TAIL = re.compile(r"[.,]\d{1,2}$")
+RE_NOT_TOTAL = re.compile(r"(?i)\W*(?:ндс|скидк|налог|vat|tax)")  # «итого НДС», «сумма скидки»
+RE_COUNT_WORD = re.compile(r"(?i)\s*(?:позиц|шт|товар|ед\b|наимен|строк|items?\b|pcs\b)")
+RE_DATE_NUM = re.compile(
+    r"\b(?:(20\d{2})[-./](0?[1-9]|1[0-2])[-./](0?[1-9]|[12]\d|3[01])"
+    r"|(0?[1-9]|[12]\d|3[01])[-./](0?[1-9]|1[0-2])[-./](20\d{2}))\b")
+RE_DATE_RU = re.compile(r"(?i)\b(0?[1-9]|[12]\d|3[01])\s+(" + "|".join(RU_MONTHS) + r")\s+(20\d{2})\b")
+RE_DATE_LABEL = re.compile(r"(?i)(?:дата|date|\bот)\s*[:\-]?\s*$")
+# голое «счёт» в банковских документах — это счёт (IBAN), а не номер счёта на оплату
+RE_INVOICE = re.compile(
+    r"(?i)(?:сч[её]т(?:\s*-\s*фактура|\s+на\s+оплату)(?:\s*№)?|сч[её]т\s*№|invoice(?:\s*no\.?)?|\binv\b\.?|doc\s*no\.?)"
+    r"\s*[:#№]*\s*([\w\-/]+)")
+RE_PARTY = {
+    "receiver": re.compile(r"(?i)(?:получатель|receiver|beneficiary)\s*[:\-]?\s*"),
+    "payer": re.compile(r"(?i)(?:плательщик|payer|customer)\s*[:\-]?\s*"),
+}
+# на чём обрывать название стороны: следующая «метка» документа
+RE_PARTY_STOP = re.compile(
+    r"(?i)\b(?:получатель|плательщик|receiver|payer|иин|бин|iin|bin|бик|bic|swift|iban|иик|"
+    r"сумма|итого|дата|счет|счёт|кбе|кнп|назначение)\b|\n")
+
+
+@dataclass
+class FieldCandidate:
+    value: str
+    score: float
+    start: int = -1
+    end: int = -1
+    source: str = "rules"
+    page: int = -1  # для полей из разметки страницы (src/field_layout.py)
+    bbox: Optional[List[int]] = None
+
+
+# --- контрольные суммы ---
+def iban_checksum_ok(iban: str) -> bool:
+    """ISO 13616: перестановка первых 4 символов в конец, буквы → 10..35, mod 97 == 1."""
+    s = (iban or "").replace(" ", "").upper()
+    if len(s) < 5 or not s.isalnum():
+        return False
+    rem = 0
+    for ch in s[4:] + s[:4]:
+        v = int(ch) if ch.isdigit() else ord(ch) - 55
+        rem = (rem * (100 if v > 9 else 10) + v) % 97
+    return rem == 1
+
+
+IIN_WEIGHTS = ((1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11), (3, 4, 5, 6, 7, 8, 9, 10, 11, 1, 2))
+
+
+def iin_checksum_ok(iin: str) -> bool:
+    """Контрольный разряд ИИН/БИН РК: веса 1..11, при остатке 10 — второй набор весов."""
+    if not iin or len(iin) != 12 or not iin.isdigit():
+        return False
+    d = [int(c) for c in iin]
+    k = sum(a * b for a, b in zip(d[:11], IIN_WEIGHTS[0])) % 11
+    if k == 10:
+        k = sum(a * b for a, b in zip(d[:11], IIN_WEIGHTS[1])) % 11
+        if k == 10:
+            return False
+    return k == d[11]
+
+
+def _num(s: str) -> str:
+    return parse_number(s) or s
+
+
+def _safe_date(y: int, m: int, d: int) -> Optional[date]:
+    try:
+        return date(y, m, d)
+    except ValueError:
+        return None
+
+
+# --- извлечение по полям ---
+def _best(cands: List[FieldCandidate]) -> Optional[FieldCandidate]:
+    return max(cands, key=lambda c: (c.score, -c.start)) if cands else None
+
+
+def _is_money(t: str, start: int, end: int, ctx: int) -> Optional[bool]:
+    """
+    Число t[start:end] после метки суммы (метка кончается на ctx): True — копейки или валюта
+    между меткой и числом / сразу после числа; None — это количество («итого 3 позиции»);
+    False — голое целое, уверенно суммой не считается.
+    """
+    if (RE_DECIMAL_TAIL.search(t, start, end) is not None
+            or RE_CURRENCY.search(t, ctx, start) is not None
+            or RE_CURRENCY.match(t[end:end + 12].lstrip()) is not None):
+        return True
+    return None if RE_COUNT_WORD.match(t, end) else False
+
+
+def _amount(t: str) -> Optional[FieldCandidate]:
+    c: List[FieldCandidate] = []
+    weak: List[FieldCandidate] = []
+    for m in RE_AMOUNT_TOTAL.finditer(t):
+        money = _is_money(t, m.start(2), m.end(2), m.end(1))
+        if money is None or RE_NOT_TOTAL.match(t, m.end(1)):
+            continue
+        cand = FieldCandidate(_num(m.group(2)), 0.92 if money else 0.6, m.start(2), m.end(2))
+        (c if money else weak).append(cand)
+    if not c:
+        for a in scan_amounts(t):
+            if a.currency:
+                c.append(FieldCandidate(a.value, 0.75, a.start, a.end))
+    # сумма цифрами, повторённая прописью, — почти наверняка итог договора:
+    # «1 500 000 (один миллион пятьсот тысяч) тенге»
+    words = words_amounts(t)
+    if words:
+        c.extend(FieldCandidate(a.value, 0.97, a.start, a.end) for a in scan_amounts(t)
+                 if any(same_amount(a.value, w.value) for w in words))
+    if not c and words:
+        w = words[-1]
+        c.append(FieldCandidate(w.value, 0.8, w.start, w.end))
+    if not c:
+        c = weak  # целое после «итого» без валюты — ниже порога, уточнит LLM
+    # при нескольких «итого» обычно верна последняя
+    return max(c, key=lambda x: (x.score, x.start)) if c else None
+
+
+def _currency(t: str) -> Optional[FieldCandidate]:
+    m = re.search(r"(?i)\bKZT\b|₸|тенге", t)
+    if m:
+        return FieldCandidate("KZT", 0.95, m.start(), m.end())
+    m = re.search(r"(?i)\b(USD|EUR|RUB)\b", t)
+    if m:
+        return FieldCandidate(m.group(1).upper(), 0.9, m.start(), m.end())
+    return None
+
+
+def _date(t: str, today: date) -> Optional[FieldCandidate]:
+    c: List[FieldCandidate] = []
+
+    def add(dt: Optional[date], start: int, end: int) -> None:
+        if dt is None or not (2000 <= dt.year <= today.year + 1):
+            return
+        labeled = RE_DATE_LABEL.search(t[max(0, start - 16):start]) is not None
+        # дата без метки — может быть датой рождения, срока или печати: ниже порога RULES_MIN_SCORE
+        c.append(FieldCandidate(dt.isoformat(), 0.95 if labeled else 0.8, start, end))
+
+    for m in RE_DATE_NUM.finditer(t):
+        if m.group(1):
+            dt = _safe_date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        else:
+            dt = _safe_date(int(m.group(6)), int(m.group(5)), int(m.group(4)))
+        add(dt, m.start(), m.end())
+    for m in RE_DATE_RU.finditer(t):
+        add(_safe_date(int(m.group(3)), RU_MONTHS[m.group(2).lower()], int(m.group(1))), m.start(), m.end())
+    return _best(c)
+
+
+def _iban(t: str) -> Optional[FieldCandidate]:
+    c = [FieldCandidate(m.group(0).upper(), 0.98 if iban_checksum_ok(m.group(0)) else 0.4, m.start(), m.end())
+         for m in RE_IBAN.finditer(t)]
+    return _best(c)
+
+
+def _bic(t: str) -> Optional[FieldCandidate]:
+    m = RE_BIC_LABEL.search(t)
+    if m:
+        return FieldCandidate(m.group(1), 0.95, m.start(1), m.end(1))
+    for m in RE_BIC.finditer(t):
+        v = m.group(0)
+        # KZ-банки: 5–6 символы — код страны
+        return FieldCandidate(v, 0.88 if v[4:6] == "KZ" else 0.5, m.start(), m.end())
+    return None
+
+
+def _iin_bin(t: str) -> Optional[FieldCandidate]:
+    c: List[FieldCandidate] = []
+    for m in RE_IIN_LABEL.finditer(t):
+        v = m.group(1)
+        c.append(FieldCandidate(v, 0.97 if iin_checksum_ok(v) else 0.6, m.start(1), m.end(1)))
+    if not c:
+        for m in RE_IIN.finditer(t):
+            v = m.group(0)
+            c.append(FieldCandidate(v, 0.86 if iin_checksum_ok(v) else 0.45, m.start(), m.end()))
+    return _best(c)
+
+
+def _invoice_ok(v: str) -> bool:
+    """Номер счёта на оплату: есть цифры и это не IBAN (банковский счёт)."""
+    return any(ch.isdigit() for ch in v) and not RE_IBAN.match(v)
+
+
+def _invoice(t: str) -> Optional[FieldCandidate]:
+    for m in RE_INVOICE.finditer(t):
+        if _invoice_ok(m.group(1)):
+            return FieldCandidate(m.group(1), 0.85, m.start(1), m.end(1))
+    return None
+
+
+def _party(t: str, key: str) -> Optional[FieldCandidate]:
+    m = RE_PARTY[key].search(t)
+    if not m:
+        return None
+    start = m.end()
+    tail = t[start:start + 120]
+    stop = RE_PARTY_STOP.search(tail)
+    v = (tail[:stop.start()] if stop else tail).strip(" ,;:-\t")
+    if not v:
+        return None
+    # организационно-правовая форма + кавычки — хороший признак полного названия
+    score = 0.86 if re.match(r"(?i)(тоо|ао|ип|оао|зао|ооо|ргп|гу)\b", v) and len(v) <= 80 else 0.6
+    return FieldCandidate(v, score, start, start + len(v))
+
+
+def extract_rule_fields(text: str, *, today: Optional[date] = None) -> Dict[str, FieldCandidate]:
+    """
+    Быстрое извлечение полей правилами с оценкой уверенности (0..1).
+    Уверенность растёт от проверок: контрольная сумма IBAN/ИИН, корректная дата
+    в разумном диапазоне, сумма рядом с «итого», метка поля рядом со значением.
+    """
+    t = text or ""
+    today = today or date.today()
+    found = {
+        "amount": _amount(t),
+        "currency": _currency(t),
+        "date": _date(t, today),
+        "iban": _iban(t),
+        "bic": _bic(t),
+        "iin_bin": _iin_bin(t),
+        "invoice_no": _invoice(t),
+        "payer": _party(t, "payer"),
+        "receiver": _party(t, "receiver"),
+    }
+    return {k: v for k, v in found.items() if v is not None}
+
+
+RE_AMOUNT_VALUE = re.compile("(" + NUMBER + ")")
+RE_INVOICE_VALUE = re.compile(r"^[\s:#№]*([\w\-_/]{3,})")
+
+
+def parse_value(field: str, s: str, *, today: Optional[date] = None) -> Optional[FieldCandidate]:
+    """
+    Проверка одиночного значения, найденного рядом с меткой поля (без самой метки).
+    Метка уже дала контекст, поэтому базовые оценки выше, чем при поиске по всему тексту.
+    """
+    s = (s or "").strip()
+    if not s:
+        return None
+    if field == "amount":
+        # те же требования, что в _amount: «3 позиции» — не сумма, голое целое — ниже порога
+        bare: Optional[FieldCandidate] = None
+        for m in RE_AMOUNT_VALUE.finditer(s):
+            money = _is_money(s, m.start(1), m.end(1), 0)
+            if money:
+                return FieldCandidate(_num(m.group(1)), 0.9, m.start(1), m.end(1))
+            if money is False and bare is None:
+                bare = FieldCandidate(_num(m.group(1)), 0.6, m.start(1), m.end(1))
+        return bare
+    if field == "currency":
+        return _currency(s)
+    if field == "date":
+        c = _date(s, today or date.today())
+        if c:
+            c.score = max(c.score, 0.93)
+        return c
+    if field == "iban":
+        return _iban(s)
+    if field == "bic":
+        m = RE_BIC.search(s)
+        return FieldCandidate(m.group(0), 0.93, m.start(), m.end()) if m else None
+    if field == "iin_bin":
+        m = RE_IIN.search(s)
+        if not m:
+            return None
+        return FieldCandidate(m.group(0), 0.97 if iin_checksum_ok(m.group(0)) else 0.5, m.start(), m.end())
+    if field == "invoice_no":
+        m = RE_INVOICE_VALUE.match(s)
+        if not m:
+            return None
+        v = m.group(1)
+        return FieldCandidate(v, 0.88, m.start(1), m.end(1)) if _invoice_ok(v) else None
+    if field in ("payer", "receiver"):
+        stop = RE_PARTY_STOP.search(s)
+        v = (s[:stop.start()] if stop else s).strip(" ,;:-\t")[:120]
+        if not v or not any(ch.isalpha() for ch in v):
+            return None
+        score = 0.9 if re.match(r"(?i)(тоо|ао|ип|оао|зао|ооо|ргп|гу)\b", v) else 0.75
+        return FieldCandidate(v, score, 0, len(v))
+    return None
+
+
+def required_fields(doc_type: Optional[str]) -> List[str]:
+    return REQUIRED_FIELDS.get((doc_type or "").lower(), ALL_FIELDS)
+
+
+def confident_fields(cands: Dict[str, FieldCandidate], min_score: float = RULES_MIN_SCORE) -> Dict[str, str]:
+    return {k: c.value for k, c in cands.items() if c.score >= min_score}
+
+
+# Ключевые слова полей (для отбора контекста LLM, см. src/llm_context.py)
+FIELD_KEYWORDS: Dict[str, str] = {
+    "amount": r"итог|к\s*оплате|сумм|total|amount|₸|тенге",
+    "currency": r"₸|тенге|KZT|USD|EUR|RUB|валют",
+    "date": r"дата|date|\bот\b|20\d{2}",
+    "iban": r"IBAN|ИИК|KZ\d{2}",
+    "bic": r"БИК|BIC|SWIFT",
+    "iin_bin": r"ИИН|БИН|IIN|BIN",
+    "invoice_no": r"сч[её]т|invoice|№",
+    "payer": r"плательщик|payer|покупатель|заказчик",
+    "receiver": r"получатель|receiver|beneficiary|продавец|поставщик",
+}
+
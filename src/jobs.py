@@ -0,0 +1,146 @@
+# src/jobs.py
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+import logging
+import threading
+import time
+import uuid
+
+from src.render import PagePreviews
+
+QUEUED, RUNNING, DONE, ERROR = "queued", "running", "done", "error"
+
+
+@dataclass
+class Job:
+    """Документ в фоновой обработке. Поля читаются UI-потоком, пишутся воркером."""
+    id: str
+    name: str
+    path: Path
+    key: Optional[str] = None  # ключ кеша (хэш файла + параметры), см. src/uploads.py
+    status: str = QUEUED
+    pages_done: int = 0
+    pages_total: int = 0
+    partial: List[List[Dict[str, Any]]] = field(default_factory=list)  # OCR готовых страниц
+    result: Optional[Dict[str, Any]] = None
+    previews: Optional[PagePreviews] = None
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def progress(self) -> float:
+        if self.status == DONE:
+            return 1.0
+        if not self.pages_total:
+            return 0.0
+        # OCR страниц — ~90% работы, остаток — LLM/разделы
+        return 0.9 * self.pages_done / self.pages_total
+
+    @property
+    def elapsed(self) -> float:
+        if not self.started:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+class JobRunner:
+    """
+    Фоновое выполнение run_pipeline с реальным постраничным прогрессом.
+
+    Один экземпляр на процесс (в Streamlit — через st.cache_resource), общий для всех
+    сессий: документы встают в очередь пула, UI опрашивает Job и показывает уже
+    распознанные страницы, пока остальные в работе.
+    """
+
+    def __init__(self, pipeline: Callable[..., Any], *, max_workers: int = 1, keep_jobs: int = 200,
+                 result_cache: Any = None, on_done: Optional[Callable[[Job], None]] = None) -> None:
+        self._pipeline = pipeline
+        self._cache = result_cache  # объект с get_result(key) / put_result(key, result)
+        self._on_done = on_done  # например, SearchIndex.add_job — индексация готового документа
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ocr-job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._keep_jobs = keep_jobs
+
+    def submit(self, path: str | Path, *, name: str | None = None, previews: bool = True,
+               key: str | None = None, **pipeline_kwargs: Any) -> Job:
+        """
+        Ставит документ в очередь. Если задан key и такой документ уже в работе или
+        обработан (в этом процессе) — возвращается существующий Job без повторной обработки.
+        """
+        with self._lock:
+            if key:
+                for j in self._jobs.values():
+                    if j.key == key and j.status != ERROR:
+                        return j
+            job = Job(id=uuid.uuid4().hex[:12], name=name or Path(path).name, path=Path(path), key=key)
+            self._jobs[job.id] = job
+            self._evict()
+        self._pool.submit(self._run, job, previews, pipeline_kwargs)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, ids: Optional[List[str]] = None) -> List[Job]:
+        with self._lock:
+            if ids is None:
+                return list(self._jobs.values())
+            return [self._jobs[i] for i in ids if i in self._jobs]
+
+    def _evict(self) -> None:
+        # старые завершённые задачи вытесняем, активные не трогаем
+        done = [j for j in self._jobs.values() if not j.active]
+        for j in sorted(done, key=lambda j: j.created)[:max(0, len(self._jobs) - self._keep_jobs)]:
+            self._jobs.pop(j.id, None)
+
+    def _run(self, job: Job, previews: bool, kwargs: Dict[str, Any]) -> None:
+        job.status, job.started = RUNNING, time.time()
+
+        def on_page(idx: int, total: int, items: List[Dict[str, Any]]) -> None:
+            job.pages_total = total
+            job.partial = job.partial + [items]  # новый список — читатель не видит полузаписи
+            job.pages_done = idx + 1
+
+        try:
+            cached = self._cache.get_result(job.key) if (self._cache is not None and job.key) else None
+            if cached is not None:
+                # результат с диска (например, после перезапуска) — без превью страниц
+                job.result = cached
+                job.status = DONE
+                self._notify(job)
+                return
+            result, pages = self._pipeline(job.path, on_page=on_page, return_pages=previews, **kwargs)
+            if previews:
+                ocr = (result or {}).get("debug", {}).get("ocr") or []
+                job.previews = PagePreviews(pages or [], ocr)
+            job.result = result or {}
+            job.status = DONE
+            if self._cache is not None and job.key:
+                self._cache.put_result(job.key, job.result)
+            self._notify(job)
+        except Exception as e:
+            logging.exception("Job %s failed", job.id)
+            job.error = str(e)
+            job.status = ERROR
+        finally:
+            job.finished = time.time()
+
+    def _notify(self, job: Job) -> None:
+        if self._on_done is None:
+            return
+        try:
+            self._on_done(job)
+        except Exception:
+            # ошибка обработчика (индекс, журнал) не должна ронять документ
+            logging.exception("on_done failed for job %s", job.id)
@@ -0,0 +1,109 @@
+# src/llm_batch.py
+from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Generic, List, Optional, Sequence, Tuple, TypeVar
+import logging
+import queue
+import threading
+import time
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Собирает запросы из разных потоков (документов) в пакеты.
+
+    Первый запрос открывает окно max_wait секунд; всё, что пришло за это время
+    (но не больше max_size), уходит одним вызовом run_batch. run_batch возвращает
+    результат на каждый элемент по порядку; None на месте элемента или исключение
+    всего пакета — элемент(ы) переспрашиваются по одному через run_single.
+
+    Пакеты и одиночные запросы выполняются в пуле из workers потоков, поэтому
+    медленный пакет не задерживает сбор следующих. Перед каждым вызовом отбрасываются
+    отменённые future (вызывающий устал ждать) и элементы, для которых expired(item)
+    истинно, — им ставится TimeoutError без обращения к модели.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[Sequence[T]], Sequence[Optional[R]]],
+        run_single: Callable[[T], R],
+        *,
+        max_size: int = 8,
+        max_wait: float = 0.3,
+        workers: int = 2,
+        expired: Optional[Callable[[T], bool]] = None,
+        name: str = "llm-batch",
+    ) -> None:
+        self._run_batch = run_batch
+        self._run_single = run_single
+        self._expired = expired
+        self.max_size = max(1, max_size)
+        self.max_wait = max_wait
+        self._q: "queue.Queue[Tuple[T, Future]]" = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=name)
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: T) -> "Future[R]":
+        fut: "Future[R]" = Future()
+        self._q.put((item, fut))
+        return fut
+
+    def _collect(self) -> List[Tuple[T, Future]]:
+        batch = [self._q.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_size:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                batch.append(self._q.get(timeout=left))
+            except queue.Empty:
+                break
+        return batch
+
+    def _live(self, item: T, fut: Future) -> bool:
+        """Ждёт ли ещё кто-то результат; просроченным сразу ставится TimeoutError."""
+        if fut.done():
+            return False
+        if self._expired is not None and self._expired(item):
+            fut.set_exception(TimeoutError("deadline expired before the LLM call"))
+            return False
+        return True
+
+    def _single(self, item: T, fut: Future) -> None:
+        if not self._live(item, fut):
+            return
+        try:
+            fut.set_result(self._run_single(item))
+        except Exception as e:
+            fut.set_exception(e)
+
+    def _start(self, batch: List[Tuple[T, Future]]) -> List[Tuple[T, Future]]:
+        # set_running_or_notify_cancel: отменённые выпадают, остальные больше нельзя отменить
+        return [(it, fut) for it, fut in batch if fut.set_running_or_notify_cancel() and self._live(it, fut)]
+
+    def _dispatch(self, batch: List[Tuple[T, Future]]) -> None:
+        batch = self._start(batch)
+        if not batch:
+            return
+        if len(batch) == 1:
+            self._single(*batch[0])
+            return
+        try:
+            results: Sequence[Optional[Any]] = self._run_batch([it for it, _ in batch])
+        except Exception as e:
+            logging.warning("Batch of %d failed, falling back to single requests: %s", len(batch), e)
+            results = [None] * len(batch)
+        for (item, fut), res in zip(batch, list(results) + [None] * (len(batch) - len(results))):
+            if res is None:
+                self._pool.submit(self._single, item, fut)
+            else:
+                fut.set_result(res)
+
+    def _loop(self) -> None:
+        while True:
+            self._pool.submit(self._dispatch, self._collect())
@@ -0,0 +1,169 @@
+# src/llm_context.py
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+import re
+
+from src.field_layout import LABELS
+from src.field_rules import (
+    FIELD_KEYWORDS, RE_AMOUNT_CUR, RE_AMOUNT_TOTAL, RE_BIC_LABEL, RE_DATE_NUM, RE_DATE_RU, RE_IBAN, RE_IIN,
+)
+
+# Значения полей: строка с самим значением ценнее строки только с меткой
+FIELD_VALUES: Dict[str, Sequence[re.Pattern]] = {
+    "amount": (RE_AMOUNT_TOTAL, RE_AMOUNT_CUR),
+    "currency": (re.compile(r"(?i)\bKZT\b|₸|тенге|\b(?:USD|EUR|RUB)\b"),),
+    "date": (RE_DATE_NUM, RE_DATE_RU),
+    "iban": (RE_IBAN,),
+    "bic": (RE_BIC_LABEL,),
+    "iin_bin": (RE_IIN,),
+    "invoice_no": (),
+    "payer": (),
+    "receiver": (),
+}
+
+# Заголовки разделов (build_sections), внутри которых обычно лежат поля
+SECTION_HINTS: Dict[str, re.Pattern] = {
+    "amount": re.compile(r"(?i)стоимост|цена|сумм|оплат|расч[её]т"),
+    "currency": re.compile(r"(?i)стоимост|цена|сумм|оплат"),
+    "date": re.compile(r"(?i)срок|дата|действ"),
+    "iban": re.compile(r"(?i)реквизит|банк"),
+    "bic": re.compile(r"(?i)реквизит|банк"),
+    "iin_bin": re.compile(r"(?i)реквизит|сторон"),
+    "invoice_no": re.compile(r"(?i)сч[её]т|оплат"),
+    "payer": re.compile(r"(?i)сторон|реквизит|предмет"),
+    "receiver": re.compile(r"(?i)сторон|реквизит|предмет"),
+}
+
+_W_LABEL, _W_VALUE, _W_KEYWORD, _W_SECTION = 3.0, 2.0, 1.0, 1.0
+
+
+def est_tokens(s: str) -> int:
+    """Грубая оценка токенов для смеси кириллицы, цифр и латиницы (~3 символа на токен)."""
+    return len(s) // 3 + 1
+
+
+@dataclass
+class LLMContext:
+    text: str
+    tokens: int
+    budget: int
+    doc_tokens: int  # оценка токенов всего документа — для сравнения
+    spans: List[Tuple[int, int]] = field(default_factory=list)  # (страница, строка) отправленных строк
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "tokens": self.tokens,
+            "budget": self.budget,
+            "doc_tokens": self.doc_tokens,
+            "chars": len(self.text),
+            "lines": len(self.spans),
+            "spans": self.spans,
+        }
+
+
+def _text_units(text: str, width: int = 240) -> List[Tuple[int, int, str]]:
+    """Без разметки страниц: режем текст по предложениям, длинные — на куски по width символов."""
+    units: List[Tuple[int, int, str]] = []
+    for part in re.split(r"(?<=[.;])\s+|\n+", text or ""):
+        part = part.strip()
+        for k in range(0, len(part), width):
+            units.append((0, len(units), part[k:k + width]))
+    return units
+
+
+def _layout_units(layout: Sequence[Sequence[Dict[str, Any]]]) -> List[Tuple[int, int, str]]:
+    return [(pi, i, (it.get("text") or "").strip())
+            for pi, page in enumerate(layout) for i, it in enumerate(page)
+            if (it.get("text") or "").strip()]
+
+
+def _section_lines(sections: Sequence[Dict[str, Any]], fields: Sequence[str]) -> Dict[int, Set[str]]:
+    """Страница → строки разделов, чьи заголовки указывают на нужные поля."""
+    pats = [SECTION_HINTS[f] for f in fields if f in SECTION_HINTS]
+    out: Dict[int, Set[str]] = {}
+    for sec in sections or ():
+        title = sec.get("title") or ""
+        if not any(p.search(title) for p in pats):
+            continue
+        lines = {ln.strip() for ln in (sec.get("content") or "").split("\n") if ln.strip()}
+        for pi in range(int(sec.get("page_from", 1)) - 1, int(sec.get("page_to", 1))):
+            out.setdefault(pi, set()).update(lines)
+    return out
+
+
+def _score(text: str, fields: Sequence[str]) -> float:
+    s = 0.0
+    for f in fields:
+        lab = LABELS.get(f)
+        if lab is not None and lab.match(text):
+            s += _W_LABEL
+        if any(p.search(text) for p in FIELD_VALUES.get(f, ())):
+            s += _W_VALUE
+        kw = FIELD_KEYWORDS.get(f)
+        if kw and re.search(kw, text, flags=re.I):
+            s += _W_KEYWORD
+    return s
+
+
+def build_context(
+    text: str,
+    fields: Sequence[str],
+    *,
+    layout: Optional[Sequence[Sequence[Dict[str, Any]]]] = None,
+    sections: Optional[Sequence[Dict[str, Any]]] = None,
+    budget_tokens: int = 1500,
+    neighbours: int = 1,
+) -> LLMContext:
+    """
+    Контекст для LLM в пределах бюджета токенов.
+
+    Каждая строка OCR (или кусок текста, если разметки нет) получает оценку по нужным
+    полям: метка поля в начале строки, значение (IBAN, ИИН/БИН, сумма, дата), ключевые
+    слова, раздел с подходящим заголовком. Строки с лучшей оценкой берутся вместе с
+    соседями, пока влезают в бюджет, и выводятся в порядке документа — так поля
+    с последних страниц не теряются, а нерелевантный текст не оплачивается.
+    """
+    units = _layout_units(layout) if layout else _text_units(text)
+    doc_tokens = sum(est_tokens(u[2]) for u in units)
+    in_section = _section_lines(sections or (), fields)
+
+    scores = []
+    for n, (pi, _i, t) in enumerate(units):
+        s = _score(t, fields)
+        if s and t in in_section.get(pi, ()):
+            s += _W_SECTION
+        if s:
+            scores.append((s, n))
+    # при равной оценке — более поздние строки («итого», реквизиты в конце договора)
+    scores.sort(key=lambda x: (-x[0], -x[1]))
+
+    chosen: Set[int] = set()
+    used = 0
+    for _s, n in scores:
+        window = [k for k in range(n - neighbours, n + neighbours + 1) if 0 <= k < len(units) and k not in chosen]
+        cost = sum(est_tokens(units[k][2]) for k in window)
+        if used + cost > budget_tokens:
+            continue
+        chosen.update(window)
+        used += cost
+    if not chosen:
+        # ни одной подсказки — хотя бы начало документа
+        for n, u in enumerate(units):
+            used += est_tokens(u[2])
+            if used > budget_tokens:
+                break
+            chosen.add(n)
+
+    out: List[str] = []
+    spans: List[Tuple[int, int]] = []
+    prev_n, prev_page = -2, -1
+    for n in sorted(chosen):
+        pi, i, t = units[n]
+        if n != prev_n + 1 or pi != prev_page:
+            out.append(f"[стр. {pi + 1}]" if layout else "…")
+        out.append(t)
+        spans.append((pi, i))
+        prev_n, prev_page = n, pi
+    ctx = "\n".join(out)
+    return LLMContext(text=ctx, tokens=est_tokens(ctx), budget=budget_tokens, doc_tokens=doc_tokens, spans=spans)
@@ -0,0 +1,342 @@
+# src/llm_providers.py
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import json
+import logging
+import os
+import threading
+import time
+
+
+class LLMError(RuntimeError):
+    """Ошибка вызова провайдера. retryable — имеет смысл повторить (429, таймаут, обрыв соединения)."""
+
+    def __init__(self, msg: str, *, retryable: bool = False) -> None:
+        super().__init__(msg)
+        self.retryable = retryable
+
+
+class BreakerOpen(LLMError):
+    """Провайдер временно отключён после серии ошибок — сразу идём в fallback."""
+
+
+@dataclass
+class CallStats:
+    provider: str
+    model: str
+    latency_s: float
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    ok: bool = True
+    error: str = ""
+
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    """
+    Предохранитель провайдера, общий для всех документов процесса.
+
+    closed → (threshold ошибок подряд) → open: вызовы сразу отклоняются, документы
+    идут в fallback на правилах. Через cooldown — half_open: пропускается не больше
+    probes пробных вызовов; успех закрывает предохранитель, ошибка снова открывает.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0, *, probes: int = 1) -> None:
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.probes = max(1, probes)
+        self._state = CLOSED
+        self._fails = 0
+        self._probing = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() >= self._open_until:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() < self._open_until:
+                    return False
+                self._state, self._probing = HALF_OPEN, 0
+            if self._state == HALF_OPEN:
+                if self._probing >= self.probes:
+                    return False
+                self._probing += 1
+            return True
+
+    def release(self) -> None:
+        """Разрешённый allow() вызов так и не состоялся: вернуть пробный слот half_open."""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probing = max(0, self._probing - 1)
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probing = max(0, self._probing - 1)
+                if ok:
+                    self._state, self._fails = CLOSED, 0
+                else:
+                    self._trip()
+                return
+            if ok:
+                self._fails = 0
+                return
+            self._fails += 1
+            if self._fails >= self.threshold:
+                self._trip()
+
+    def _trip(self) -> None:
+        if self._state != OPEN:
+            logging.warning("LLM circuit breaker open for %.0fs", self.cooldown)
+        self._state = OPEN
+        self._open_until = time.monotonic() + self.cooldown
+
+
+class RateLimiter:
+    """Не больше rpm запросов в минуту на провайдер (0 — без ограничения); лишние ждут своей очереди."""
+
+    def __init__(self, rpm: float = 0.0) -> None:
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, max_wait: float = float("inf")) -> bool:
+        """False — слот дальше, чем max_wait (вызов не начинаем)."""
+        if not self.interval:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            if at - now > max_wait:
+                return False
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+        return True
+
+
+class LLMProvider(ABC):
+    """
+    Общий интерфейс: complete_json(system, parts, schema) → разобранный JSON.
+    Один вызов без повторов (политика повторов — у вызывающего), с таймаутом,
+    предохранителем и учётом задержки/токенов.
+    """
+
+    name = "base"
+
+    def __init__(self, model: str, *, timeout: float = 60.0, breaker: Optional[CircuitBreaker] = None,
+                 limiter: Optional[RateLimiter] = None, history: int = 500) -> None:
+        self.model = model
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter or RateLimiter(float(os.getenv("LLM_RPM", "0")))
+        self.calls: Deque[CallStats] = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self.totals = {"calls": 0, "errors": 0, "prompt_tokens": 0, "output_tokens": 0, "latency_s": 0.0}
+
+    # --- реализуется провайдером ---
+    @abstractmethod
+    def _complete(self, system: str, parts: List[str], schema: Dict[str, Any], *,
+                  model: str, max_tokens: int, timeout: float) -> Tuple[str, int, int]:
+        """(текст ответа, prompt_tokens, output_tokens)"""
+
+    # --- общее ---
+    def complete_json(self, system: str, parts: List[str], schema: Dict[str, Any], *,
+                      model: Optional[str] = None, max_tokens: int = 512, timeout: Optional[float] = None,
+                      collect: Optional[List[CallStats]] = None) -> Dict[str, Any]:
+        """
+        timeout — не больше собственного таймаута провайдера (остаток бюджета документа);
+        collect — список, куда дописывается CallStats вызова (учёт по документу).
+        """
+        # сначала предохранитель: при открытом — сразу fallback, без ожидания слота лимита
+        if not self.breaker.allow():
+            raise BreakerOpen(f"{self.name}: circuit open")
+        if not self.limiter.wait(timeout if timeout is not None else float("inf")):
+            self.breaker.release()
+            raise LLMError(f"{self.name}: rate limit slot beyond deadline")
+        if self.breaker.state == OPEN:  # пока ждали слот, другие вызовы открыли предохранитель
+            self.breaker.release()
+            raise BreakerOpen(f"{self.name}: circuit open")
+        model = model or self.model
+        t0 = time.perf_counter()
+        stats = CallStats(self.name, model, 0.0)
+        try:
+            text, stats.prompt_tokens, stats.output_tokens = self._complete(
+                system, parts, schema, model=model, max_tokens=max_tokens,
+                timeout=min(self.timeout, timeout) if timeout is not None else self.timeout)
+            text = (text or "").strip()
+            if not text:
+                raise LLMError(f"{self.name}: empty response")
+            try:
+                return json.loads(text) or {}
+            except ValueError as e:
+                raise LLMError(f"{self.name}: invalid JSON: {e}") from e
+        except Exception as e:
+            stats.ok, stats.error = False, str(e)[:200]
+            raise
+        finally:
+            stats.latency_s = time.perf_counter() - t0
+            self.breaker.record(stats.ok)
+            self._account(stats)
+            if collect is not None:
+                collect.append(stats)
+
+    def _account(self, s: CallStats) -> None:
+        with self._lock:
+            self.calls.append(s)
+            self.totals["calls"] += 1
+            self.totals["errors"] += 0 if s.ok else 1
+            self.totals["prompt_tokens"] += s.prompt_tokens
+            self.totals["output_tokens"] += s.output_tokens
+            self.totals["latency_s"] += s.latency_s
+
+    def usage(self) -> Dict[str, Any]:
+        with self._lock:
+            last = asdict(self.calls[-1]) if self.calls else None
+            return {"provider": self.name, "model": self.model, "breaker": self.breaker.state, **self.totals, "last": last}
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, api_key: str, model: str, **kw: Any) -> None:
+        super().__init__(model, **kw)
+        import google.generativeai as genai
+        try:
+            from google.api_core import exceptions as gexc
+            self._retryable: Tuple[type, ...] = (gexc.ResourceExhausted, gexc.ServiceUnavailable, gexc.DeadlineExceeded)
+        except Exception:
+            self._retryable = ()
+        genai.configure(api_key=api_key)
+        self._genai = genai
+        self._models: Dict[Tuple[str, str], Any] = {}
+
+    def _model(self, model: str, system: str) -> Any:
+        # GenerativeModel хранит system_instruction — кешируем по (модель, промпт)
+        key = (model, system)
+        m = self._models.get(key)
+        if m is None:
+            m = self._models[key] = self._genai.GenerativeModel(model, system_instruction=system)
+        return m
+
+    def _complete(self, system, parts, schema, *, model, max_tokens, timeout):
+        cfg = {
+            "response_mime_type": "application/json",
+            "response_schema": schema,
+            "temperature": 0.0,
+            "max_output_tokens": max_tokens,
+        }
+        try:
+            resp = self._model(model, system).generate_content(
+                parts, generation_config=cfg, request_options={"timeout": timeout})
+        except self._retryable as e:
+            raise LLMError(f"gemini: {e}", retryable=True) from e
+        except Exception as e:
+            msg = str(e).lower()
+            raise LLMError(f"gemini: {e}", retryable="429" in msg or "quota" in msg or "timeout" in msg) from e
+        um = getattr(resp, "usage_metadata", None)
+        return (getattr(resp, "text", "") or "",
+                int(getattr(um, "prompt_token_count", 0) or 0),
+                int(getattr(um, "candidates_token_count", 0) or 0))
+
+
+class OpenAIProvider(LLMProvider):
+    """
+    OpenAI и любой OpenAI-совместимый сервер (llama.cpp server, vLLM, Ollama) через base_url.
+    Соединения держит пул httpx внутри клиента; повторы SDK отключены (max_retries=0).
+    """
+
+    name = "openai"
+
+    def __init__(self, model: str, *, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 json_mode: str = "json_schema", pool_size: int = 8, name: Optional[str] = None, **kw: Any) -> None:
+        super().__init__(model, **kw)
+        import httpx
+        import openai
+        self.name = name or self.name
+        self.json_mode = json_mode
+        self._openai = openai
+        self._client = openai.OpenAI(
+            api_key=api_key or "none",
+            base_url=base_url,
+            timeout=self.timeout,
+            max_retries=0,
+            http_client=httpx.Client(
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                timeout=self.timeout,
+            ),
+        )
+
+    def _complete(self, system, parts, schema, *, model, max_tokens, timeout):
+        if self.json_mode == "json_schema":
+            fmt: Dict[str, Any] = {"type": "json_schema", "json_schema": {"name": "result", "schema": schema}}
+        else:
+            # локальные серверы часто понимают только json_object — схему дублируем в промпте
+            fmt = {"type": "json_object"}
+            system = f"{system}\nJSON-схема ответа: {json.dumps(schema, ensure_ascii=False)}"
+        try:
+            resp = self._client.chat.completions.create(
+                model=model,
+                messages=[{"role": "system", "content": system},
+                          {"role": "user", "content": "\n\n".join(parts)}],
+                response_format=fmt,
+                temperature=0.0,
+                max_tokens=max_tokens,
+                timeout=timeout,
+            )
+        except (self._openai.RateLimitError, self._openai.APITimeoutError, self._openai.APIConnectionError) as e:
+            raise LLMError(f"{self.name}: {e}", retryable=True) from e
+        except self._openai.APIStatusError as e:
+            raise LLMError(f"{self.name}: {e}", retryable=getattr(e, "status_code", 0) >= 500) from e
+        usage = getattr(resp, "usage", None)
+        return (resp.choices[0].message.content or "",
+                int(getattr(usage, "prompt_tokens", 0) or 0),
+                int(getattr(usage, "completion_tokens", 0) or 0))
+
+
+def make_provider(name: Optional[str] = None) -> Optional[LLMProvider]:
+    """
+    Провайдер из env (LLM_PROVIDER: gemini | openai | local). None — LLM не настроен.
+    - gemini: GEMINI_API_KEY/GOOGLE_API_KEY, GEMINI_MODEL, GEMINI_TIMEOUT_S
+    - openai: OPENAI_API_KEY, OPENAI_MODEL, OPENAI_BASE_URL, OPENAI_TIMEOUT_S
+    - local:  LLM_BASE_URL (OpenAI-совместимый /v1), LLM_MODEL, LLM_API_KEY, LLM_JSON_MODE, LLM_LOCAL_TIMEOUT_S
+    Предохранитель: LLM_BREAKER_FAILS (5) ошибок подряд → пауза LLM_BREAKER_COOLDOWN_S (30).
+    """
+    gemini_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    name = (name or os.getenv("LLM_PROVIDER") or ("gemini" if gemini_key else "")).lower()
+
+    def breaker() -> CircuitBreaker:
+        return CircuitBreaker(int(os.getenv("LLM_BREAKER_FAILS", "5")),
+                              float(os.getenv("LLM_BREAKER_COOLDOWN_S", "30")))
+
+    try:
+        if name == "gemini" and gemini_key:
+            return GeminiProvider(gemini_key, os.getenv("GEMINI_MODEL", "gemini-2.5-pro"),
+                                  timeout=float(os.getenv("GEMINI_TIMEOUT_S", "60")), breaker=breaker())
+        if name == "openai" and os.getenv("OPENAI_API_KEY"):
+            return OpenAIProvider(os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+                                  api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL"),
+                                  timeout=float(os.getenv("OPENAI_TIMEOUT_S", "60")), breaker=breaker())
+        if name == "local" and os.getenv("LLM_BASE_URL"):
+            return OpenAIProvider(os.getenv("LLM_MODEL", "local"), name="local",
+                                  api_key=os.getenv("LLM_API_KEY"), base_url=os.getenv("LLM_BASE_URL"),
+                                  json_mode=os.getenv("LLM_JSON_MODE", "json_object"),
+                                  timeout=float(os.getenv("LLM_LOCAL_TIMEOUT_S", "120")), breaker=breaker())
+    except ImportError as e:
+        logging.warning("LLM provider %s unavailable: %s", name, e)
+        return None
+    if name:
+        logging.warning("LLM provider %r is not configured", name)
+    return None
@@ -0,0 +1,344 @@
+# src/ocr_onnx.py
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import argparse
+import json
+import math
+import os
+import shutil
+import subprocess
+import threading
+
+import cv2
+import numpy as np
+
+# Те же модели PP-OCR (det DBNet, cls, rec CTC), экспортированные в ONNX, без paddlepaddle в процессе:
+# ONNX Runtime (OCR_BACKEND=onnx) или OpenVINO (OCR_BACKEND=openvino, пакет openvino).
+# OnnxOCR.ocr() повторяет PaddleOCR.ocr() из paddleocr 2.7 — препроцессинг, постобработку DB,
+# сортировку боксов, поворот по cls, CTC-декодирование, drop_score — и формат результата,
+# поэтому PaddleEngine (src/ocr_paddle.py) склеивает строки одинаково для обоих бэкендов.
+#
+# Папка моделей (OCR_ONNX_DIR, по умолчанию models/ppocr-ru) готовится один раз там, где стоит
+# paddleocr + paddle2onnx:  python -m src.ocr_onnx export models/ppocr-ru
+# В ней det.onnx, cls.onnx, rec.onnx, dict.txt и config.json (параметры из PaddleOCR.args).
+
+RUNTIMES = ("onnx", "openvino")
+
+# Значения по умолчанию paddleocr 2.7 (tools/infer/utility.parse_args); config.json их перекрывает
+DEFAULTS: Dict[str, Any] = {
+    "det_limit_side_len": 960,
+    "det_limit_type": "max",
+    "det_db_thresh": 0.3,
+    "det_db_box_thresh": 0.6,
+    "det_db_unclip_ratio": 1.5,
+    "max_candidates": 1000,
+    "det_box_min_size": 3,
+    "use_angle_cls": False,
+    "cls_image_shape": "3,48,192",
+    "cls_batch_num": 6,
+    "cls_thresh": 0.9,
+    "rec_image_shape": "3,48,320",
+    "rec_batch_num": 6,
+    "use_space_char": True,
+    "drop_score": 0.5,
+}
+_DET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+_DET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+def _shape(s: str | Sequence[int]) -> Tuple[int, int, int]:
+    c, h, w = (int(v) for v in (s.split(",") if isinstance(s, str) else s))
+    return c, h, w
+
+
+class _Session:
+    """Один ONNX-граф на ONNX Runtime или OpenVINO: run(x) → первый выход."""
+
+    def __init__(self, path: Path, runtime: str, threads: int, inter_threads: int) -> None:
+        self.runtime = runtime
+        if runtime == "openvino":
+            import openvino as ov
+            core = ov.Core()
+            self._compiled = core.compile_model(str(path), "CPU", {
+                "INFERENCE_NUM_THREADS": threads,
+                "PERFORMANCE_HINT": "LATENCY",
+            })
+            self._local = threading.local()  # infer request не потокобезопасен — свой на поток
+        else:
+            import onnxruntime as ort
+            so = ort.SessionOptions()
+            so.intra_op_num_threads = threads
+            so.inter_op_num_threads = inter_threads
+            so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self._sess = ort.InferenceSession(str(path), so, providers=["CPUExecutionProvider"])
+            self._input = self._sess.get_inputs()[0].name
+
+    def run(self, x: np.ndarray) -> np.ndarray:
+        if self.runtime == "openvino":
+            req = getattr(self._local, "req", None)
+            if req is None:
+                req = self._local.req = self._compiled.create_infer_request()
+            return np.array(req.infer([x])[0])
+        return self._sess.run(None, {self._input: x})[0]
+
+
+# --- детектор (DBNet) ---
+
+def _det_resize(img: np.ndarray, limit: int, limit_type: str) -> Tuple[np.ndarray, float, float]:
+    h, w = img.shape[:2]
+    if limit_type == "max":
+        ratio = float(limit) / max(h, w) if max(h, w) > limit else 1.0
+    elif limit_type == "min":
+        ratio = float(limit) / min(h, w) if min(h, w) < limit else 1.0
+    else:  # resize_long
+        ratio = float(limit) / max(h, w)
+    rh = max(int(round(int(h * ratio) / 32) * 32), 32)
+    rw = max(int(round(int(w * ratio) / 32) * 32), 32)
+    return cv2.resize(img, (rw, rh)), rh / float(h), rw / float(w)
+
+
+def _mini_box(contour: np.ndarray) -> Tuple[List[np.ndarray], float]:
+    rect = cv2.minAreaRect(contour)
+    pts = sorted(list(cv2.boxPoints(rect)), key=lambda p: p[0])
+    i1, i4 = (0, 1) if pts[1][1] > pts[0][1] else (1, 0)
+    i2, i3 = (2, 3) if pts[3][1] > pts[2][1] else (3, 2)
+    return [pts[i1], pts[i2], pts[i3], pts[i4]], min(rect[1])
+
+
+def _box_score(pred: np.ndarray, box: np.ndarray) -> float:
+    h, w = pred.shape[:2]
+    box = box.copy()
+    x0 = int(np.clip(np.floor(box[:, 0].min()), 0, w - 1))
+    x1 = int(np.clip(np.ceil(box[:, 0].max()), 0, w - 1))
+    y0 = int(np.clip(np.floor(box[:, 1].min()), 0, h - 1))
+    y1 = int(np.clip(np.ceil(box[:, 1].max()), 0, h - 1))
+    mask = np.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=np.uint8)
+    box[:, 0] -= x0
+    box[:, 1] -= y0
+    cv2.fillPoly(mask, box.reshape(1, -1, 2).astype(np.int32), 1)
+    return cv2.mean(pred[y0:y1 + 1, x0:x1 + 1], mask)[0]
+
+
+def _unclip(box: np.ndarray, ratio: float) -> np.ndarray:
+    """Расширение бокса на area·ratio/perimeter (как DBPostProcess.unclip)."""
+    x, y = box[:, 0].astype(np.float64), box[:, 1].astype(np.float64)
+    area = 0.5 * abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1)))
+    length = float(np.sum(np.hypot(np.diff(np.append(x, x[0])), np.diff(np.append(y, y[0])))))
+    distance = area * ratio / max(length, 1e-6)
+    try:
+        import pyclipper
+        off = pyclipper.PyclipperOffset()
+        off.AddPath(box.tolist(), pyclipper.JT_ROUND, pyclipper.ET_CLOSEDPOLYGON)
+        return np.array(off.Execute(distance), dtype=np.float32).reshape(-1, 2)
+    except ImportError:
+        # бокс — прямоугольник, так что minAreaRect от скруглённого контура = прямоугольник шире на distance
+        (cx, cy), (rw, rh), ang = cv2.minAreaRect(box.astype(np.float32))
+        return cv2.boxPoints(((cx, cy), (rw + 2 * distance, rh + 2 * distance), ang))
+
+
+def _order_clockwise(pts: np.ndarray) -> np.ndarray:
+    rect = np.zeros((4, 2), dtype=np.float32)
+    s = pts.sum(axis=1)
+    rect[0], rect[2] = pts[np.argmin(s)], pts[np.argmax(s)]
+    tmp = np.delete(pts, (np.argmin(s), np.argmax(s)), axis=0)
+    diff = np.diff(np.array(tmp), axis=1)
+    rect[1], rect[3] = tmp[np.argmin(diff)], tmp[np.argmax(diff)]
+    return rect
+
+
+def _sorted_boxes(boxes: List[np.ndarray]) -> List[np.ndarray]:
+    """Сверху вниз, слева направо; боксы одной строки (±10 px) — по x."""
+    out = sorted(boxes, key=lambda b: (b[0][1], b[0][0]))
+    for i in range(len(out) - 1):
+        for j in range(i, -1, -1):
+            if abs(out[j + 1][0][1] - out[j][0][1]) < 10 and out[j + 1][0][0] < out[j][0][0]:
+                out[j], out[j + 1] = out[j + 1], out[j]
+            else:
+                break
+    return out
+
+
+def _crop(img: np.ndarray, pts: np.ndarray) -> np.ndarray:
+    w = int(max(np.linalg.norm(pts[0] - pts[1]), np.linalg.norm(pts[2] - pts[3])))
+    h = int(max(np.linalg.norm(pts[0] - pts[3]), np.linalg.norm(pts[1] - pts[2])))
+    dst = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    m = cv2.getPerspectiveTransform(pts.astype(np.float32), dst)
+    out = cv2.warpPerspective(img, m, (w, h), borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC)
+    if out.shape[0] * 1.0 / max(out.shape[1], 1) >= 1.5:
+        out = np.rot90(out)
+    return out
+
+
+def _resize_norm(img: np.ndarray, c: int, h: int, w: int) -> np.ndarray:
+    """Высота h, ширина по пропорции (не больше w), нормировка в [-1, 1], паддинг нулями до w."""
+    rw = min(w, int(math.ceil(h * img.shape[1] / float(img.shape[0]))))
+    x = cv2.resize(img, (rw, h)).astype(np.float32).transpose((2, 0, 1)) / 255.0
+    out = np.zeros((c, h, w), dtype=np.float32)
+    out[:, :, :rw] = (x - 0.5) / 0.5
+    return out
+
+
+class OnnxOCR:
+    """
+    Замена PaddleOCR с тем же ocr(img, det=, rec=, cls=). Сессии ONNX Runtime потокобезопасны,
+    поэтому один экземпляр можно делить между потоками (у OpenVINO — свой infer request на поток).
+    """
+
+    def __init__(self, model_dir: str | Path, *, runtime: str = "onnx", threads: Optional[int] = None,
+                 inter_threads: int = 1, **params: Any) -> None:
+        if runtime not in RUNTIMES:
+            raise ValueError(f"runtime: ожидается одно из {RUNTIMES}, получено {runtime!r}")
+        self.model_dir = Path(model_dir)
+        if not (self.model_dir / "det.onnx").exists():
+            raise RuntimeError(f"В {self.model_dir} нет det.onnx — подготовьте: python -m src.ocr_onnx export {self.model_dir}")
+        cfg_path = self.model_dir / "config.json"
+        cfg = json.loads(cfg_path.read_text(encoding="utf-8")) if cfg_path.exists() else {}
+        # параметры PaddleEngine (пороги DB, rec_image_shape, drop_score...) важнее сохранённых при экспорте
+        p = {**DEFAULTS, **cfg, **{k: v for k, v in params.items() if k in DEFAULTS}}
+        self.p = p
+        threads = int(threads or params.get("cpu_threads") or os.cpu_count() or 1)
+
+        self.det = _Session(self.model_dir / "det.onnx", runtime, threads, inter_threads)
+        self.rec = _Session(self.model_dir / "rec.onnx", runtime, threads, inter_threads)
+        self.cls = (_Session(self.model_dir / "cls.onnx", runtime, threads, inter_threads)
+                    if p["use_angle_cls"] and (self.model_dir / "cls.onnx").exists() else None)
+        chars = (self.model_dir / "dict.txt").read_text(encoding="utf-8").splitlines()
+        self.characters = ["blank"] + chars + ([" "] if p["use_space_char"] else [])
+
+    # --- этапы ---
+    def detect(self, img: np.ndarray) -> List[np.ndarray]:
+        p = self.p
+        h, w = img.shape[:2]
+        resized, _, _ = _det_resize(img, int(p["det_limit_side_len"]), p["det_limit_type"])
+        x = ((resized.astype(np.float32) / 255.0 - _DET_MEAN) / _DET_STD).transpose((2, 0, 1))[None]
+        pred = self.det.run(np.ascontiguousarray(x))[0, 0]
+        bitmap = pred > float(p["det_db_thresh"])
+        ph, pw = bitmap.shape
+        outs = cv2.findContours((bitmap * 255).astype(np.uint8), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        contours = outs[0] if len(outs) == 2 else outs[1]
+        min_size = int(p["det_box_min_size"])
+        boxes: List[np.ndarray] = []
+        for contour in contours[:int(p["max_candidates"])]:
+            pts, side = _mini_box(contour)
+            if side < min_size:
+                continue
+            pts = np.array(pts)
+            if _box_score(pred, pts.reshape(-1, 2)) < float(p["det_db_box_thresh"]):
+                continue
+            box, side = _mini_box(_unclip(pts, float(p["det_db_unclip_ratio"])).reshape(-1, 1, 2))
+            if side < min_size + 2:
+                continue
+            box = np.array(box)
+            box[:, 0] = np.clip(np.round(box[:, 0] / pw * w), 0, w)
+            box[:, 1] = np.clip(np.round(box[:, 1] / ph * h), 0, h)
+            box = _order_clockwise(box.astype(np.int32))
+            box[:, 0] = np.clip(box[:, 0], 0, w - 1).astype(np.int32)
+            box[:, 1] = np.clip(box[:, 1], 0, h - 1).astype(np.int32)
+            if int(np.linalg.norm(box[0] - box[1])) <= 3 or int(np.linalg.norm(box[0] - box[3])) <= 3:
+                continue
+            boxes.append(box)
+        return _sorted_boxes(boxes)
+
+    def classify(self, crops: List[np.ndarray]) -> List[np.ndarray]:
+        """Строки, перевёрнутые на 180° с уверенностью > cls_thresh, разворачиваются."""
+        if self.cls is None or not crops:
+            return crops
+        c, h, w = _shape(self.p["cls_image_shape"])
+        order = np.argsort([im.shape[1] / float(im.shape[0]) for im in crops])
+        crops = list(crops)
+        n = int(self.p["cls_batch_num"])
+        for b in range(0, len(crops), n):
+            idx = order[b:b + n]
+            prob = self.cls.run(np.stack([_resize_norm(crops[i], c, h, w) for i in idx]))
+            for i, pr in zip(idx, prob):
+                if int(pr.argmax()) == 1 and float(pr[1]) > float(self.p["cls_thresh"]):
+                    crops[i] = cv2.rotate(crops[i], cv2.ROTATE_180)
+        return crops
+
+    def recognize(self, crops: List[np.ndarray]) -> List[Tuple[str, float]]:
+        c, h, w = _shape(self.p["rec_image_shape"])
+        order = np.argsort([im.shape[1] / float(im.shape[0]) for im in crops])
+        res: List[Tuple[str, float]] = [("", 0.0)] * len(crops)
+        n = int(self.p["rec_batch_num"])
+        for b in range(0, len(crops), n):
+            idx = order[b:b + n]
+            ratio = max([w / h] + [crops[i].shape[1] / float(crops[i].shape[0]) for i in idx])
+            bw = int(h * ratio)
+            preds = self.rec.run(np.stack([_resize_norm(crops[i], c, h, bw) for i in idx]))
+            for i, text_conf in zip(idx, self._ctc_decode(preds)):
+                res[i] = text_conf
+        return res
+
+    def _ctc_decode(self, preds: np.ndarray) -> List[Tuple[str, float]]:
+        ids, probs = preds.argmax(axis=2), preds.max(axis=2)
+        out: List[Tuple[str, float]] = []
+        for seq, pr in zip(ids, probs):
+            keep = np.ones(len(seq), dtype=bool)
+            keep[1:] = seq[1:] != seq[:-1]
+            keep &= seq != 0
+            conf = pr[keep]
+            out.append(("".join(self.characters[i] for i in seq[keep] if i < len(self.characters)),
+                        float(conf.mean()) if len(conf) else 0.0))
+        return out
+
+    # --- совместимость с PaddleOCR.ocr ---
+    def ocr(self, img: np.ndarray, det: bool = True, rec: bool = True, cls: bool = True) -> List[Any]:
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        elif img.shape[2] == 4:
+            img = np.ascontiguousarray(img[..., :3])
+        if not det:
+            crops = self.classify([img]) if cls else [img]
+            return [list(self.recognize(crops))]
+        boxes = self.detect(img)
+        if not boxes:
+            return [None]
+        crops = [_crop(img, b.astype(np.float32)) for b in boxes]
+        if cls:
+            crops = self.classify(crops)
+        drop = float(self.p["drop_score"])
+        kept = [[b.tolist(), (t, s)] for b, (t, s) in zip(boxes, self.recognize(crops)) if s >= drop]
+        return [kept or None]
+
+
+# --- экспорт моделей paddleocr → ONNX ---
+
+_CONFIG_KEYS = tuple(DEFAULTS) + ("lang", "ocr_version", "det_algorithm", "rec_algorithm")
+
+
+def export(out_dir: str | Path, lang: str = "ru", opset: int = 11) -> Path:
+    """Скачивает (через paddleocr) det/cls/rec inference-модели и конвертирует paddle2onnx."""
+    from paddleocr import PaddleOCR
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    args = PaddleOCR(lang=lang, use_angle_cls=True, show_log=False).args
+    for name, d in (("det", args.det_model_dir), ("cls", args.cls_model_dir), ("rec", args.rec_model_dir)):
+        subprocess.run([
+            "paddle2onnx", "--model_dir", str(d),
+            "--model_filename", "inference.pdmodel", "--params_filename", "inference.pdiparams",
+            "--save_file", str(out / f"{name}.onnx"), "--opset_version", str(opset),
+            "--enable_onnx_checker", "True",
+        ], check=True)
+    shutil.copyfile(args.rec_char_dict_path, out / "dict.txt")
+    cfg = {k: getattr(args, k) for k in _CONFIG_KEYS if hasattr(args, k)}
+    (out / "config.json").write_text(json.dumps(cfg, ensure_ascii=False, indent=2), encoding="utf-8")
+    return out
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.ocr_onnx", description="PP-OCR в ONNX: экспорт моделей")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("export", help="paddleocr-модели → det/cls/rec.onnx + dict.txt + config.json")
+    p.add_argument("out_dir")
+    p.add_argument("--lang", default="ru")
+    p.add_argument("--opset", type=int, default=11)
+    a = ap.parse_args(argv)
+    print(export(a.out_dir, lang=a.lang, opset=a.opset))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
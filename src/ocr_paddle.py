@@ -1,14 +1,29 @@
 # src/ocr_paddle.py
 from __future__ import annotations
-from typing import List, Dict, Any, Tuple
+from typing import TYPE_CHECKING, List, Dict, Any, Tuple, Callable
 from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+import os
 import numpy as np
 from PIL import Image
 
-try:
+from utils.page_buffer import as_array, image_size
+from utils.tiling import tile_grid, touches_inner_edge, dedup_boxes
+
+if TYPE_CHECKING:
     from paddleocr import PaddleOCR
-except ImportError as e:
-    raise RuntimeError("PaddleOCR не установлен. Установи: pip install 'paddleocr>=2.7'") from e
+
+# Бэкенд инференса (OCR_BACKEND): paddle — paddlepaddle 2.6; onnx / openvino — те же модели
+# в ONNX (src/ocr_onnx.py), paddlepaddle тогда не импортируется вовсе.
+BACKENDS = ("paddle", "onnx", "openvino")
+
+
+def _paddle_ocr(**kwargs: Any) -> PaddleOCR:
+    try:
+        from paddleocr import PaddleOCR
+    except ImportError as e:
+        raise RuntimeError("PaddleOCR не установлен. Установи: pip install 'paddleocr>=2.7'") from e
+    return PaddleOCR(**kwargs)
 
 # --- нормализация: латиница ↔ кириллица, частые путаницы ---
 LATIN_TO_CYR = str.maketrans({
@@ -59,9 +74,10 @@ class OCRItem:
     conf: float
 
 class PaddleEngine:
-    def __init__(self, lang: str = "ru"):
+    def __init__(self, lang: str = "ru", *, tile_workers: int | None = None, cpu_threads: int | None = None,
+                 backend: str | None = None):
         # Безопасные параметры, совместимые с 2.7.x
-        self.ocr = PaddleOCR(
+        self._ocr_kwargs = dict(
             use_angle_cls=True,
             lang=lang,
             det=True, rec=True,
@@ -74,6 +90,33 @@ class PaddleEngine:
             drop_score=0.10,  # не выкидывать слабые символы слишком агрессивно
             # rec_batch_num=8,            # можно поднять, если хватает RAM/VRAM
         )
+        if cpu_threads:
+            self._ocr_kwargs["cpu_threads"] = cpu_threads  # см. src/engines.py: PaddlePool делит ядра
+        self.backend = (backend or os.getenv("OCR_BACKEND", "paddle")).lower()
+        if self.backend not in BACKENDS:
+            raise ValueError(f"OCR_BACKEND: ожидается одно из {BACKENDS}, получено {self.backend!r}")
+        self.ocr = self._new_ocr()
+
+        # Тайловый режим: предиктор Paddle не потокобезопасен, а лишний экземпляр на поток
+        # удвоил бы память моделей и вылез бы за долю ядер от PaddlePool (cpu_threads) —
+        # поэтому paddle идёт по тайлам последовательно на своём экземпляре. Параллельно —
+        # только сессии ONNX Runtime/OpenVINO, они общие для потоков.
+        workers = 1 if self.backend == "paddle" else int(tile_workers or os.getenv("OCR_TILE_WORKERS", "2"))
+        self.tile_workers = max(1, workers)
+        self._tile_pool: ThreadPoolExecutor | None = None
+
+    def _new_ocr(self) -> PaddleOCR:
+        if self.backend == "paddle":
+            return _paddle_ocr(**self._ocr_kwargs)
+        from src.ocr_onnx import OnnxOCR
+        # OCR_ONNX_THREADS — intra-op (по умолчанию доля ядер от PaddlePool), OCR_ONNX_INTER_THREADS — inter-op
+        return OnnxOCR(
+            os.getenv("OCR_ONNX_DIR", "models/ppocr-ru"),
+            runtime=self.backend,
+            threads=int(os.getenv("OCR_ONNX_THREADS", "0")) or self._ocr_kwargs.get("cpu_threads"),
+            inter_threads=int(os.getenv("OCR_ONNX_INTER_THREADS", "1")),
+            **self._ocr_kwargs,
+        )
 
     @staticmethod
     def _poly_to_ltrb(poly: List[List[float]]) -> List[int]:
@@ -135,22 +178,39 @@ class PaddleEngine:
             merged.append(OCRItem(text=text, bbox=bbox, conf=conf))
         return merged
 
-    def run(self, img: Image.Image) -> List[Dict[str, Any]]:
+    @staticmethod
+    def is_garbage(text: str, conf: float) -> bool:
+        """Очень короткая строка с низкой уверенностью — скорее всего мусор."""
+        return len(text) <= 2 and conf < 0.6
+
+    def run(self, img: Image.Image | np.ndarray, *, keep_weak: bool = False) -> List[Dict[str, Any]]:
         """
         Возвращает список элементов: {"text": "...", "bbox": [x1,y1,x2,y2], "conf": 0.xx}
         где каждый элемент — уже строка (а не «слово»)
+
+        keep_weak=True — не выкидывать «мусорные» строки, а помечать их "weak": True
+        (нужно для адаптивного второго прохода, см. src/second_pass.py).
         """
-        arr = np.array(img)
+        raw_items = self._detect(self.ocr, as_array(img))
+        return self._finalize(raw_items, keep_weak=keep_weak)
+
+    def _detect(self, ocr: PaddleOCR, arr: np.ndarray, offset: Tuple[int, int] = (0, 0)) -> List[OCRItem]:
+        """Детекция + распознавание «слов»; bbox сдвигаются на offset (координаты тайла → страницы)."""
         # result формата: [ [ [poly, text, conf], ... ] ] на страницу
-        res = self.ocr.ocr(arr, cls=True)
+        res = ocr.ocr(arr, cls=True)
         raw_items: List[OCRItem] = []
+        dx, dy = offset
 
         if res and res[0]:
             for poly, (txt, sc) in res[0]:
                 bbox = self._poly_to_ltrb(poly) if poly else None
+                if bbox and (dx or dy):
+                    bbox = [bbox[0] + dx, bbox[1] + dy, bbox[2] + dx, bbox[3] + dy]
                 txt = normalize_ru(txt)
                 raw_items.append(OCRItem(text=txt, bbox=bbox, conf=float(sc or 0.0)))
+        return raw_items
 
+    def _finalize(self, raw_items: List[OCRItem], *, keep_weak: bool) -> List[Dict[str, Any]]:
         # Сортировка + склейка в строки
         raw_items = self._sort_boxes(raw_items)
         line_items = self._merge_tokens_to_lines(raw_items, y_tol=10)
@@ -158,8 +218,75 @@ class PaddleEngine:
         # Фильтрация мусора: выкидываем очень короткие строки с низкой уверенностью
         cleaned = []
         for it in line_items:
-            if (len(it.text) <= 2 and it.conf < 0.6):
+            if self.is_garbage(it.text, it.conf):
+                if keep_weak:
+                    cleaned.append({"text": it.text, "bbox": it.bbox, "conf": it.conf, "weak": True})
                 continue
             cleaned.append({"text": it.text, "bbox": it.bbox, "conf": it.conf})
 
         return cleaned
+
+    def _run_tile(self, img: Image.Image | np.ndarray, box: Tuple[int, int, int, int],
+                  preprocess: Callable[[np.ndarray], np.ndarray] | None) -> List[Tuple[OCRItem, bool]]:
+        x1, y1, x2, y2 = box
+        if isinstance(img, Image.Image):
+            tile = np.array(img.crop(box))
+        else:
+            # именно копия: срез на всю ширину страницы — непрерывный вид, и preprocess(inplace)
+            # переписал бы общий буфер страницы (перекрытия — дважды, из нескольких потоков)
+            tile = img[y1:y2, x1:x2].copy()
+        if preprocess is not None:
+            tile = preprocess(tile)  # размер тайла не должен меняться (без апскейла/паддинга)
+        items = self._detect(self.ocr, as_array(tile), offset=(x1, y1))
+        del tile
+        w, h = image_size(img)
+        return [(it, bool(it.bbox) and touches_inner_edge(it.bbox, box, w, h)) for it in items]
+
+    def run_tiled(
+        self,
+        img: Image.Image | np.ndarray,
+        *,
+        tile: int = 2048,
+        overlap: int = 192,
+        preprocess: Callable[[np.ndarray], np.ndarray] | None = None,
+        keep_weak: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """
+        Тайловый режим для очень больших сканов (A3 @ 600 DPI и т.п.).
+
+        Страница режется на перекрывающиеся тайлы, детекция идёт по тайлам (для ONNX —
+        параллельно в tile_workers потоков, для paddle — последовательно), боксы переводятся
+        в координаты страницы, дубли на швах удаляются, затем общая склейка в строки.
+        Пиковая память на изображения — порядка tile_workers тайлов, а не вся страница;
+        модели не копируются. Мелкий текст не теряется из-за даунскейла внутри детектора.
+        """
+        w, h = image_size(img)
+        boxes = tile_grid(w, h, tile=tile, overlap=overlap)
+        if self.tile_workers == 1 or len(boxes) == 1:
+            per_tile = [self._run_tile(img, b, preprocess) for b in boxes]
+        else:
+            if self._tile_pool is None:
+                self._tile_pool = ThreadPoolExecutor(max_workers=self.tile_workers,
+                                                     thread_name_prefix="paddle-tile")
+            per_tile = list(self._tile_pool.map(lambda b: self._run_tile(img, b, preprocess), boxes))
+
+        tagged = [pair for chunk in per_tile for pair in chunk]
+        with_box = [(it, cl) for it, cl in tagged if it.bbox]
+        keep = dedup_boxes([it.bbox for it, _ in with_box],
+                           clipped=[cl for _, cl in with_box],
+                           confs=[it.conf for it, _ in with_box])
+        raw_items = [with_box[i][0] for i in keep]
+        return self._finalize(raw_items, keep_weak=keep_weak)
+
+    def recognize(self, crop: Image.Image | np.ndarray) -> Tuple[str, float]:
+        """
+        Только распознавание (без детектора) для одного фрагмента-строки.
+        Возвращает (текст, уверенность); пустой результат — ("", 0.0).
+        """
+        arr = as_array(crop)
+        # det=False → формат: [ [ (text, conf) ] ]
+        res = self.ocr.ocr(arr, det=False, rec=True, cls=True)
+        if not res or not res[0]:
+            return "", 0.0
+        txt, sc = res[0][0]
+        return normalize_ru(txt or ""), float(sc or 0.0)
@@ -1,37 +1,41 @@
 # src/pipeline.py
 from pathlib import Path
-from typing import Dict, Any, List
-from PIL import Image, ImageDraw
+from typing import Dict, Any, List, Tuple, Callable
+from PIL import Image
+import numpy as np
 import re
 import unicodedata
 import logging
+import os
 
-from src.preprocess import pdf_to_images
-from utils.ocr_utils import preprocess_for_ocr
+from src.preprocess import pdf_to_arrays
+from utils.ocr_utils import preprocess_for_ocr, triage_page, rotate_image, PREPROC_PROFILES
+from utils.page_buffer import image_size
 from src.ocr_paddle import PaddleEngine
-from src.vt_donut import DonutEngine
-from src.post_llm import LLMClient
+from src.engines import get_engines  # <-- общие «тёплые» движки на процесс
 from src.post_rules import fix_fields
+from src.post_validate import needs_review, validate_fields
 from src.section_parser import build_sections  # <-- парсер разделов
-from src.post_ocr_corrector import PostCorrector  # <-- автокорректор OCR-текста
+from src.second_pass import SecondPass  # <-- адаптивный второй проход по слабым строкам
+from src.deadline import Deadline
+from src.dedup import Match, file_sha256, fingerprint
+from src.doc_classifier import thumb_features
+from src.uploads import params_digest
 
 # Регулярки для быстрых подсказок LLM
 RE_IBAN = re.compile(r"\bKZ\d{20}\b", flags=re.I)
 RE_BIN = re.compile(r"\b\d{12}\b")
 
-# Инициализация движков
-paddle = PaddleEngine(lang="ru")
-donut = DonutEngine()
-llm = LLMClient()
-corrector = PostCorrector(enable_headings=True, enable_terms=True)
-
-
-def _pages_from_file(path: str | Path) -> List[Image.Image]:
-    """Загружает изображения из PDF или из файла-изображения."""
+def _pages_from_file(path: str | Path) -> List[np.ndarray]:
+    """
+    Загружает страницы из PDF или из файла-изображения как RGB-массивы.
+    Дальше по цепочке страница идёт одним буфером, PIL — только на выходе.
+    """
     p = Path(path)
     if p.suffix.lower() == ".pdf":
-        return pdf_to_images(p)
-    return [Image.open(p).convert("RGB")]
+        return pdf_to_arrays(p)
+    with Image.open(p) as im:
+        return [np.array(im.convert("RGB"))]
 
 
 def _poly_to_ltrb(poly: List[List[float]]) -> List[int]:
@@ -63,137 +67,390 @@ def _sanitize_for_llm(s: str, *, max_len: int = 8000) -> str:
     return s
 
 
+def _preprocess_page(img: np.ndarray, preproc_mode: str) -> Tuple[np.ndarray | None, Dict[str, Any] | None]:
+    """
+    Препроцессинг страницы по выбранному режиму.
+    preproc_mode="auto": триаж по миниатюре выбирает самый дешёвый достаточный профиль;
+    пустые страницы не обрабатываются (возвращается None).
+    Исходный буфер страницы после вызова не используется — он конвертируется на месте.
+    """
+    if preproc_mode == "auto":
+        tri = triage_page(img)
+        if tri.profile == "skip":
+            return None, tri.as_dict()
+        return preprocess_for_ocr(img, inplace=True, as_array=True, **tri.preprocess_kwargs()), tri.as_dict()
+    kw = PREPROC_PROFILES.get(preproc_mode, PREPROC_PROFILES["soft"])
+    return preprocess_for_ocr(img, inplace=True, as_array=True, **kw), None
+
+
+def _needs_tiling(img: np.ndarray, tile_trigger: int) -> bool:
+    return tile_trigger > 0 and max(image_size(img)) > tile_trigger
+
+
+def _tiled_page(img: np.ndarray, preproc_mode: str) -> Tuple[np.ndarray | None, Dict[str, Any], Any]:
+    """Страница для тайлового OCR: поворот по углу триажа и профиль препроцессинга тайлов (None — пустая)."""
+    tri = triage_page(img)
+    if preproc_mode == "auto" and tri.profile == "skip":
+        return None, {}, tri
+    kw = tri.preprocess_kwargs() if preproc_mode == "auto" else \
+        dict(PREPROC_PROFILES.get(preproc_mode, PREPROC_PROFILES["soft"]))
+    kw.update(target_width=0, add_padding=0, do_deskew=False)
+    kw.pop("deskew_angle", None)
+    if abs(tri.skew) >= 0.3:
+        img = rotate_image(img, tri.skew)
+    return img, kw, tri
+
+
+def _ocr_tiled(paddle: PaddleEngine, img: np.ndarray, preproc_mode: str, *, tile_size: int, keep_weak: bool
+               ) -> Tuple[np.ndarray | None, List[dict], Dict[str, Any] | None]:
+    """
+    OCR очень большой страницы по тайлам: препроцессинг идёт по тайлу (без апскейла,
+    паддинга и поворота — координаты тайла должны совпадать со страницей), наклон
+    снимается один раз поворотом всей страницы по углу из триажа.
+    """
+    img, kw, tri = _tiled_page(img, preproc_mode)
+    if img is None:
+        return None, [], tri.as_dict()
+    items = paddle.run_tiled(
+        img,
+        tile=tile_size,
+        preprocess=lambda t: preprocess_for_ocr(t, inplace=True, as_array=True, **kw),
+        keep_weak=keep_weak,
+    )
+    return img, items, {**tri.as_dict(), "tiled": True}
+
+
 def run_pipeline(
     path: str | Path,
     doc_type_hint: str | None = None,
     *,
     conf_threshold: float = 0.5,
-    preproc_mode: str = "soft"
+    preproc_mode: str = "soft",
+    adaptive: bool = True,
+    tile_trigger: int = 5000,
+    tile_size: int = 2048,
+    return_pages: bool = False,
+    on_page: Callable[[int, int, List[dict]], None] | None = None,
+    deadline_s: float | None = None,
+    fix_text: bool = False,
+    dedup: bool = True,
 ):
     """
     Основной конвейер:
     - Загружает страницы
+    - Препроцессинг по профилю preproc_mode (по умолчанию "soft", как раньше); preproc_mode="auto":
+      быстрый триаж страницы → профиль препроцессинга (пустые пропускаются), так работает демо
     - Выполняет OCR (Пaddle) + автокоррекция русских OCR-ошибок
-    - Пробует классификацию документа (Donut) — безопасно
+    - Страницы больше tile_trigger px по длинной стороне идут в тайловый OCR
+    - adaptive=True: слабые строки (conf < conf_threshold) перечитываются
+      по кропу с жёстким препроцессингом, остальные страницы не платят ничего
+    - Определяет тип документа (src/doc_classifier.py) по первой странице с текстом; Donut — только при низкой уверенности
     - Передаёт текст в LLM — безопасно
     - Строит разделы
+
+    Возвращает (result, pages). Страницы (после препроцессинга, без разметки) отдаются
+    только при return_pages=True — для UI; bbox рисуются по запросу через src/render.py.
+    Пакетные/headless вызовы битмапов не держат.
+
+    on_page(idx, total, ocr_items) вызывается после OCR каждой страницы — для живого
+    прогресса и частичных результатов (см. src/jobs.py).
+
+    deadline_s — бюджет документа в секундах (по умолчанию OCR_DOC_DEADLINE_S, без лимита).
+    LLM-этап получает не больше LLM_BUDGET_S (45) из остатка; если времени не осталось
+    или провайдер недоступен, поля берутся из правил — документ не зависает на LLM.
+
+    fix_text=True — LLM-правка OCR-опечаток по кускам страниц (LLMClient.fix_pages)
+    до извлечения полей; правки со смещениями — в debug.llm_fix.
+
+    dedup=True — проверка по индексу отпечатков (src/dedup.py, DEDUP_MODE=reuse|flag|off):
+    тот же файл отдаёт готовый результат без OCR, тот же текст с теми же числами — поля
+    без LLM; похожие страницы/текст помечаются в meta.dedup. Переиспользуется только
+    результат, полученный с теми же параметрами (тип-подсказка, порог, препроцессинг,
+    adaptive, fix_text, тайлинг).
     """
-    pages = _pages_from_file(path)
-    out_pages: List[Image.Image] = []
-    ocr_pages: List[List[dict]] = []
-    all_text: List[str] = []
-    donut_guess = None
-    donut_error = None
-    llm_error = None
-
-    for img in pages:
-        # --- выбор препроцессинга ---
-        if preproc_mode == "soft":
-            img2 = preprocess_for_ocr(img)
-        else:
-            img2 = preprocess_for_ocr(img, use_clahe=False, do_unsharp=True)
-
-        # --- OCR ---
-        ocr_raw = paddle.run(img2)
-
-        # Нормализация bbox + фильтр по уверенности
-        ocr_norm: List[dict] = []
-        for o in ocr_raw:
-            conf = float(o.get("conf", o.get("score", 0.0)) or 0.0)
-            if conf < conf_threshold:
-                continue
+    env_deadline = os.getenv("OCR_DOC_DEADLINE_S")
+    deadline = Deadline(deadline_s if deadline_s is not None else (float(env_deadline) if env_deadline else None))
+    eng = get_engines()
+    # допуск по памяти: тяжёлая часть (страницы в памяти + OCR) — только при свободных ресурсах
+    reuse = os.getenv("DEDUP_MODE", "reuse") == "reuse"
+    with eng.admission.admit():
+        pages = _pages_from_file(path)
 
-            bb = o.get("bbox")
-            if bb and isinstance(bb, list) and len(bb) == 4 and isinstance(bb[0], (list, tuple)):
-                bb = _poly_to_ltrb(bb)
-            elif bb and isinstance(bb, dict):
-                x = bb.get("x", bb.get("left", 0))
-                y = bb.get("y", bb.get("top", 0))
-                w = bb.get("w", bb.get("width", 0))
-                h = bb.get("h", bb.get("height", 0))
-                bb = [int(x), int(y), int(x + w), int(y + h)]
-            elif bb and isinstance(bb, list) and len(bb) == 4:
-                bb = list(map(int, bb))
+        # --- дедупликация: отпечатки страниц дёшевы (миниатюры), считаются до OCR ---
+        fp = page_dup = None
+        # от этих параметров зависит результат: готовый переиспользуется только при тех же
+        run_params = params_digest({"doc_type_hint": doc_type_hint, "conf_threshold": conf_threshold,
+                                    "preproc_mode": preproc_mode, "adaptive": adaptive, "fix_text": fix_text,
+                                    "tile_trigger": tile_trigger, "tile_size": tile_size})
+        if dedup and eng.dedup is not None:
+            try:
+                fp = fingerprint(pages, sha256=file_sha256(path))
+                page_dup = eng.dedup.find_pages(fp, params=run_params, with_result=reuse)
+            except Exception as e:
+                logging.warning("dedup lookup failed: %s", e)
+            if reuse and page_dup is not None and page_dup.reusable and page_dup.result is not None:
+                return _reuse_result(page_dup, pages, preproc_mode=preproc_mode, tile_trigger=tile_trigger,
+                                     return_pages=return_pages, on_page=on_page)
+
+        out_pages: List[np.ndarray] = []
+        ocr_pages: List[List[dict]] = []
+        all_text: List[str] = []
+        doc_class: Dict[str, Any] | None = None
+        llm_error = None
+        second_pass = SecondPass() if adaptive else None
+        triage: List[Dict[str, Any] | None] = []
+
+        n_pages = len(pages)
+        for pi in range(n_pages):
+            img, pages[pi] = pages[pi], None  # исходник страницы дальше не держим
+            # --- выбор препроцессинга + OCR ---
+            if _needs_tiling(img, tile_trigger):
+                with eng.paddle.acquire() as paddle:
+                    img2, ocr_raw, tri = _ocr_tiled(paddle, img, preproc_mode, tile_size=tile_size, keep_weak=adaptive)
             else:
-                bb = None
+                img2, tri = _preprocess_page(img, preproc_mode)
+                ocr_raw = []
+                if img2 is not None:
+                    with eng.paddle.acquire() as paddle:
+                        ocr_raw = paddle.run(img2, keep_weak=adaptive)
+            triage.append(tri)
+            if img2 is None:
+                # пустая страница: ни OCR, ни Donut
+                ocr_pages.append([])
+                if return_pages:
+                    out_pages.append(img)
+                if on_page:
+                    on_page(pi, n_pages, [])
+                continue
 
-            ocr_norm.append({
-                "text": o.get("text", "") or "",
-                "bbox": bb,
-                "conf": conf,
-            })
+            if second_pass is not None and ocr_raw:
+                with eng.paddle.acquire() as paddle:
+                    ocr_raw = second_pass.refine(paddle, img2, ocr_raw, conf_threshold=conf_threshold)
 
-        # --- Автокоррекция русских OCR-ошибок (латиница→кириллица, частые опечатки, заголовки) ---
-        try:
-            ocr_fixed = corrector.correct_items(ocr_norm)
-        except Exception as _:
-            ocr_fixed = ocr_norm  # не валим пайплайн
+            # Нормализация bbox + фильтр по уверенности
+            ocr_norm: List[dict] = []
+            for o in ocr_raw:
+                conf = float(o.get("conf", o.get("score", 0.0)) or 0.0)
+                if conf < conf_threshold or o.get("weak"):
+                    continue
 
-        ocr_pages.append(ocr_fixed)
-        all_text.append(" ".join(o["text"] for o in ocr_fixed if o.get("text")))
+                bb = o.get("bbox")
+                if bb and isinstance(bb, list) and len(bb) == 4 and isinstance(bb[0], (list, tuple)):
+                    bb = _poly_to_ltrb(bb)
+                elif bb and isinstance(bb, dict):
+                    x = bb.get("x", bb.get("left", 0))
+                    y = bb.get("y", bb.get("top", 0))
+                    w = bb.get("w", bb.get("width", 0))
+                    h = bb.get("h", bb.get("height", 0))
+                    bb = [int(x), int(y), int(x + w), int(y + h)]
+                elif bb and isinstance(bb, list) and len(bb) == 4:
+                    bb = list(map(int, bb))
+                else:
+                    bb = None
 
-        # --- Donut (классификатор) безопасно ---
-        try:
-            dj = donut.infer(img2)
-            if isinstance(dj, dict) and not donut_guess:
-                donut_guess = dj.get("document_type") or dj.get("doctype")
-        except Exception as e:
-            logging.warning("DonutEngine failed: %s", e)
-            donut_error = str(e)
+                ocr_norm.append({
+                    "text": o.get("text", "") or "",
+                    "bbox": bb,
+                    "conf": conf,
+                })
+
+            # --- Автокоррекция русских OCR-ошибок (латиница→кириллица, частые опечатки, заголовки) ---
+            try:
+                ocr_fixed = eng.corrector.correct_items(ocr_norm)
+            except Exception as _:
+                ocr_fixed = ocr_norm  # не валим пайплайн
+
+            ocr_pages.append(ocr_fixed)
+            all_text.append(" ".join(o["text"] for o in ocr_fixed if o.get("text")))
 
-        # --- отрисовка bbox ---
-        draw = ImageDraw.Draw(img2)
-        for o in ocr_fixed:
-            bb = o.get("bbox")
-            if bb:
-                x1, y1, x2, y2 = bb
-                draw.rectangle((x1, y1, x2, y2), outline=(0, 255, 0), width=1)
+            # --- тип документа: по первой странице с текстом, за миллисекунды ---
+            if doc_class is None and ocr_fixed:
+                doc_class = _classify_page(eng, ocr_fixed, img2, pi, doc_type_hint)
 
-        out_pages.append(img2)
+            if return_pages:
+                out_pages.append(img2)
+            if on_page:
+                on_page(pi, n_pages, ocr_fixed)
+
+    llm_deadline = deadline.sub(float(os.getenv("LLM_BUDGET_S", "45")))
+
+    # --- LLM-правка OCR-опечаток по кускам (опционально, параллельно) ---
+    llm_fix = None
+    if fix_text and eng.llm.enabled:
+        try:
+            fixed = eng.llm.fix_pages(ocr_pages, deadline=llm_deadline)
+            ocr_pages = fixed["pages"]
+            all_text = [" ".join(o["text"] for o in page if o.get("text")) for page in ocr_pages]
+            llm_fix = {"chunks": fixed["chunks"], "edits": fixed["edits"], "notes": fixed["notes"]}
+        except Exception as e:
+            logging.warning("LLMClient.fix_pages failed: %s", e)
 
     # --- агрегация текста и подсказок ---
     raw_text = " ".join(all_text)
-    doc_type = doc_type_hint or donut_guess or "receipt"
+    doc_type = doc_type_hint or (doc_class or {}).get("type") or "receipt"
+    donut_error = (doc_class or {}).pop("donut_error", None)
 
     hints = {
         "iban_candidates": list(set(RE_IBAN.findall(raw_text))),
         "bin_candidates": list(set(RE_BIN.findall(raw_text))),
     }
 
-    # --- LLM безопасно (санитайзер + try/except) ---
-    text_clean = _sanitize_for_llm(raw_text)
+    # --- разделы по исправленному OCR (нужны и для отбора контекста LLM) ---
     try:
-        fields = llm.map_to_fields(doc_type, text_clean, hints).get("fields", {})
-    except Exception as e:
-        logging.warning("LLMClient.map_to_fields failed: %s", e)
-        llm_error = str(e)
-        fields = {}
+        sections = build_sections(ocr_pages)
+    except Exception:
+        sections = []
+
+    # --- тот же текст с теми же числами уже обрабатывался: поля без LLM ---
+    text_dup = None
+    if fp is not None:
+        try:
+            fp.set_text(raw_text)
+            text_dup = eng.dedup.find_text(fp, params=run_params, with_result=reuse)
+        except Exception as e:
+            logging.warning("dedup text lookup failed: %s", e)
+    prev = text_dup.result if (reuse and text_dup is not None and text_dup.reusable) else None
+
+    # --- LLM безопасно (санитайзер + try/except) ---
+    # правила видят весь документ и разметку страниц; в LLM уходят только самые релевантные строки
+    text_clean = _sanitize_for_llm(raw_text, max_len=200_000)
+    field_sources: Dict[str, str] = {}
+    field_boxes: Dict[str, Any] = {}
+    llm_called = llm_batched = False
+    llm_context = None
+    llm_calls: List[Dict[str, Any]] = []
+    if prev is not None:
+        fields = dict(prev.get("fields") or {})
+        field_sources = {k: "dedup" for k in fields}
+        field_boxes = (prev.get("debug") or {}).get("field_boxes") or {}
+    else:
+        try:
+            mapped = eng.llm.map_to_fields(doc_type, text_clean, hints, layout=ocr_pages, sections=sections,
+                                           deadline=llm_deadline)
+            fields = mapped.get("fields", {})
+            field_sources = mapped.get("sources", {})
+            field_boxes = mapped.get("boxes", {})
+            llm_called = bool(mapped.get("llm_called"))
+            llm_batched = bool(mapped.get("llm_batched"))
+            llm_context = mapped.get("context")
+            llm_calls = mapped.get("calls", [])
+            llm_error = mapped.get("llm_error", llm_error)
+        except Exception as e:
+            logging.warning("LLMClient.map_to_fields failed: %s", e)
+            llm_error = str(e)
+            fields = {}
 
     fields = fix_fields(fields)
 
-    # --- разделы по исправленному OCR ---
+    # --- проверки полей (форматы, контрольные суммы, согласованность) ---
     try:
-        sections = build_sections(ocr_pages)
-    except Exception:
-        sections = []
+        validation = validate_fields(fields, raw_text, doc_type=doc_type)
+    except Exception as e:
+        logging.warning("validate_fields failed: %s", e)
+        validation = []
 
     result: Dict[str, Any] = {
         "docType": doc_type,
         "meta": {
-            "pages": len(pages),
+            "pages": n_pages,
             "lang": "ru",
             "confidence": 0.0,
             "preproc_mode": preproc_mode,
             "conf_threshold": conf_threshold,
+            "second_pass": second_pass.stats.as_dict() if second_pass else None,
+            "triage": triage if any(triage) else None,
+            "dedup": _dedup_meta(page_dup, text_dup, reused=prev is not None),
+            "doc_class": doc_class,
         },
         "fields": fields,
+        "validation": validation,
+        "needs_review": needs_review(validation),
         "lineItems": [],
         "sections": sections,
         "debug": {
             "ocr": ocr_pages,
             "llm_text_len": len(text_clean),
+            "llm_called": llm_called,
+            "llm_batched": llm_batched,
+            "llm_context": llm_context,
+            "llm_calls": llm_calls,
+            "llm_fix": llm_fix,
+            "field_sources": field_sources,
+            "field_boxes": field_boxes,
             "donut_error": donut_error,
             "llm_error": llm_error,
         },
     }
-    return result, out_pages
+    if fp is not None:
+        try:
+            eng.dedup.add(f"{fp.sha256}.{run_params}", fp, result, params=run_params)
+        except Exception as e:
+            logging.warning("dedup add failed: %s", e)
+    return result, [Image.fromarray(p) for p in out_pages]
+
+
+def _classify_page(eng, items: List[dict], img: np.ndarray, page: int, hint: str | None) -> Dict[str, Any]:
+    """
+    Тип документа: DocClassifier по OCR, разметке и миниатюре; Donut — только если классификатор
+    не уверен (confidence < DOC_CLASSIFIER_MIN_CONF) и DOC_TYPE_FALLBACK=donut. С подсказкой
+    типа классификатор всё равно считается: признаки (thumb/size) нужны для дообучения.
+    """
+    h, w = img.shape[:2]
+    out: Dict[str, Any] = {"source": "classifier", "page": page, "size": [w, h]}
+    try:
+        out["thumb"] = thumb_features(img)
+        pred = eng.classifier.predict(items, (w, h), out["thumb"])
+        out.update(pred.as_dict())
+    except Exception as e:
+        logging.warning("DocClassifier failed: %s", e)
+        pred = None
+    if hint:
+        out.update(type=hint, source="hint", predicted=pred.doc_type if pred else None)
+    elif (pred is None or pred.confidence < eng.classifier_min_conf) and eng.donut_fallback:
+        try:
+            donut = eng.get_donut()
+            with eng.donut_lock:
+                dj = donut.classify(img)
+            if isinstance(dj, dict) and dj.get("document_type"):
+                out.update(type=dj["document_type"], source="donut", predicted=pred.doc_type if pred else None)
+        except Exception as e:
+            logging.warning("DonutEngine failed: %s", e)
+            out["donut_error"] = str(e)
+    return out
+
+
+def _dedup_meta(page_dup: Match | None, text_dup: Match | None, *, reused: bool) -> Dict[str, Any] | None:
+    if page_dup is None and text_dup is None:
+        return None
+    return {
+        "pages": page_dup.as_dict() if page_dup else None,
+        "text": text_dup.as_dict() if text_dup else None,
+        "reused": reused,
+    }
+
+
+def _display_page(img: np.ndarray, preproc_mode: str, tile_trigger: int) -> np.ndarray:
+    """Страница в тех координатах, в которых считались bbox OCR (как out_pages в run_pipeline)."""
+    if _needs_tiling(img, tile_trigger):
+        base = _tiled_page(img, preproc_mode)[0]
+    else:
+        base = _preprocess_page(img, preproc_mode)[0]
+    return img if base is None else base
+
+
+def _reuse_result(dup: Match, pages: List[np.ndarray], *, preproc_mode: str, tile_trigger: int, return_pages: bool,
+                  on_page: Callable[[int, int, List[dict]], None] | None):
+    """
+    Готовый результат того же файла: без OCR и LLM, с пометкой meta.dedup.
+    bbox в debug.ocr — в координатах страницы после препроцессинга, поэтому для UI страницы
+    препроцессятся заново (параметры те же — иначе результат бы не переиспользовался).
+    """
+    result = dict(dup.result or {})
+    result["meta"] = {**(result.get("meta") or {}), "dedup": {"pages": dup.as_dict(), "text": None, "reused": True}}
+    ocr_pages = (result.get("debug") or {}).get("ocr") or []
+    if on_page:
+        for pi, items in enumerate(ocr_pages):
+            on_page(pi, len(ocr_pages), items)
+    if not return_pages:
+        return result, []
+    return result, [Image.fromarray(_display_page(p, preproc_mode, tile_trigger)) for p in pages]
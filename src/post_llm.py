@@ -1,21 +1,21 @@
+import math
 import os
 import re
 import time
 import json
 import random
-from typing import Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import asdict, dataclass
+from typing import Optional, Dict, Any, List, Sequence, Tuple
 
-import google.generativeai as genai
+from src.field_rules import FieldCandidate, extract_rule_fields, confident_fields, required_fields
+from src.field_layout import extract_layout_fields
+from src.llm_context import build_context
+from src.llm_batch import MicroBatcher
+from src.llm_providers import CallStats, LLMError, LLMProvider, make_provider
+from src.deadline import Deadline
 
-try:
-    from google.api_core import exceptions as gexc
-    GoogleAPIError = getattr(gexc, "GoogleAPIError", Exception)
-    ResourceExhausted = getattr(gexc, "ResourceExhausted", GoogleAPIError)
-except Exception:
-    class GoogleAPIError(Exception): ...
-    class ResourceExhausted(GoogleAPIError): ...
-
-MAX_CTX = 20000
+MIN_CALL_S = 2.0  # меньше этого остатка бюджета новый вызов LLM не начинаем
 
 SYSTEM_RU = (
     "Ты — система извлечения полей из финансовых документов на русском и казахском языках. "
@@ -49,6 +49,43 @@ def _response_schema() -> Dict[str, Any]:
         "required": ["fields"],
     }
 
+BATCH_NOTE_RU = (
+    "Во входе несколько документов, каждый начинается строкой «=== Документ id=... ===». "
+    'Верни JSON {"documents": [{"id": "...", "fields": {...}}]} — по одному элементу на каждый документ, '
+    "id копируй из заголовка. Поля одного документа не переносить в другой."
+)
+
+
+def _batch_response_schema() -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {
+            "documents": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "string"},
+                        "fields": _response_schema()["properties"]["fields"],
+                    },
+                    "required": ["id", "fields"],
+                },
+            }
+        },
+        "required": ["documents"],
+    }
+
+
+@dataclass
+class FieldsRequest:
+    """Запрос недостающих полей одного документа (уже с отобранным контекстом)."""
+    doc_type: str
+    fields: List[str]
+    hints: Dict[str, Any]
+    text: str
+    deadline: Optional[Deadline] = None
+
+
 FEW_SHOTS_RU = [
     {
         "text": "СЧЁТ № 123 от 10.09.2025\nПлательщик: ТОО «Ромашка»\nПолучатель: АО «Банк Демонстрации»\nIBAN: KZ12345678901234567890  BIC: HSBKKZKX\nК оплате: 12 345,67 ₸",
@@ -80,197 +117,331 @@ FEW_SHOTS_RU = [
     },
 ]
 
-_RU_MONTHS = {
-    "января": "01", "февраля": "02", "марта": "03", "апреля": "04",
-    "мая": "05", "июня": "06", "июля": "07", "августа": "08",
-    "сентября": "09", "октября": "10", "ноября": "11", "декабря": "12",
-}
-
-def _norm_num(s: str) -> str:
-    return s.replace(" ", "").replace("\u00A0", "").replace(",", ".")
-
-def _try_parse_ru_date(t: str) -> Optional[str]:
-    m = re.search(r"(?i)\b(0?[1-9]|[12]\d|3[01])\s+(" + "|".join(_RU_MONTHS.keys()) + r")\s+20(\d{2})\b", t)
-    if m:
-        dd = int(m.group(1))
-        mm = _RU_MONTHS[m.group(2).lower()]
-        yyyy = "20" + m.group(3)
-        return f"{int(yyyy):04d}-{int(mm):02d}-{dd:02d}"
-    return None
-
 class LLMClient:
-    def __init__(self) -> None:
-        api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    def __init__(self, provider: Optional[LLMProvider] = None) -> None:
         disabled = os.getenv("LLM_DISABLED", "").lower() in ("1", "true", "yes")
-        self.enabled = bool(api_key) and not disabled
-        if self.enabled:
-            genai.configure(api_key=api_key)
-
-        self.model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-pro")
-        self.generation_config = {
-            "response_mime_type": "application/json",
-            "response_schema": _response_schema(),
-            "temperature": 0.0,
-            "max_output_tokens": 512,
-        }
+        # gemini | openai | local (OpenAI-совместимый сервер), см. src/llm_providers.py
+        self.provider = None if disabled else (provider or make_provider())
+        self.enabled = self.provider is not None
+        self.ctx_tokens = int(os.getenv("LLM_CTX_TOKENS", "1500"))
+        self.max_output_tokens = 512
+
+        # пакетирование коротких документов (чеки): LLM_BATCH_SIZE > 1 включает
+        batch_size = int(os.getenv("LLM_BATCH_SIZE", "1"))
+        self.batch_max_tokens = int(os.getenv("LLM_BATCH_MAX_TOKENS", "600"))
+        self._batcher: Optional[MicroBatcher] = None
+        if self.enabled and batch_size > 1:
+            self._batcher = MicroBatcher(
+                self._ask_batch, self._ask_one,
+                max_size=batch_size,
+                max_wait=float(os.getenv("LLM_BATCH_WAIT_MS", "300")) / 1000.0,
+                workers=int(os.getenv("LLM_BATCH_WORKERS", "2")),
+                expired=lambda r: r.deadline is not None and r.deadline.expired,
+            )
+
+    @staticmethod
+    def _candidates(text: str, layout: Optional[List[List[Dict[str, Any]]]]) -> Dict[str, FieldCandidate]:
+        """Кандидаты правил по тексту и по разметке страниц; на каждое поле — более уверенный."""
+        cands = extract_rule_fields(text)
+        for k, c in (extract_layout_fields(layout) if layout else {}).items():
+            if k not in cands or c.score > cands[k].score:  # при равенстве — правила по всему тексту
+                cands[k] = c
+        return cands
+
+    def map_to_fields(self, doc_type: str, text: str, hints: Optional[Dict[str, Any]] = None, model: Optional[str] = None,
+                      *, layout: Optional[List[List[Dict[str, Any]]]] = None,
+                      sections: Optional[List[Dict[str, Any]]] = None,
+                      deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Сначала быстрые правила с оценкой уверенности (src/field_rules.py), а если передан
+        layout (OCR-строки с bbox по страницам) — ещё и ключ-значение по геометрии (src/field_layout.py).
+        LLM зовётся только для обязательных полей, которые правила не заполнили уверенно,
+        и получает самые релевантные этим полям строки в пределах LLM_CTX_TOKENS (src/llm_context.py).
+        Короткие запросы при LLM_BATCH_SIZE > 1 объединяются с запросами других документов.
+        deadline ограничивает весь этап: при нехватке времени или открытом предохранителе
+        провайдера сразу возвращается fallback на правилах.
+        Уверенные значения правил имеют приоритет над ответом LLM.
+        """
+        cands = self._candidates(text, layout)
+        confident = confident_fields(cands)
+        sources = {k: cands[k].source for k in confident}
+        boxes = {k: {"page": c.page, "bbox": c.bbox} for k, c in cands.items() if k in confident and c.bbox}
+        missing = [f for f in required_fields(doc_type) if f not in confident]
+        if not missing:
+            return {"fields": confident, "sources": sources, "boxes": boxes, "llm_called": False}
 
-    def map_to_fields(self, doc_type: str, text: str, hints: Optional[Dict[str, Any]] = None, model: Optional[str] = None) -> Dict[str, Any]:
         if not self.enabled:
-            return {"fields": self._fallback(doc_type, text, hints)}
-
-        hints_str = json.dumps(hints or {}, ensure_ascii=False)
-        model_obj = genai.GenerativeModel(model or self.model_name, system_instruction=SYSTEM_RU)
-
-        shot_blocks = []
+            fields = {**self._fallback(cands), **confident}
+            sources.update({k: "fallback" for k in fields if k not in sources})
+            return {"fields": fields, "sources": sources, "boxes": boxes, "llm_called": False}
+
+        ctx = build_context(text, missing, layout=layout, sections=sections, budget_tokens=self.ctx_tokens)
+        req = FieldsRequest(doc_type=doc_type, fields=missing, hints=hints or {}, text=ctx.text, deadline=deadline)
+        batched = self._batcher is not None and model is None and ctx.tokens <= self.batch_max_tokens
+        calls: List[CallStats] = []  # учёт задержки/токенов по документу (в пакете — общий, не пишется)
+        try:
+            if batched:
+                wait = deadline.remaining() if deadline else math.inf
+                fut = self._batcher.submit(req)
+                try:
+                    llm_fields = fut.result(timeout=None if math.isinf(wait) else wait)
+                except FutureTimeout:
+                    fut.cancel()  # ещё в очереди — в модель не уйдёт
+                    raise
+            else:
+                llm_fields = self._ask_one(req, model, collect=calls)
+        except Exception as e:
+            fields = {**self._fallback(cands), **confident}
+            sources.update({k: "fallback" for k in fields if k not in sources})
+            return {"fields": fields, "sources": sources, "boxes": boxes, "llm_called": True,
+                    "context": ctx.as_dict(), "calls": [asdict(c) for c in calls], "llm_error": str(e)[:500]}
+
+        sources.update({k: "llm" for k in llm_fields if k not in confident})
+        return {"fields": {**llm_fields, **confident}, "sources": sources, "boxes": boxes, "llm_called": True,
+                "llm_batched": batched, "context": ctx.as_dict(), "calls": [asdict(c) for c in calls]}
+
+    @staticmethod
+    def _shot_blocks() -> List[str]:
+        blocks = []
         for ex in FEW_SHOTS_RU:
-            shot_blocks += [
+            blocks += [
                 "Пример входа:\n" + ex["text"],
                 "Пример правильного JSON-выхода:\n" + json.dumps(ex["out"], ensure_ascii=False),
             ]
+        return blocks
 
-        user = f"Тип документа: {doc_type}\nПодсказки (кандидаты): {hints_str}\n\nИзвлеки поля: amount, currency, date, iban, bic, iin_bin, invoice_no, payer, receiver.\n\nТекст:\n{text[:MAX_CTX]}"
-
-        last_err = None
+    def _generate(self, system: str, parts: List[str], schema: Dict[str, Any], *,
+                  model: Optional[str] = None, max_tokens: Optional[int] = None,
+                  deadline: Optional[Deadline] = None,
+                  collect: Optional[List[CallStats]] = None) -> Dict[str, Any]:
+        """
+        Вызов провайдера с повтором на 429/таймаутах в пределах бюджета deadline:
+        таймаут вызова и паузы между повторами не выходят за остаток бюджета.
+        Возвращает разобранный JSON или бросает последнюю ошибку.
+        """
+        deadline = deadline or Deadline()
+        last_err: Exception = LLMError("LLM call failed")
         for attempt in range(3):
+            if deadline.remaining() < MIN_CALL_S:
+                raise LLMError(f"LLM budget exhausted ({last_err})")
             try:
-                resp = model_obj.generate_content(shot_blocks + [user], generation_config=self.generation_config)
-                content = (getattr(resp, "text", "") or "").strip()
-                if not content:
-                    raise ValueError("Empty response from Gemini")
-                return json.loads(content)
-            except (ResourceExhausted, GoogleAPIError) as e:
+                return self.provider.complete_json(system, parts, schema, model=model,
+                                                   max_tokens=max_tokens or self.max_output_tokens,
+                                                   timeout=deadline.timeout(self.provider.timeout), collect=collect)
+            except LLMError as e:
                 last_err = e
-                code = getattr(e, "code", None)
-                msg = (str(e) or "").lower()
-                if isinstance(e, ResourceExhausted) or code == 429 or "429" in msg or "quota" in msg:
-                    time.sleep(min(20, 2 ** attempt + random.random()))
+                pause = min(20, 2 ** attempt + random.random())
+                if e.retryable and pause + MIN_CALL_S <= deadline.remaining():
+                    time.sleep(pause)
                     continue
                 break
-            except Exception as e:
-                last_err = e
-                break
-
-        return {"fields": self._fallback(doc_type, text, hints), "llm_error": str(last_err)[:500]}
-
-    def _fallback(self, doc_type: str, text: str, hints: Optional[Dict[str, Any]]) -> Dict[str, str]:
-        t = text or ""
-        fields: Dict[str, str] = {}
-
-        m = re.search(r"(?i)(итог(?:овая)?\s*сумма|итого(?:\s*к\s*оплате)?|сумма\s*к\s*оплате|к\s*оплате|total|amount|sum)\D{0,40}([0-9]+(?:[ .][0-9]{3})*(?:[.,][0-9]{2})?)", t)
-        if not m:
-            m = re.search(r"(?i)\b([0-9]+(?:[ .][0-9]{3})*(?:[.,][0-9]{2})?)\s*(тенге|₸|kzt)\b", t)
-        if m:
-            fields["amount"] = _norm_num(m.group(2) if m.lastindex and m.lastindex >= 2 else m.group(1))
-
-        if re.search(r"(?i)\bKZT\b|₸|тенге", t):
-            fields["currency"] = "KZT"
-        else:
-            cur = re.search(r"(?i)\b(USD|EUR|RUB)\b", t)
-            if cur:
-                fields["currency"] = cur.group(1).upper()
-
-        d = re.search(r"\b((?:20\d{2}[-./](?:0?[1-9]|1[0-2])[-./](?:0?[1-9]|[12]\d|3[01]))|(?:(?:0?[1-9]|[12]\d|3[01])[-./](?:0?[1-9]|1[0-2])[-./]20\d{2}))\b", t)
-        if d:
-            s = d.group(1)
-            if re.match(r"^\d{1,2}[./-]\d{1,2}[./-]20\d{2}$", s):
-                dd, mm, yyyy = re.split(r"[./-]", s)
-                fields["date"] = f"{int(yyyy):04d}-{int(mm):02d}-{int(dd):02d}"
-            else:
-                fields["date"] = s
-        else:
-            ru = _try_parse_ru_date(t)
-            if ru:
-                fields["date"] = ru
-
-        iban = re.search(r"(?i)\bKZ\d{20}\b", t)
-        if iban:
-            fields["iban"] = iban.group(0)
-
-        bic = re.search(r"\b[A-Z]{6}[A-Z0-9]{2}(?:[A-Z0-9]{3})?\b", t)
-        if bic:
-            fields["bic"] = bic.group(0)
-
-        iin = re.search(r"\b\d{12}\b", t)
-        if iin:
-            fields.setdefault("iin_bin", iin.group(0))
-
-        inv = re.search(r"(?i)(?:сч(?:е|ё)т|номер\s*сч[её]та|invoice|inv|doc\s*no\.?)\s*[:#№]*\s*([\w\-_/]{3,})", t)
-        if inv:
-            fields["invoice_no"] = inv.group(1)
-
-        recv = re.search(r"(?i)(?:получатель|receiver|beneficiary)\s*[:\-]?\s*(.+)", t)
-        if recv:
-            fields["receiver"] = recv.group(1).splitlines()[0].strip()
-        pay = re.search(r"(?i)(?:плательщик|payer|customer)\s*[:\-]?\s*(.+)", t)
-        if pay:
-            fields["payer"] = pay.group(1).splitlines()[0].strip()
-
-        return fields
+        raise last_err
+
+    def _ask_one(self, req: FieldsRequest, model: Optional[str] = None,
+                 collect: Optional[List[CallStats]] = None) -> Dict[str, Any]:
+        hints_str = json.dumps(req.hints, ensure_ascii=False)
+        user = (f"Тип документа: {req.doc_type}\nПодсказки (кандидаты): {hints_str}\n\n"
+                f"Извлеки поля: {', '.join(req.fields)}.\n\nТекст:\n{req.text}")
+        out = self._generate(SYSTEM_RU, self._shot_blocks() + [user], _response_schema(), model=model,
+                             deadline=req.deadline, collect=collect)
+        return out.get("fields") or {}
+
+    def _ask_batch(self, reqs: Sequence[FieldsRequest]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Несколько документов одним запросом: системный промпт и примеры — один раз,
+        документы помечены id, ответ — {"documents": [{"id", "fields"}]}.
+        Документ, которого нет в ответе, получает None (его переспросят отдельно).
+        """
+        blocks = []
+        for n, r in enumerate(reqs):
+            blocks.append(
+                f"=== Документ id=d{n} ===\nТип документа: {r.doc_type}\n"
+                f"Подсказки (кандидаты): {json.dumps(r.hints, ensure_ascii=False)}\n"
+                f"Извлеки поля: {', '.join(r.fields)}.\nТекст:\n{r.text}"
+            )
+        # пакет ждёт не дольше самого «срочного» документа
+        deadline = min((r.deadline for r in reqs if r.deadline), key=lambda d: d.remaining(), default=None)
+        out = self._generate(SYSTEM_RU + " " + BATCH_NOTE_RU, self._shot_blocks() + ["\n\n".join(blocks)],
+                             _batch_response_schema(), max_tokens=self.max_output_tokens * len(reqs), deadline=deadline)
+        docs = out.get("documents")
+        if not isinstance(docs, list):
+            raise ValueError("Batch response without documents[]")
+        by_id = {d.get("id"): d.get("fields") for d in docs if isinstance(d, dict)}
+        return [by_id.get(f"d{n}") if isinstance(by_id.get(f"d{n}"), dict) else None for n in range(len(reqs))]
+
+    @staticmethod
+    def _fallback(cands: Dict[str, FieldCandidate]) -> Dict[str, str]:
+        # все кандидаты правил, включая неуверенные — лучше, чем ничего
+        return {k: c.value for k, c in cands.items()}
 
     def fix_text(self, full_text: str, fields_hint: Optional[Dict[str, Any]] = None,
-                 language: str = "ru") -> Dict[str, Any]:
+                 language: str = "ru", *, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
         """
-        Редактура OCR-текста с самопроверкой. Возвращает:
+        Редактура OCR-текста. Текст любой длины режется по строкам на куски (см. fix_pages),
+        правки применяются к исходному тексту. Возвращает:
         {
           "corrected_text": "....",
-          "edits": [{"from":"...", "to":"...", "reason":"..."}],
+          "edits": [{"from":"...", "to":"...", "reason":"...", "item": номер строки, "start", "end"}],
           "notes": "краткий лог (опционально)"
         }
         """
+        lines = [{"text": t} for t in full_text.split("\n")]
+        res = self.fix_pages([lines], fields_hint=fields_hint, language=language, conf_skip=None, deadline=deadline)
+        return {
+            "corrected_text": "\n".join(it["text"] for it in res["pages"][0]),
+            "edits": res["edits"],
+            "notes": res["notes"],
+        }
+
+    def fix_pages(
+        self,
+        ocr_pages: List[List[Dict[str, Any]]],
+        *,
+        fields_hint: Optional[Dict[str, Any]] = None,
+        language: str = "ru",
+        conf_skip: Optional[float] = 0.92,
+        chunk_chars: int = 6000,
+        workers: Optional[int] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        """
+        Поблочная правка OCR-строк по страницам.
+
+        Страницы режутся на куски до chunk_chars (граница куска — граница страницы или строки),
+        куски с уверенным OCR (средний conf ≥ conf_skip и нет слабых строк) не отправляются.
+        Остальные правятся параллельно (LLM_FIX_WORKERS, по умолчанию 4) под общим
+        лимитом частоты провайдера. Модель возвращает только правки по номерам строк —
+        они применяются к тексту каждой строки с конца, исходные смещения start/end
+        сохраняются в edits. Правки, меняющие цифры, отбрасываются.
+        """
+        pages = [[dict(it) for it in page] for page in ocr_pages]
         if not self.enabled:
-            # без LLM просто эхо
-            return {"corrected_text": full_text, "edits": [], "notes": "LLM disabled"}
-
-        schema = {
-            "type": "object",
-            "properties": {
-                "corrected_text": {"type": "string"},
-                "edits": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "from": {"type": "string"},
-                            "to": {"type": "string"},
-                            "reason": {"type": "string"}
-                        },
-                        "required": ["from","to"]
-                    }
+            return {"pages": pages, "edits": [], "notes": "LLM disabled", "chunks": {}}
+
+        chunks = _fix_chunks(pages, chunk_chars)
+        todo = [c for c in chunks if conf_skip is None or _needs_fix(pages, c, conf_skip)]
+        workers = workers or int(os.getenv("LLM_FIX_WORKERS", "4"))
+        hints = json.dumps(fields_hint or {}, ensure_ascii=False)
+
+        def run(chunk: List[Tuple[int, int]]) -> List[Dict[str, Any]]:
+            numbered = "\n".join(f"[{n}] {pages[pi][ii].get('text', '')}" for n, (pi, ii) in enumerate(chunk))
+            user = (f"Язык: {language}\nПодсказки полей: {hints}\n\n"
+                    f"Строки OCR (номер в квадратных скобках):\n{numbered}")
+            out = self._generate(FIX_SYSTEM_RU, [user], _fix_schema(), deadline=deadline,
+                                 max_tokens=max(self.max_output_tokens, len(chunk) * 24))
+            return [{**e, "_at": chunk[e["line"]]} for e in out.get("edits") or []
+                    if isinstance(e, dict) and isinstance(e.get("line"), int) and 0 <= e["line"] < len(chunk)]
+
+        raw: List[Dict[str, Any]] = []
+        errors: List[str] = []
+        if todo:
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(todo))), thread_name_prefix="llm-fix") as pool:
+                for fut in [pool.submit(run, c) for c in todo]:
+                    try:
+                        raw.extend(fut.result())
+                    except Exception as e:
+                        errors.append(str(e)[:200])
+
+        edits = _apply_edits(pages, raw)
+        stats = {"total": len(chunks), "sent": len(todo), "skipped": len(chunks) - len(todo), "failed": len(errors)}
+        notes = f"error: {errors[0]}" if errors else ""
+        return {"pages": pages, "edits": edits, "notes": notes, "chunks": stats}
+
+
+FIX_SYSTEM_RU = (
+    "Ты — редактор финансовых документов (RU/KZ).\n"
+    "Тебе дают пронумерованные строки после OCR. Исправляй только OCR-опечатки и склейки/разрывы слов, "
+    "сохраняя исходный смысл и числа.\n"
+    "Не придумывай новые факты. Не меняй суммы/даты/номера.\n"
+    "Верни ТОЛЬКО JSON: edits — список правок {line: номер строки, from: точный фрагмент строки, to: замена}. "
+    "Если правок нет — пустой список."
+)
+
+
+def _fix_schema() -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {
+            "edits": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "line": {"type": "integer"},
+                        "from": {"type": "string"},
+                        "to": {"type": "string"},
+                        "reason": {"type": "string"},
+                    },
+                    "required": ["line", "from", "to"],
                 },
-                "notes": {"type": "string"}
-            },
-            "required": ["corrected_text"]
-        }
+            }
+        },
+        "required": ["edits"],
+    }
 
-        system = (
-            "Ты — редактор финансовых документов (RU/KZ).\n"
-            "Исправляй только OCR-опечатки и склейки/разрывы слов, сохраняя исходный смысл и числа.\n"
-            "Не придумывай новые факты. Не меняй суммы/даты, если они выглядят корректно.\n"
-            "Возвращай ТОЛЬКО JSON по схеме."
-        )
-        hints = fields_hint or {}
-        user = (
-            f"Язык: {language}\n"
-            f"Подсказки полей: {json.dumps(hints, ensure_ascii=False)}\n\n"
-            f"Текст для правки:\n{full_text[:MAX_CTX]}"
-        )
-
-        model_obj = genai.GenerativeModel(self.model_name, system_instruction=system)
-        cfg = {**self.generation_config, "response_schema": schema}
-
-        last_err = None
-        for attempt in range(3):
-            try:
-                resp = model_obj.generate_content([user], generation_config=cfg)
-                txt = (getattr(resp, "text", "") or "").strip()
-                if not txt:
-                    raise ValueError("Empty response")
-                return json.loads(txt)
-            except (ResourceExhausted, GoogleAPIError) as e:
-                last_err = e
-                time.sleep(min(20, 2 ** attempt + random.random()))
-            except Exception as e:
-                last_err = e
-                break
 
-        return {"corrected_text": full_text, "edits": [], "notes": f"error: {str(last_err)[:300]}"}
+def _fix_chunks(pages: List[List[Dict[str, Any]]], chunk_chars: int) -> List[List[Tuple[int, int]]]:
+    """Куски (страница, строка): не больше chunk_chars, страница не делится без нужды."""
+    chunks: List[List[Tuple[int, int]]] = []
+    cur: List[Tuple[int, int]] = []
+    size = 0
+    for pi, page in enumerate(pages):
+        page_len = sum(len(it.get("text") or "") for it in page)
+        if cur and size + page_len > chunk_chars:
+            chunks.append(cur)
+            cur, size = [], 0
+        for ii, it in enumerate(page):
+            n = len(it.get("text") or "")
+            if cur and size + n > chunk_chars:
+                chunks.append(cur)
+                cur, size = [], 0
+            cur.append((pi, ii))
+            size += n
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+
+def _needs_fix(pages: List[List[Dict[str, Any]]], chunk: List[Tuple[int, int]], conf_skip: float) -> bool:
+    items = [pages[pi][ii] for pi, ii in chunk]
+    if any(it.get("weak") for it in items):
+        return True
+    confs = [float(it["conf"]) for it in items if it.get("conf") is not None]
+    return not confs or sum(confs) / len(confs) < conf_skip
+
+
+_DIGITS = re.compile(r"\d")
+
+
+def _apply_edits(pages: List[List[Dict[str, Any]]], raw: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Применяет правки к строкам на месте. Смещения считаются по исходному тексту строки;
+    внутри строки правки применяются справа налево, пересекающиеся отбрасываются.
+    """
+    by_item: Dict[Tuple[int, int], List[Dict[str, Any]]] = {}
+    for e in raw:
+        pi, ii = e["_at"]
+        src = pages[pi][ii].get("text") or ""
+        frm, to = str(e.get("from") or ""), str(e.get("to") or "")
+        if not frm or frm == to or _DIGITS.findall(frm) != _DIGITS.findall(to):
+            continue
+        start = src.find(frm)
+        if start < 0:
+            continue
+        by_item.setdefault((pi, ii), []).append(
+            {"page": pi, "item": ii, "start": start, "end": start + len(frm),
+             "from": frm, "to": to, "reason": e.get("reason", "")})
+
+    applied: List[Dict[str, Any]] = []
+    for (pi, ii), eds in by_item.items():
+        text = pages[pi][ii].get("text") or ""
+        last = len(text) + 1
+        for e in sorted(eds, key=lambda e: -e["start"]):
+            if e["end"] > last:
+                continue  # пересекается с уже применённой
+            text = text[:e["start"]] + e["to"] + text[e["end"]:]
+            last = e["start"]
+            applied.append(e)
+        pages[pi][ii]["text"] = text
+    applied.sort(key=lambda e: (e["page"], e["item"], e["start"]))
+    return applied
@@ -1,54 +1,152 @@
 import re
-from datetime import datetime
-from typing import Optional, Dict
+from datetime import date
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 
-KZ_IBAN_RE = re.compile(r"\bKZ\d{20}\b")
+from src.amounts import currency_code, parse_number
+from src.field_rules import RU_MONTHS, iban_checksum_ok
+
+# KZ-IBAN: 2 контрольные цифры + 3 цифры кода банка + 13 символов счёта (буквы допустимы)
+KZ_IBAN_RE = re.compile(r"\bKZ\d{2}[0-9A-Z]{16}\b")
+KZ_IBAN_SPACED_RE = re.compile(r"\bKZ(?:\s?[0-9A-Z]){18}\b")  # «KZ18 722S 0000 1234 5678»
 BIC_RE = re.compile(r"\b[A-Z]{6}[A-Z0-9]{2}([A-Z0-9]{3})?\b")
+IIN_RE = re.compile(r"\b\d{12}\b")
+# форматы, которые раньше перебирались strptime: Y-m-d, Y.m.d, d.m.Y, d/m/Y, d-m-Y
+DATE_YMD_RE = re.compile(r"(\d{4})([-.])(\d{1,2})\2(\d{1,2})")
+DATE_DMY_RE = re.compile(r"(\d{1,2})([./-])(\d{1,2})\2(\d{4})")
+DATE_YMD_ANY_RE = re.compile(r"(20\d{2})[-./](\d{1,2})[-./](\d{1,2})")
+DATE_RU_RE = re.compile(r"(?i)\b(\d{1,2})\s+(" + "|".join(RU_MONTHS) + r")\s+(\d{4})")
 
-def norm_amount(x: Optional[str]) -> Optional[str]:
-    if not x:
+_CACHE = 1 << 16
+
+
+def _iso(y: int, m: int, d: int) -> Optional[str]:
+    try:
+        return date(y, m, d).isoformat()
+    except ValueError:
         return None
-    s = x.replace(" ", "").replace("\u00A0", "").replace(",", ".")
-    m = re.findall(r"\d+\.?\d*", s)
-    return m[-1] if m else None
+
+
+def norm_amount(x: Optional[str]) -> Optional[str]:
+    """Сумма → «1234567.89» общим разборщиком src/amounts.py (разряды, NBSP, валюта, прописью)."""
+    return parse_number(x)
 
 def norm_currency(t: Optional[str]) -> Optional[str]:
-    if not t:
-        return None
-    t = t.upper()
-    if "₸" in t or "KZT" in t:
-        return "KZT"
-    for c in ("USD", "EUR", "RUB", "KZT"):
-        if c in t:
-            return c
-    return None
+    return currency_code(t)
 
+@lru_cache(maxsize=_CACHE)
 def norm_date(s: Optional[str]) -> Optional[str]:
+    """
+    Дата → YYYY-MM-DD. Полные форматы Y-m-d / Y.m.d / d.m.Y / d/m/Y / d-m-Y,
+    русские месяцы («5 марта 2024»), иначе — первая Y-m-d внутри строки.
+    Результат кешируется: в архиве одни и те же строки дат повторяются тысячами.
+    """
     if not s:
         return None
-    for fmt in ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%Y.%m.%d", "%d-%m-%Y"):
-        try:
-            return datetime.strptime(s, fmt).strftime("%Y-%m-%d")
-        except Exception:
-            pass
-    m = re.search(r"(20\d{2})[-./](\d{1,2})[-./](\d{1,2})", s)
+    s = s.strip()
+    m = DATE_YMD_RE.fullmatch(s)
+    if m:
+        return _iso(int(m.group(1)), int(m.group(3)), int(m.group(4)))
+    m = DATE_DMY_RE.fullmatch(s)
+    if m:
+        return _iso(int(m.group(4)), int(m.group(3)), int(m.group(1)))
+    m = DATE_RU_RE.search(s)
+    if m:
+        return _iso(int(m.group(3)), RU_MONTHS[m.group(2).lower()], int(m.group(1)))
+    m = DATE_YMD_ANY_RE.search(s)
     if m:
-        y, mo, da = m.groups()
-        return f"{int(y):04d}-{int(mo):02d}-{int(da):02d}"
+        return _iso(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    return None
+
+def norm_iban(s: Optional[str]) -> Optional[str]:
+    """Первый KZ-IBAN с верной контрольной суммой mod 97; пробелы внутри номера убираются."""
+    if not s:
+        return None
+    for m in KZ_IBAN_SPACED_RE.finditer(s.upper()):
+        iban = re.sub(r"\s", "", m.group(0))
+        if KZ_IBAN_RE.fullmatch(iban) and iban_checksum_ok(iban):
+            return iban
     return None
 
+def norm_bic(s: Optional[str]) -> Optional[str]:
+    if not s:
+        return None
+    m = BIC_RE.search(s)
+    return m.group(0) if m else None
+
+def norm_iin(s: Optional[str]) -> Optional[str]:
+    if not s:
+        return None
+    m = IIN_RE.search(s)
+    return m.group(0) if m else None
+
+# Нормализатор на каждое поле; остальные поля переносятся как есть
+NORMALIZERS: Dict[str, Callable[[Optional[str]], Optional[str]]] = {
+    "iban": norm_iban,
+    "bic": norm_bic,
+    "amount": norm_amount,
+    "currency": norm_currency,
+    "date": norm_date,
+    "iin_bin": norm_iin,
+}
+
+def _apply(fn: Callable[[Optional[str]], Optional[str]], v: Any) -> Any:
+    """Строки — через нормализатор, числа — как их str(), прочие значения (списки, dict) — как есть."""
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        v = str(v)
+    elif v is not None and not isinstance(v, str):
+        return v
+    return fn(v or None)
+
+
 def fix_fields(raw: Optional[Dict]) -> Dict:
     out = dict(raw or {})
-    if iban := out.get("iban"):
-        m = KZ_IBAN_RE.search(iban.replace(" ", ""))
-        out["iban"] = m.group(0) if m else None
-    if bic := out.get("bic"):
-        m = BIC_RE.search(bic)
-        out["bic"] = m.group(0) if m else None
-    out["amount"] = norm_amount(out.get("amount"))
-    out["currency"] = norm_currency(out.get("currency") or "")
-    out["date"] = norm_date(out.get("date"))
-    if iin := out.get("iin_bin"):
-        m = re.search(r"\b\d{12}\b", iin)
-        out["iin_bin"] = m.group(0) if m else None
+    for k, fn in NORMALIZERS.items():
+        out[k] = _apply(fn, out.get(k))
     return {k: v for k, v in out.items() if v}
+
+
+# --- массовая перенормализация (архив результатов) ---
+def normalize_column(field: str, values: Sequence[Any]) -> Tuple[List[Optional[str]], int]:
+    """
+    Нормализует столбец значений одного поля. Каждое уникальное значение считается
+    один раз. Числа нормализуются как строки, прочие нестроковые значения
+    переносятся без изменений. Возвращает (новые значения, сколько изменилось).
+    """
+    fn = NORMALIZERS.get(field)
+    if fn is None:
+        return list(values), 0
+    seen: Dict[Any, Any] = {}
+    out: List[Any] = []
+    changed = 0
+    for v in values:
+        if not isinstance(v, (str, int, float, type(None))):
+            nv = v  # список/словарь: нехешируемо и нормализатору не по зубам
+        elif (type(v), v) in seen:  # 12500 и 12500.0 равны как ключи, но нормализуются по-разному
+            nv = seen[type(v), v]
+        else:
+            nv = seen[type(v), v] = _apply(fn, v)
+        out.append(nv)
+        changed += nv != (v or None)
+    return out, changed
+
+
+def normalize_columns(columns: Dict[str, Sequence[Any]]) -> Tuple[Dict[str, List[Optional[str]]], Dict[str, int]]:
+    """Столбцы {поле: значения} → (нормализованные столбцы, число изменений по полям)."""
+    out: Dict[str, List[Optional[str]]] = {}
+    counts: Dict[str, int] = {}
+    for field, values in columns.items():
+        out[field], counts[field] = normalize_column(field, values)
+    return out, counts
+
+
+def fix_fields_bulk(records: Iterable[Optional[Dict]]) -> Tuple[List[Dict], Dict[str, int]]:
+    """
+    То же, что fix_fields для каждого словаря, но по столбцам: для перенормализации
+    архива после изменения правил. Возвращает (записи, число изменений по полям).
+    """
+    rows = [dict(r or {}) for r in records]
+    keys = {k for r in rows for k in r} | set(NORMALIZERS)
+    cols, counts = normalize_columns({k: [r.get(k) for r in rows] for k in keys})
+    out = [{k: cols[k][i] for k in keys if cols[k][i]} for i in range(len(rows))]
+    return out, {k: v for k, v in counts.items() if k in NORMALIZERS}
@@ -1,14 +1,53 @@
 # src/post_validate.py
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import Dict, Any, List, Optional
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Sequence
 import re
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
-RE_IBAN_KZ = re.compile(r"\bKZ\d{20}\b", flags=re.I)
+import numpy as np
+
+from src.amounts import parse_number, same_amount, words_amounts
+from src.field_rules import IIN_WEIGHTS, iban_checksum_ok, iin_checksum_ok, required_fields
+
+RE_IBAN_KZ = re.compile(r"\bKZ\d{2}[0-9A-Z]{16}\b", flags=re.I)
 RE_BIC     = re.compile(r"\b[A-Z]{6}[A-Z0-9]{2}([A-Z0-9]{3})?\b")
 RE_DATE    = re.compile(r"\b(20\d{2})[-./](0?[1-9]|1[0-2])[-./](0?[1-9]|[12]\d|3[01])\b")
 
+CURRENCIES = ("KZT", "USD", "EUR", "RUB")
+MAX_AMOUNT = 1e11  # больше — почти наверняка склейка чисел OCR
+MAX_DATE_AHEAD = 366  # дней в будущее: дальше — скорее ошибка OCR в годе
+
+# Проверки по тексту документа: есть только у validate_fields (в validate_batch текста нет).
+# Остальные правила и их имена у validate_fields и validate_batch общие; правило полю
+# применяется, только если поле заполнено, а пустые обязательные поля — это missing_required.
+TEXT_RULES = ("iban_present_in_text", "iban_candidate_in_text", "amount_words_match",
+              "currency_symbol_consistency")
+
+# Код банка в KZ-IBAN (символы 5–7) → BIC. Неполный список крупных банков;
+# для кодов вне таблицы проверка BIC↔IBAN не выполняется.
+KZ_BANK_BIC: Dict[str, str] = {
+    "070": "KKMFKZ2A",  # Комитет казначейства
+    "125": "NBRKKZKX",  # Национальный банк
+    "250": "HCSKKZKA",  # Отбасы банк
+    "432": "VTBAKZKZ",  # ВТБ (Казахстан)
+    "551": "KSNVKZKA",  # Freedom Finance Kazakhstan
+    "563": "KPSTKZKA",  # Казпочта
+    "601": "HSBKKZKX",  # Народный банк (Halyk)
+    "722": "CASPKZKA",  # Kaspi Bank
+    "821": "KINCKZKA",  # Bank RBK
+    "826": "ALFAKZKA",  # Альфа-Банк
+    "832": "CITIKZKA",  # Ситибанк Казахстан
+    "849": "NURSKZKX",  # Нурбанк
+    "856": "KCJBKZKX",  # Банк ЦентрКредит
+    "886": "INLMKZKA",  # Хоум Кредит Банк
+    "907": "BKCHKZKA",  # Bank of China Kazakhstan
+    "914": "SABRKZKA",  # Береке Банк
+    "948": "EURIKZKA",  # Евразийский банк
+    "996": "IRTYKZKA",  # ForteBank
+    "998": "TSESKZKA",  # Jusan Bank
+}
+
 def _ok_date_iso(s: str) -> bool:
     try:
         datetime.strptime(s, "%Y-%m-%d")
@@ -16,51 +55,110 @@ def _ok_date_iso(s: str) -> bool:
     except Exception:
         return False
 
+
+def _date_ok(s: str, today: date) -> bool:
+    """YYYY-MM-DD и не дальше MAX_DATE_AHEAD дней в будущее."""
+    if not (RE_DATE.fullmatch(s) and _ok_date_iso(s)):
+        return False
+    return date.fromisoformat(s) <= today + timedelta(days=MAX_DATE_AHEAD)
+
+
+def iin_birth_date(iin: str) -> Optional[date]:
+    """
+    Дата рождения из ИИН физлица: ГГММДД + 7-й разряд (век и пол: 1–2 → 1800-е, 3–4 → 1900-е, 5–6 → 2000-е).
+    None — это БИН (5-й разряд 4/5/6) или дата некорректна.
+    """
+    if not iin or len(iin) != 12 or not iin.isdigit() or iin[4] in "456":
+        return None
+    c = int(iin[6])
+    if not 1 <= c <= 6:
+        return None
+    try:
+        return date(1800 + 100 * ((c - 1) // 2) + int(iin[:2]), int(iin[2:4]), int(iin[4:6]))
+    except ValueError:
+        return None
+
+
 @dataclass
 class Check:
     rule: str
     ok: bool
     details: str = ""
+    info: bool = False  # подсказка: в needs_review не учитывается
 
-def validate_fields(fields: Dict[str, Any], text: str) -> List[Dict[str, Any]]:
+
+def needs_review(checks: Sequence[Dict[str, Any]]) -> bool:
+    """Есть проваленная проверка (информационные не в счёт)."""
+    return any(not c["ok"] and not c.get("info") for c in checks)
+
+
+def validate_fields(fields: Dict[str, Any], text: str, *, doc_type: Optional[str] = None,
+                    today: Optional[date] = None) -> List[Dict[str, Any]]:
+    """
+    Проверки одного документа. Имена правил и условия — те же, что у validate_batch
+    (плюс TEXT_RULES по тексту); doc_type включает проверку обязательных полей.
+    """
     out: List[Check] = []
+    today = today or date.today()
 
     # 1) IBAN
     ib = fields.get("iban")
     if ib:
         out.append(Check("iban_format", bool(RE_IBAN_KZ.fullmatch(ib or "")),
                          f"iban={ib}"))
+        out.append(Check("iban_checksum", iban_checksum_ok(ib), "ISO 13616 mod 97"))
+        # извлечённый IBAN должен найтись в тексте (без пробелов) — иначе его выдумала модель
+        compact = re.sub(r"\s+", "", text or "").upper()
+        out.append(Check("iban_present_in_text", re.sub(r"\s+", "", ib).upper() in compact, f"iban={ib}"))
     else:
-        # если IBAN не извлекли, но в тексте есть — подсказка
+        # IBAN не извлекли: у чеков его и не бывает, поэтому только подсказка, если он есть в тексте
         hint = RE_IBAN_KZ.search(text or "")
-        out.append(Check("iban_present_in_text", hint is not None,
-                         f"candidate={hint.group(0) if hint else ''}"))
+        if hint:
+            out.append(Check("iban_candidate_in_text", False, f"candidate={hint.group(0)}", info=True))
 
     # 2) BIC
     bic = fields.get("bic")
     if bic:
-        out.append(Check("bic_format", bool(RE_BIC.fullmatch(bic or "")),
+        out.append(Check("bic_format", bool(RE_BIC.fullmatch(bic.strip().upper())),
                          f"bic={bic}"))
+        # банк в BIC и в IBAN должен совпадать
+        expected = KZ_BANK_BIC.get((ib or "")[4:7].upper()) if ib else None
+        if expected:
+            out.append(Check("bic_iban_bank", bic.upper()[:8] == expected,
+                             f"iban bank code {ib[4:7]} → {expected}"))
 
-    # 3) Дата ISO
+    # 3) ИИН/БИН (дата — тем же кодом, что в пакетной проверке)
+    iin = fields.get("iin_bin")
+    if iin:
+        out.append(Check("iin_checksum", iin_checksum_ok(iin), f"iin_bin={iin}"))
+        fmt, d = _iin_digits(np.array([str(iin).strip()]))
+        born = iin_birth_date(iin)
+        out.append(Check("iin_birth_date", bool(_iin_date_ok(fmt, d, np.datetime64(today, "D"))[0]),
+                         f"born={born.isoformat() if born else ''}"))
+
+    # 4) Дата ISO
     dt = fields.get("date")
-    out.append(Check("date_iso_yyyy_mm_dd", bool(dt and _ok_date_iso(dt)),
-                     f"date={dt}"))
+    if dt:
+        out.append(Check("date_iso", _date_ok(str(dt).strip(), today), f"date={dt}"))
 
-    # 4) Валюта
-    cur = (fields.get("currency") or "").upper()
-    out.append(Check("currency_iso", cur in {"KZT","USD","EUR","RUB"}, f"currency={cur}"))
+    # 5) Валюта
+    cur = str(fields.get("currency") or "").strip().upper()
+    if cur:
+        out.append(Check("currency_iso", cur in CURRENCIES, f"currency={cur}"))
 
-    # 5) Сумма: должна быть числом
+    # 6) Сумма: должна быть числом в разумных пределах (разбор — тот же, что при извлечении)
     amt = fields.get("amount")
-    ok_amt = False
     if amt:
-        try:
-            float(amt)
-            ok_amt = True
-        except Exception:
-            pass
-    out.append(Check("amount_numeric", ok_amt, f"amount={amt}"))
+        num = parse_number(str(amt))
+        out.append(Check("amount_numeric", num is not None, f"amount={amt}"))
+        out.append(Check("amount_currency", bool(cur), f"currency={cur}"))
+        if num is not None:
+            out.append(Check("amount_range", 0 < float(num) < MAX_AMOUNT, f"amount={amt}"))
+            # сумма прописью в тексте должна совпасть с извлечённой
+            words = words_amounts(text or "")
+            if words:
+                out.append(Check("amount_words_match", any(same_amount(num, w.value) for w in words),
+                                 f"words={','.join(w.value for w in words[:3])}"))
 
     # Пример согласованности: если в тексте встречается знак ₸ — ожидаем KZT
     if "₸" in (text or "") and cur and cur != "KZT":
@@ -68,4 +166,169 @@ def validate_fields(fields: Dict[str, Any], text: str) -> List[Dict[str, Any]]:
     else:
         out.append(Check("currency_symbol_consistency", True, ""))
 
+    # 7) Обязательные поля по типу документа
+    if doc_type is not None:
+        missing = [f for f in required_fields(doc_type) if not fields.get(f)]
+        out.append(Check("missing_required", not missing, f"missing={','.join(missing)}"))
+
     return [c.__dict__ for c in out]
+
+
+# --- пакетная проверка ---
+def _col(rows: Sequence[Dict[str, Any]], key: str) -> np.ndarray:
+    return np.array([str(r.get(key) or "").strip().upper() for r in rows], dtype=object).astype(str)
+
+
+def _ascii_matrix(col: np.ndarray, width: int) -> np.ndarray:
+    """Строки фиксированной длины → матрица байтов (N, width); не-ASCII заменяются на '?'."""
+    enc = np.char.encode(col, "ascii", "replace").astype(f"S{width}")
+    return enc.view(np.uint8).reshape(len(col), width)
+
+
+def _iban_ok(iban: np.ndarray) -> np.ndarray:
+    """ISO 13616 mod 97 для всего столбца сразу: 20 шагов по столбцам вместо цикла по строкам."""
+    fmt = (np.char.str_len(iban) == 20) & (np.char.startswith(iban, "KZ"))
+    b = _ascii_matrix(np.where(fmt, iban, "KZ" + "0" * 18), 20).astype(np.int64)
+    b = np.concatenate([b[:, 4:], b[:, :4]], axis=1)
+    digit = (b >= 48) & (b <= 57)
+    alpha = (b >= 65) & (b <= 90)
+    vals = np.where(digit, b - 48, b - 55)
+    rem = np.zeros(len(iban), dtype=np.int64)
+    for k in range(vals.shape[1]):
+        v = vals[:, k]
+        rem = (rem * np.where(v > 9, 100, 10) + v) % 97
+    return fmt & (digit | alpha).all(axis=1) & (rem == 1)
+
+
+def _iin_digits(iin: np.ndarray) -> tuple:
+    fmt = (np.char.str_len(iin) == 12) & np.char.isdigit(iin)
+    d = _ascii_matrix(np.where(fmt, iin, "0" * 12), 12).astype(np.int64) - 48
+    return fmt, d
+
+
+def _iin_ok(fmt: np.ndarray, d: np.ndarray) -> np.ndarray:
+    w1, w2 = (np.array(w, dtype=np.int64) for w in IIN_WEIGHTS)
+    k1 = (d[:, :11] @ w1) % 11
+    k2 = (d[:, :11] @ w2) % 11
+    k = np.where(k1 == 10, k2, k1)
+    return fmt & (k != 10) & (k == d[:, 11])
+
+
+def _iin_date_ok(fmt: np.ndarray, d: np.ndarray, today: np.datetime64) -> np.ndarray:
+    """ИИН физлица: корректная дата рождения не в будущем. БИН: месяц регистрации 1–12."""
+    is_bin = np.isin(d[:, 4], (4, 5, 6))
+    month = d[:, 2] * 10 + d[:, 3]
+    c = d[:, 6]
+    year = 1800 + 100 * ((c - 1) // 2) + d[:, 0] * 10 + d[:, 1]
+    day = d[:, 4] * 10 + d[:, 5]
+    m_ok = (month >= 1) & (month <= 12)
+    ym = ((year - 1970) * 12 + np.clip(month, 1, 12) - 1).astype("datetime64[M]")
+    month_days = ((ym + 1).astype("datetime64[D]") - ym.astype("datetime64[D]")).astype(np.int64)
+    born = ym.astype("datetime64[D]") + (np.clip(day, 1, 31) - 1)
+    person_ok = (c >= 1) & (c <= 6) & m_ok & (day >= 1) & (day <= month_days) & (born <= today)
+    return fmt & np.where(is_bin, m_ok, person_ok)
+
+
+def _amounts(col: np.ndarray) -> np.ndarray:
+    try:
+        return np.where(col == "", "nan", col).astype(np.float64)
+    except ValueError:
+        # есть ненормализованные записи («12 345,67 ₸») — разбираем их общим разборщиком
+        out = np.full(len(col), np.nan)
+        for i, v in enumerate(col):
+            num = parse_number(v)
+            if num is not None:
+                out[i] = float(num)
+        return out
+
+
+@dataclass
+class BatchValidation:
+    """
+    Результат пакетной проверки: для каждого правила — массив ok (True, если поле
+    отсутствует и проверять нечего) и массив present (правило применимо).
+    needs_review — документы, которые стоит перепрогнать или проверить вручную.
+    """
+    n: int
+    checks: Dict[str, np.ndarray] = field(default_factory=dict)
+    present: Dict[str, np.ndarray] = field(default_factory=dict)
+    missing_required: Optional[np.ndarray] = None
+
+    @property
+    def needs_review(self) -> np.ndarray:
+        bad = np.zeros(self.n, dtype=bool)
+        for ok in self.checks.values():
+            bad |= ~ok
+        if self.missing_required is not None:
+            bad |= self.missing_required > 0
+        return bad
+
+    def failed_rules(self, i: int) -> List[str]:
+        out = [name for name, ok in self.checks.items() if not ok[i]]
+        if self.missing_required is not None and self.missing_required[i]:
+            out.append("missing_required")
+        return out
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "documents": self.n,
+            "needs_review": int(self.needs_review.sum()),
+            "failed": {k: int((~v).sum()) for k, v in self.checks.items()},
+            "checked": {k: int(v.sum()) for k, v in self.present.items()},
+            "missing_required": int((self.missing_required > 0).sum()) if self.missing_required is not None else 0,
+        }
+
+
+def validate_batch(results: Sequence[Dict[str, Any]], *, today: Optional[date] = None) -> BatchValidation:
+    """
+    Проверка тысяч результатов пайплайна сразу (элемент — result с "fields" и "docType"
+    или просто словарь полей). Контрольные суммы IBAN и ИИН/БИН, дата рождения в ИИН,
+    банк BIC↔IBAN, сумма/валюта считаются по столбцам numpy. Правила — те же, что
+    у validate_fields, кроме TEXT_RULES.
+    """
+    rows = [r.get("fields", r) if isinstance(r, dict) else {} for r in results]
+    n = len(rows)
+    rep = BatchValidation(n)
+    if not n:
+        return rep
+    today64 = np.datetime64(today or date.today(), "D")
+
+    iban, bic, iin = _col(rows, "iban"), _col(rows, "bic"), _col(rows, "iin_bin")
+    cur, amt_s, dt = _col(rows, "currency"), _col(rows, "amount"), _col(rows, "date")
+
+    def put(name: str, present: np.ndarray, ok: np.ndarray) -> None:
+        rep.present[name] = present
+        rep.checks[name] = ~present | ok
+
+    has_iban = iban != ""
+    put("iban_format", has_iban, np.array([bool(RE_IBAN_KZ.fullmatch(v)) for v in iban], dtype=bool))
+    put("iban_checksum", has_iban, _iban_ok(iban))
+    put("bic_format", bic != "", np.array([bool(RE_BIC.fullmatch(v)) for v in bic], dtype=bool))
+
+    fmt, d = _iin_digits(iin)
+    has_iin = iin != ""
+    put("iin_checksum", has_iin, _iin_ok(fmt, d))
+    put("iin_birth_date", has_iin, _iin_date_ok(fmt, d, today64))
+
+    # банк: код из IBAN → ожидаемый BIC по таблице
+    codes = np.array([s[4:7] if len(s) >= 7 else "" for s in iban])
+    expected = np.array([KZ_BANK_BIC.get(c, "") for c in codes])
+    both = has_iban & (bic != "") & (expected != "")
+    put("bic_iban_bank", both, np.char.startswith(bic, expected) | ~both)
+
+    amt = _amounts(amt_s)
+    has_amt = amt_s != ""
+    put("amount_numeric", has_amt, np.isfinite(amt))
+    put("amount_range", has_amt & np.isfinite(amt), (amt > 0) & (amt < MAX_AMOUNT))
+    put("currency_iso", cur != "", np.isin(cur, CURRENCIES))
+    put("amount_currency", has_amt, cur != "")
+
+    day = today or date.today()
+    put("date_iso", dt != "", np.array([_date_ok(v, day) for v in dt], dtype=bool))
+
+    # обязательные поля по типу документа
+    rep.missing_required = np.array([
+        sum(1 for f in required_fields(r["docType"]) if not row.get(f)) if isinstance(r, dict) and "docType" in r else 0
+        for r, row in zip(results, rows)
+    ], dtype=np.int64)
+    return rep
@@ -3,6 +3,9 @@ from pathlib import Path
 from typing import List
 from PIL import Image, ImageEnhance, ImageFilter
 import fitz
+import numpy as np
+
+from utils.page_buffer import PageBuffer
 
 
 def pdf_to_images(path: str | Path, dpi: int = 300) -> List[Image.Image]:
@@ -27,6 +30,17 @@ def pdf_to_images(path: str | Path, dpi: int = 300) -> List[Image.Image]:
     return pages
 
 
+def pdf_to_arrays(path: str | Path, dpi: int = 300) -> List[np.ndarray]:
+    """
+    Как pdf_to_images, но сразу RGB-массивы (H, W, 3) uint8 — без промежуточного PIL.
+    Дальше страница идёт по цепочке одним буфером (см. utils/page_buffer.py).
+    """
+    doc = fitz.open(str(path))
+    zoom = dpi / 72.0
+    mat = fitz.Matrix(zoom, zoom)
+    return [PageBuffer.from_pixmap(page.get_pixmap(matrix=mat, alpha=False)).array for page in doc]
+
+
 def preprocess_light(img: Image.Image) -> Image.Image:
     """
     Лёгкая предобработка изображения: увеличение контраста,
@@ -0,0 +1,103 @@
+# src/render.py
+from __future__ import annotations
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from utils.image_tools import safe_crop
+
+
+def render_overlay(
+    page: Image.Image | np.ndarray,
+    ocr_items: Sequence[Dict[str, Any]],
+    *,
+    max_side: int | None = None,
+    scale: float = 1.0,
+    color: Tuple[int, int, int] = (0, 255, 0),
+    width: int = 1,
+) -> Image.Image:
+    """
+    Рисует bbox OCR поверх страницы. Исходник не меняется.
+    scale — масштаб bbox относительно page (если page уже уменьшена);
+    max_side — дополнительно уменьшить результат до этого размера по длинной стороне.
+    """
+    img = Image.fromarray(page) if isinstance(page, np.ndarray) else page.copy()
+    if max_side and max(img.size) > max_side:
+        k = max_side / float(max(img.size))
+        img = img.resize((max(1, int(img.width * k)), max(1, int(img.height * k))), Image.BILINEAR)
+        scale *= k
+    draw = ImageDraw.Draw(img)
+    for o in ocr_items:
+        bb = o.get("bbox")
+        if bb:
+            x1, y1, x2, y2 = (int(v * scale) for v in bb)
+            draw.rectangle((x1, y1, x2, y2), outline=color, width=width)
+    return img
+
+
+class PagePreviews:
+    """
+    Превью страниц для UI: вместо полноразмерных аннотированных страниц хранятся
+    уменьшенные JPEG-байты (≈ в 10+ раз меньше памяти на сессию). Оверлей bbox
+    и декодированные картинки строятся по запросу и держатся в маленьком LRU-кеше.
+    """
+
+    def __init__(
+        self,
+        pages: Sequence[Image.Image | np.ndarray],
+        ocr_pages: Sequence[Sequence[Dict[str, Any]]],
+        *,
+        max_side: int = 1400,
+        quality: int = 80,
+        cache_size: int = 6,
+    ) -> None:
+        self._blobs: List[bytes] = []
+        self._scales: List[float] = []
+        self._ocr = [list(p or []) for p in ocr_pages]
+        self._cache: "OrderedDict[Tuple[Any, ...], Image.Image]" = OrderedDict()
+        self._cache_size = cache_size
+        for page in pages:
+            img = Image.fromarray(page) if isinstance(page, np.ndarray) else page
+            k = min(1.0, max_side / float(max(img.size)))
+            if k < 1.0:
+                img = img.resize((max(1, int(img.width * k)), max(1, int(img.height * k))), Image.BILINEAR)
+            buf = BytesIO()
+            img.convert("RGB").save(buf, format="JPEG", quality=quality, optimize=True)
+            self._blobs.append(buf.getvalue())
+            self._scales.append(k)
+
+    def __len__(self) -> int:
+        return len(self._blobs)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(b) for b in self._blobs)
+
+    def _cached(self, key: Tuple[Any, ...], build) -> Image.Image:
+        img = self._cache.get(key)
+        if img is None:
+            img = build()
+            self._cache[key] = img
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return img
+
+    def page(self, i: int) -> Image.Image:
+        """Превью страницы без разметки."""
+        return self._cached(("page", i), lambda: Image.open(BytesIO(self._blobs[i])).convert("RGB"))
+
+    def overlay(self, i: int, *, max_side: int | None = None) -> Image.Image:
+        """Превью страницы с bbox OCR (строится один раз на (страница, размер))."""
+        ocr = self._ocr[i] if i < len(self._ocr) else []
+        return self._cached(("overlay", i, max_side),
+                            lambda: render_overlay(self.page(i), ocr, max_side=max_side, scale=self._scales[i]))
+
+    def crop(self, i: int, bbox: Sequence[int], expand: int = 2) -> Image.Image | None:
+        """Фрагмент превью по bbox в координатах исходной страницы."""
+        k = self._scales[i]
+        return safe_crop(self.page(i), [int(v * k) for v in bbox], expand=expand)
@@ -0,0 +1,386 @@
+# src/result_store.py
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+import argparse
+import json
+import mmap
+import struct
+import sys
+import threading
+
+import numpy as np
+
+from src.field_rules import ALL_FIELDS
+
+if TYPE_CHECKING:
+    import os
+
+# Компактное хранение результатов run_pipeline: один файл-журнал на набор документов.
+#
+# Файл — заголовок MAGIC и кадры «4 байта длины (little-endian) + MessagePack-запись».
+# В записи результат лежит как есть, но debug.ocr упакован по столбцам: тексты строк списком,
+# bbox — int32-массив n×4, conf — float64, наличие bbox и weak — битовые маски.
+# Запись дописывается в конец файла, чтение — через mmap, с доступом по номеру записи.
+# unpack_result возвращает прежний JSON-вид.
+
+MAGIC = b"OCR2PK01"
+_LEN = struct.Struct("<I")
+_ITEM_KEYS = ("text", "bbox", "conf", "weak")
+
+PathLike = Union[str, "os.PathLike[str]"]
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError as e:  # pragma: no cover - зависит от окружения
+        raise RuntimeError("Для src/result_store.py нужен пакет msgpack: pip install msgpack") from e
+    return msgpack
+
+
+# --- упаковка OCR-страниц по столбцам ---
+def pack_page(items: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    n = len(items)
+    boxes = np.zeros((n, 4), dtype="<i4")
+    has_box = np.zeros(n, dtype=bool)
+    conf = np.zeros(n, dtype="<f8")
+    weak = np.zeros(n, dtype=bool)
+    extra: Dict[int, Dict[str, Any]] = {}
+    for i, it in enumerate(items):
+        bb = it.get("bbox")
+        if bb is not None and len(bb) == 4 and all(isinstance(v, int) for v in bb):
+            boxes[i] = bb
+            has_box[i] = True
+        elif bb is not None:
+            extra.setdefault(i, {})["bbox"] = bb  # полигон или float — как есть
+        conf[i] = float(it.get("conf") or 0.0)
+        weak[i] = bool(it.get("weak"))
+        rest = {k: v for k, v in it.items() if k not in _ITEM_KEYS}
+        if rest:
+            extra.setdefault(i, {}).update(rest)
+    page: Dict[str, Any] = {
+        "n": n,
+        "text": [it.get("text") or "" for it in items],
+        "bbox": boxes.tobytes(),
+        "has_bbox": np.packbits(has_box).tobytes(),
+        "conf": conf.tobytes(),
+    }
+    if weak.any():
+        page["weak"] = np.packbits(weak).tobytes()
+    if extra:
+        page["extra"] = extra
+    return page
+
+
+def unpack_page(page: Dict[str, Any]) -> List[Dict[str, Any]]:
+    n = page["n"]
+    boxes = np.frombuffer(page["bbox"], dtype="<i4").reshape(n, 4).tolist()
+    has_box = np.unpackbits(np.frombuffer(page["has_bbox"], dtype=np.uint8), count=n).astype(bool)
+    conf = np.frombuffer(page["conf"], dtype="<f8").tolist()
+    weak = (np.unpackbits(np.frombuffer(page["weak"], dtype=np.uint8), count=n).astype(bool)
+            if "weak" in page else None)
+    extra = page.get("extra") or {}
+    out: List[Dict[str, Any]] = []
+    for i in range(n):
+        it: Dict[str, Any] = {"text": page["text"][i], "bbox": boxes[i] if has_box[i] else None, "conf": conf[i]}
+        if weak is not None and weak[i]:
+            it["weak"] = True
+        if i in extra:
+            it.update(extra[i])
+        out.append(it)
+    return out
+
+
+def pack_result(result: Dict[str, Any], **meta: Any) -> Dict[str, Any]:
+    """Результат → запись журнала. meta (file, sha256, …) кладётся рядом с результатом."""
+    res = dict(result)
+    debug = dict(res.get("debug") or {})
+    ocr = debug.pop("ocr", None)
+    if debug or "debug" in res:
+        res["debug"] = debug
+    rec: Dict[str, Any] = {"v": 1, "result": res, **meta}
+    if ocr is not None:
+        rec["ocr"] = [pack_page(p) for p in ocr]
+    return rec
+
+
+def unpack_result(rec: Dict[str, Any]) -> Dict[str, Any]:
+    """Запись журнала → результат в прежнем JSON-виде (debug.ocr — список страниц со строками)."""
+    res = dict(rec["result"])
+    if "ocr" in rec:
+        res["debug"] = {"ocr": [unpack_page(p) for p in rec["ocr"]], **(res.get("debug") or {})}
+    return res
+
+
+def _default(o: Any) -> Any:
+    # numpy-скаляры и массивы встречаются в meta/debug
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, tuple):
+        return list(o)
+    raise TypeError(f"Не сериализуется в msgpack: {type(o).__name__}")
+
+
+def packb(result: Dict[str, Any], **meta: Any) -> bytes:
+    """Один результат → MessagePack-байты записи (без рамки журнала)."""
+    return _msgpack().packb(pack_result(result, **meta), default=_default, use_bin_type=True)
+
+
+def unpackb(data: bytes) -> Dict[str, Any]:
+    return unpack_result(_msgpack().unpackb(data, raw=False, strict_map_key=False))
+
+
+def _frame(result: Dict[str, Any], **meta: Any) -> bytes:
+    payload = packb(result, **meta)
+    return _LEN.pack(len(payload)) + payload
+
+
+def dumps(records: Sequence[Dict[str, Any]]) -> bytes:
+    """Содержимое файла-журнала целиком в памяти: [{"result": …, **meta}] → bytes (для скачивания)."""
+    return MAGIC + b"".join(_frame(r["result"], **{k: v for k, v in r.items() if k != "result"}) for r in records)
+
+
+class ResultLog:
+    """
+    Журнал результатов в одном файле. append() дописывает запись (потокобезопасно
+    в пределах процесса), чтение — по mmap: len(), log[i], итерация, records().
+
+        log = ResultLog("archive.ocrpack")
+        log.append(result, file="scan.pdf")
+        for res in log: ...
+    """
+
+    def __init__(self, path: PathLike) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._offsets: List[int] = []
+        self._scanned = 0  # до какого байта файл уже проиндексирован
+        self._mm: Optional[mmap.mmap] = None
+        self._mm_size = 0
+
+    # --- запись ---
+    def append(self, result: Dict[str, Any], **meta: Any) -> int:
+        """Дописывает результат; возвращает номер записи."""
+        frame = _frame(result, **meta)
+        with self._lock:
+            new = not self.path.exists() or self.path.stat().st_size == 0
+            with open(self.path, "ab") as f:
+                f.write(MAGIC + frame if new else frame)  # один write — кадр не рвётся между процессами
+            self._reindex()
+            return len(self._offsets) - 1
+
+    def extend(self, results: Sequence[Dict[str, Any]]) -> None:
+        for r in results:
+            self.append(r)
+
+    # --- чтение ---
+    def _map(self) -> mmap.mmap:
+        size = self.path.stat().st_size
+        if self._mm is None or size != self._mm_size:
+            if self._mm is not None:
+                self._mm.close()
+            with open(self.path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mm_size = size
+        return self._mm
+
+    def _reindex(self) -> None:
+        """Дочитывает длины новых кадров; сами записи не разбираются."""
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            return
+        mm = self._map()
+        if self._scanned == 0:
+            if mm[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{self.path}: не журнал результатов (нет заголовка {MAGIC!r})")
+            self._scanned = len(MAGIC)
+        pos, size = self._scanned, len(mm)
+        while pos + _LEN.size <= size:
+            (n,) = _LEN.unpack_from(mm, pos)
+            if pos + _LEN.size + n > size:
+                break  # недописанный хвост (запись идёт прямо сейчас или оборвалась)
+            self._offsets.append(pos)
+            pos += _LEN.size + n
+        self._scanned = pos
+
+    def record(self, i: int) -> Dict[str, Any]:
+        """Сырая запись (result + ocr по столбцам + meta)."""
+        with self._lock:
+            self._reindex()
+            pos = self._offsets[i]
+            mm = self._map()
+            (n,) = _LEN.unpack_from(mm, pos)
+            start = pos + _LEN.size
+            with memoryview(mm) as mv:  # без копии кадра; view отпускается до возможного remap
+                return _msgpack().unpackb(mv[start:start + n], raw=False, strict_map_key=False)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._reindex()
+            return len(self._offsets)
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        return unpack_result(self.record(i))
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self.record(i)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for rec in self.records():
+            yield unpack_result(rec)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+
+    def __enter__(self) -> "ResultLog":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+# --- конвертеры ---
+def to_jsonl(log: ResultLog, out: PathLike) -> int:
+    """Журнал → JSONL в прежнем виде ({"file", …, "result"} на строку). Возвращает число записей."""
+    n = 0
+    with open(out, "w", encoding="utf-8") as f:
+        for rec in log.records():
+            meta = {k: v for k, v in rec.items() if k not in ("v", "result", "ocr")}
+            f.write(json.dumps({**meta, "result": unpack_result(rec)}, ensure_ascii=False) + "\n")
+            n += 1
+    return n
+
+
+def from_jsonl(src: PathLike, log: ResultLog) -> int:
+    """JSONL (как отдаёт src/batch.to_jsonl или to_jsonl выше) или один JSON-результат → журнал."""
+    n = 0
+    with open(src, "r", encoding="utf-8") as f:
+        head = f.read(1)
+        f.seek(0)
+        if head == "{" and not f.readline().rstrip().endswith("}"):
+            # многострочный JSON одного результата (экспорт из демо, indent=2)
+            f.seek(0)
+            log.append(json.load(f), file=Path(src).name)
+            return 1
+        f.seek(0)
+        for line in f:
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            if "result" in obj and isinstance(obj["result"], dict):
+                meta = {k: v for k, v in obj.items() if k != "result"}
+                log.append(obj["result"], **meta)
+            elif "docType" in obj:
+                log.append(obj)
+            else:
+                continue
+            n += 1
+    return n
+
+
+def to_parquet(log: ResultLog, out_dir: PathLike) -> Dict[str, str]:
+    """
+    Журнал → две Parquet-таблицы (нужен pyarrow): fields.parquet — документ на строку
+    (поля, docType, needs_review), ocr_items.parquet — строка OCR на строку (doc, page, line,
+    text, x1..y2, conf). Таблицы читаются pyarrow/pandas/DuckDB, в т.ч. с memory_map.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:  # pragma: no cover - зависит от окружения
+        raise RuntimeError("Для экспорта в Parquet нужен pyarrow: pip install pyarrow") from e
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    docs: Dict[str, List[Any]] = {k: [] for k in ("doc", "file", "docType", "pages", "needs_review", *ALL_FIELDS)}
+    items: Dict[str, List[Any]] = {k: [] for k in ("doc", "page", "line", "text", "conf")}
+    boxes: List[np.ndarray] = []
+    has_boxes: List[np.ndarray] = []
+    for d, rec in enumerate(log.records()):
+        res = rec["result"]
+        fields = res.get("fields") or {}
+        docs["doc"].append(d)
+        docs["file"].append(rec.get("file"))
+        docs["docType"].append(res.get("docType"))
+        docs["pages"].append((res.get("meta") or {}).get("pages"))
+        docs["needs_review"].append(res.get("needs_review"))
+        for k in ALL_FIELDS:
+            docs[k].append(fields.get(k))
+        for p, page in enumerate(rec.get("ocr") or ()):
+            n = page["n"]
+            items["doc"].extend([d] * n)
+            items["page"].extend([p] * n)
+            items["line"].extend(range(n))
+            items["text"].extend(page["text"])
+            items["conf"].extend(np.frombuffer(page["conf"], dtype="<f8").tolist())
+            boxes.append(np.frombuffer(page["bbox"], dtype="<i4").reshape(n, 4))
+            has_boxes.append(np.unpackbits(np.frombuffer(page["has_bbox"], dtype=np.uint8), count=n).astype(bool))
+    bb = np.concatenate(boxes) if boxes else np.zeros((0, 4), dtype="<i4")
+    no_box = ~np.concatenate(has_boxes) if has_boxes else np.zeros(0, dtype=bool)
+    table = pa.table({**items, **{k: pa.array(bb[:, j], mask=no_box)  # нет bbox → null
+                                  for j, k in enumerate(("x1", "y1", "x2", "y2"))}})
+    paths = {"fields": str(out / "fields.parquet"), "ocr_items": str(out / "ocr_items.parquet")}
+    pq.write_table(pa.table(docs), paths["fields"], compression="zstd")
+    pq.write_table(table, paths["ocr_items"], compression="zstd")
+    return paths
+
+
+def iter_results(paths: Sequence[str]) -> Iterable[Tuple[Dict[str, Any], str, Optional[str]]]:
+    """JSON/JSONL (экспорт демо и batch.to_jsonl) или журнал .ocrpack → (result, key, file)."""
+    for path in paths:
+        if path.endswith(".ocrpack"):
+            with ResultLog(path) as log:
+                for i, rec in enumerate(log.records()):
+                    yield unpack_result(rec), rec.get("key") or f"{path}#{i}", rec.get("file")
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        try:
+            objs = [json.loads(text)]
+        except json.JSONDecodeError:
+            objs = [json.loads(ln) for ln in text.splitlines() if ln.strip()]
+        for i, obj in enumerate(objs):
+            res = obj.get("result") if isinstance(obj.get("result"), dict) else obj
+            if res and "docType" in res:
+                yield res, obj.get("key") or f"{path}#{i}", obj.get("file") or Path(path).name
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.result_store",
+                                 description="Журнал результатов OCR (MessagePack): импорт, экспорт, просмотр")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("pack", help="JSON/JSONL → журнал (дописывает)")
+    p.add_argument("src", nargs="+")
+    p.add_argument("log")
+    p = sub.add_parser("unpack", help="журнал → JSONL в прежнем виде")
+    p.add_argument("log")
+    p.add_argument("out")
+    p = sub.add_parser("parquet", help="журнал → fields.parquet + ocr_items.parquet")
+    p.add_argument("log")
+    p.add_argument("out_dir")
+    p = sub.add_parser("show", help="одна запись в JSON")
+    p.add_argument("log")
+    p.add_argument("index", type=int)
+    a = ap.parse_args(argv)
+
+    with ResultLog(a.log) as log:
+        if a.cmd == "pack":
+            n = sum(from_jsonl(s, log) for s in a.src)
+            print(f"{n} записей → {a.log} (всего {len(log)})")
+        elif a.cmd == "unpack":
+            print(f"{to_jsonl(log, a.out)} записей → {a.out}")
+        elif a.cmd == "parquet":
+            print(json.dumps(to_parquet(log, a.out_dir), ensure_ascii=False))
+        elif a.cmd == "show":
+            json.dump(log[a.index], sys.stdout, ensure_ascii=False, indent=2)
+            print()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,346 @@
+# src/search_index.py
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from src.amounts import parse_number
+from src.field_rules import ALL_FIELDS
+from src.post_rules import NORMALIZERS
+from src.result_store import iter_results
+
+# Локальный поисковый индекс по результатам run_pipeline (SQLite, один файл).
+#
+# docs   — документ на строку (ключ кеша/хэш, имя файла, тип, needs_review);
+# fields — точные значения полей (field, value, doc) без rowid: поиск по IBAN/БИН/номеру —
+#          один спуск по B-дереву, миллисекунды и на миллионах документов; num — число
+#          для диапазонов сумм;
+# lines  — строки OCR и разделов, полнотекстовый поиск через FTS5 (external content,
+#          синхронизируется триггерами, переиндексация документа — удаление по doc).
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    file TEXT,
+    doc_type TEXT,
+    pages INTEGER,
+    needs_review INTEGER,
+    indexed_at REAL
+);
+CREATE TABLE IF NOT EXISTS fields (
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    doc INTEGER NOT NULL REFERENCES docs(id) ON DELETE CASCADE,
+    num REAL,
+    PRIMARY KEY (field, value, doc)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS fields_doc ON fields(doc);
+CREATE INDEX IF NOT EXISTS fields_num ON fields(field, num) WHERE num IS NOT NULL;
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    doc INTEGER NOT NULL REFERENCES docs(id) ON DELETE CASCADE,
+    page INTEGER,
+    line INTEGER,
+    kind TEXT,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lines_doc ON lines(doc);
+CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts USING fts5(
+    text, content='lines', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS lines_ai AFTER INSERT ON lines BEGIN
+    INSERT INTO lines_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS lines_ad AFTER DELETE ON lines BEGIN
+    INSERT INTO lines_fts(lines_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+# Распознавание запроса в общей строке поиска: поле по виду значения
+_QUERY_FIELDS: Sequence[Tuple[str, re.Pattern]] = (
+    ("iban", re.compile(r"(?i)^KZ\d{2}[0-9A-Z ]{16,20}$")),
+    ("iin_bin", re.compile(r"^\d{12}$")),
+    ("date", re.compile(r"^(?:20\d{2}[-./]\d{1,2}[-./]\d{1,2}|\d{1,2}[-./]\d{1,2}[-./]20\d{2})$")),
+    ("bic", re.compile(r"^[A-Z]{4}KZ[A-Z0-9]{2}(?:[A-Z0-9]{3})?$")),
+    ("amount", re.compile(r"^[\d\s  .,]+(?:₸|тенге|kzt)?$", re.I)),
+)
+_FTS_TOKEN = re.compile(r"\w+\*?")
+
+PathLike = Union[str, "os.PathLike[str]"]
+
+
+@dataclass
+class Hit:
+    doc: int
+    key: str
+    file: Optional[str]
+    doc_type: Optional[str]
+    needs_review: bool
+    matches: List[Dict[str, Any]] = field(default_factory=list)  # {field, value} или {page, line, snippet}
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"doc": self.doc, "key": self.key, "file": self.file, "docType": self.doc_type,
+                "needs_review": self.needs_review, "matches": self.matches}
+
+
+def norm_value(field_name: str, value: Any) -> Optional[str]:
+    """Значение поля в том виде, в каком оно хранится и ищется в индексе."""
+    if value is None or value == "":
+        return None
+    s = str(value).strip()
+    fn = NORMALIZERS.get(field_name)
+    if fn is None:
+        return " ".join(s.casefold().split()) or None  # номер счёта, стороны — без регистра и лишних пробелов
+    return fn(s.replace(" ", "").upper() if field_name in ("iban", "bic") else s)
+
+
+def _num(field_name: str, value: str) -> Optional[float]:
+    if field_name != "amount":
+        return None
+    n = parse_number(value)
+    return float(n) if n is not None else None
+
+
+def fts_query(q: str) -> str:
+    """Строка пользователя → запрос FTS5: слова в кавычках через AND, «слово*» — префикс."""
+    toks = _FTS_TOKEN.findall(q or "")
+    return " ".join(f'"{t[:-1]}"*' if t.endswith("*") else f'"{t}"' for t in toks)
+
+
+class SearchIndex:
+    """
+    Индекс обработанных документов. Пишется инкрементально (add/add_job после каждого
+    документа), читается из любого потока. Одно соединение под блокировкой: SQLite в
+    WAL-режиме, запросы короткие.
+
+        idx = SearchIndex("ocr_index.sqlite")
+        idx.add(result, key=sha256, file="scan.pdf")
+        idx.find("iban", "KZ86 1250 ...")   # точное значение поля
+        idx.search("договор поставки")      # полнотекст по строкам OCR и разделам
+        idx.query("KZ86125...")             # поле угадывается по виду запроса
+    """
+
+    def __init__(self, path: PathLike = ":memory:") -> None:
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+
+    # --- запись ---
+    def add(self, result: Dict[str, Any], *, key: str, file: Optional[str] = None) -> int:
+        """Добавляет или заменяет документ (по key). Возвращает id документа."""
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                doc = self._add(result, key=key, file=file)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return doc
+
+    def add_many(self, items: Iterable[Tuple[Dict[str, Any], str, Optional[str]]], *, batch: int = 500) -> int:
+        """Массовая загрузка (result, key, file): транзакция на batch документов. Возвращает число документов."""
+        n = 0
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                for result, key, file in items:
+                    self._add(result, key=key, file=file)
+                    n += 1
+                    if n % batch == 0:
+                        self._db.execute("COMMIT")
+                        self._db.execute("BEGIN")
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return n
+
+    def add_job(self, job: Any) -> None:
+        """Обработчик JobRunner(on_done=...): индексирует завершённый документ."""
+        if job.result is not None:
+            self.add(job.result, key=job.key or job.id, file=job.name)
+
+    def _add(self, result: Dict[str, Any], *, key: str, file: Optional[str]) -> int:
+        db = self._db
+        db.execute("DELETE FROM docs WHERE key = ?", (key,))  # каскадом — поля и строки
+        cur = db.execute(
+            "INSERT INTO docs(key, file, doc_type, pages, needs_review, indexed_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, file, result.get("docType"), (result.get("meta") or {}).get("pages"),
+             int(bool(result.get("needs_review"))), time.time()))
+        doc = cur.lastrowid
+        rows = []
+        for k, v in (result.get("fields") or {}).items():
+            nv = norm_value(k, v)
+            if nv:
+                rows.append((k, nv, doc, _num(k, nv)))
+        db.executemany("INSERT OR IGNORE INTO fields(field, value, doc, num) VALUES (?, ?, ?, ?)", rows)
+        lines = [(doc, p, i, "ocr", it.get("text"))
+                 for p, page in enumerate((result.get("debug") or {}).get("ocr") or ())
+                 for i, it in enumerate(page) if it.get("text")]
+        for i, sec in enumerate(result.get("sections") or ()):
+            text = " ".join(filter(None, (sec.get("title"), sec.get("content"))))
+            if text:
+                lines.append((doc, int(sec.get("page_from", 1)) - 1, i, "section", text))
+        db.executemany("INSERT INTO lines(doc, page, line, kind, text) VALUES (?, ?, ?, ?, ?)", lines)
+        return doc
+
+    def remove(self, key: str) -> bool:
+        with self._lock:
+            return self._db.execute("DELETE FROM docs WHERE key = ?", (key,)).rowcount > 0
+
+    def optimize(self) -> None:
+        """Слияние сегментов FTS после массовой загрузки."""
+        with self._lock:
+            self._db.execute("INSERT INTO lines_fts(lines_fts) VALUES ('optimize')")
+
+    # --- чтение ---
+    def _hits(self, rows: Sequence[Tuple[int, Dict[str, Any]]]) -> List[Hit]:
+        """(doc, совпадение) → Hit на документ, в порядке первого появления."""
+        by_doc: Dict[int, Hit] = {}
+        ids = list(dict.fromkeys(d for d, _ in rows))
+        if ids:
+            q = f"SELECT id, key, file, doc_type, needs_review FROM docs WHERE id IN ({','.join('?' * len(ids))})"
+            for d, key, file, dt, nr in self._db.execute(q, ids):
+                by_doc[d] = Hit(d, key, file, dt, bool(nr))
+        for d, m in rows:
+            if d in by_doc:
+                by_doc[d].matches.append(m)
+        return [by_doc[d] for d in ids if d in by_doc]
+
+    def find(self, field_name: str, value: Any, *, limit: int = 100) -> List[Hit]:
+        """
+        Документы с точным значением поля (значение нормализуется так же, как при записи).
+        Суммы сравниваются по числу: «12 500» находит сохранённое «12500.00».
+        """
+        nv = norm_value(field_name, value)
+        if not nv:
+            return []
+        num = _num(field_name, nv)
+        with self._lock:
+            if num is not None:
+                rows = self._db.execute(
+                    "SELECT doc, value FROM fields WHERE field = ? AND num = ? ORDER BY doc DESC LIMIT ?",
+                    (field_name, num, limit)).fetchall()
+            else:
+                rows = self._db.execute(
+                    "SELECT doc, value FROM fields WHERE field = ? AND value = ? ORDER BY doc DESC LIMIT ?",
+                    (field_name, nv, limit)).fetchall()
+            return self._hits([(d, {"field": field_name, "value": v}) for d, v in rows])
+
+    def find_range(self, field_name: str, lo: Any = None, hi: Any = None, *, limit: int = 100) -> List[Hit]:
+        """Диапазон: суммы — по числу, даты и прочее — по строке (даты хранятся в ISO)."""
+        with self._lock:
+            if field_name == "amount":
+                col = "num"
+                a = _num("amount", str(lo)) if lo is not None else None
+                b = _num("amount", str(hi)) if hi is not None else None
+            else:
+                col, a, b = "value", norm_value(field_name, lo), norm_value(field_name, hi)
+            sql = "SELECT doc, value FROM fields WHERE field = ?"
+            args: List[Any] = [field_name]
+            if a is not None:
+                sql += f" AND {col} >= ?"
+                args.append(a)
+            if b is not None:
+                sql += f" AND {col} <= ?"
+                args.append(b)
+            rows = self._db.execute(sql + f" ORDER BY {col} LIMIT ?", (*args, limit)).fetchall()
+            return self._hits([(d, {"field": field_name, "value": v}) for d, v in rows])
+
+    def search(self, q: str, *, limit: int = 20, raw: bool = False) -> List[Hit]:
+        """Полнотекстовый поиск по строкам OCR и разделам (bm25). raw=True — q как есть в синтаксисе FTS5."""
+        match = q if raw else fts_query(q)
+        if not match:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT l.doc, l.page, l.line, l.kind, snippet(lines_fts, 0, '[', ']', '…', 12) "
+                "FROM lines_fts JOIN lines l ON l.id = lines_fts.rowid "
+                "WHERE lines_fts MATCH ? ORDER BY bm25(lines_fts) LIMIT ?", (match, limit * 5)).fetchall()
+            hits = self._hits([(d, {"page": p + 1, "line": i, "kind": k, "snippet": s}) for d, p, i, k, s in rows])
+        return hits[:limit]
+
+    def query(self, q: str, *, limit: int = 20) -> List[Hit]:
+        """Общая строка поиска: IBAN, ИИН/БИН, BIC, дата, сумма — точным поиском по полю, иначе полнотекст."""
+        s = (q or "").strip()
+        for name, rx in _QUERY_FIELDS:
+            if rx.match(s):
+                hits = self.find(name, s, limit=limit)
+                if hits:
+                    return hits
+        m = re.match(r"^(\w+)\s*[:=]\s*(.+)$", s)  # «invoice_no: 123», «payer=ТОО …»
+        if m and m.group(1) in ALL_FIELDS:
+            return self.find(m.group(1), m.group(2), limit=limit)
+        return self.search(s, limit=limit)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            one = lambda sql: self._db.execute(sql).fetchone()[0]  # noqa: E731
+            return {"docs": one("SELECT count(*) FROM docs"), "fields": one("SELECT count(*) FROM fields"),
+                    "lines": one("SELECT count(*) FROM lines"),
+                    "needs_review": one("SELECT count(*) FROM docs WHERE needs_review")}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.search_index", description="Поиск по обработанным документам")
+    ap.add_argument("--db", default=os.getenv("SEARCH_DB", "ocr_index.sqlite"))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("add", help="проиндексировать JSON/JSONL/.ocrpack")
+    p.add_argument("paths", nargs="+")
+    p = sub.add_parser("find", help="точное значение поля")
+    p.add_argument("field")
+    p.add_argument("value")
+    p = sub.add_parser("range", help="диапазон значений поля (amount — по числу)")
+    p.add_argument("field")
+    p.add_argument("lo", nargs="?")
+    p.add_argument("hi", nargs="?")
+    p = sub.add_parser("search", help="полнотекст по строкам OCR и разделам")
+    p.add_argument("query")
+    p = sub.add_parser("q", help="общая строка поиска (поле угадывается)")
+    p.add_argument("query")
+    sub.add_parser("stats")
+    for name in ("find", "range", "search", "q"):
+        sub.choices[name].add_argument("-n", "--limit", type=int, default=20)
+    a = ap.parse_args(argv)
+
+    idx = SearchIndex(a.db)
+    t = time.perf_counter()
+    if a.cmd == "add":
+        n = idx.add_many(iter_results(a.paths))
+        idx.optimize()
+        out: Any = {"added": n, **idx.stats()}
+    elif a.cmd == "find":
+        out = [h.as_dict() for h in idx.find(a.field, a.value, limit=a.limit)]
+    elif a.cmd == "range":
+        out = [h.as_dict() for h in idx.find_range(a.field, a.lo, a.hi, limit=a.limit)]
+    elif a.cmd == "search":
+        out = [h.as_dict() for h in idx.search(a.query, limit=a.limit)]
+    elif a.cmd == "q":
+        out = [h.as_dict() for h in idx.query(a.query, limit=a.limit)]
+    else:
+        out = idx.stats()
+    json.dump(out, sys.stdout, ensure_ascii=False, indent=2)
+    print(f"\n# {1000 * (time.perf_counter() - t):.1f} мс", file=sys.stderr)
+    idx.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,100 @@
+# src/second_pass.py
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import List, Dict, Any
+import numpy as np
+from PIL import Image
+
+from utils.image_tools import safe_crop
+from utils.page_buffer import image_size
+from utils.ocr_utils import preprocess_for_ocr
+
+
+@dataclass
+class SecondPassStats:
+    candidates: int = 0   # сколько строк ушло на повторное распознавание
+    improved: int = 0     # сколько строк заменили более уверенным чтением
+    skipped: int = 0      # не влезли в бюджет / плохой bbox
+
+    def as_dict(self) -> Dict[str, int]:
+        return {"candidates": self.candidates, "improved": self.improved, "skipped": self.skipped}
+
+
+@dataclass
+class SecondPass:
+    """
+    Адаптивный второй проход по «слабым» строкам.
+
+    Берёт только строки с уверенностью ниже порога (или помеченные PaddleEngine как weak),
+    вырезает их регион со страницы, прогоняет через жёсткий профиль препроцессинга
+    (binary + сильный апскейл) и распознаёт без детектора. Оставляет чтение с лучшим score.
+    Страницы без слабых строк ничего не платят.
+    """
+    upscale: float = 3.0          # во сколько раз увеличиваем кроп строки
+    min_width: int = 640          # минимальная ширина кропа после апскейла
+    expand: int = 4               # поля вокруг bbox, px
+    max_items: int = 48           # бюджет на страницу
+    max_aspect: float = 40.0      # слишком длинные «строки» rec-модель всё равно сожмёт
+    min_gain: float = 0.02        # новое чтение должно быть заметно увереннее
+    stats: SecondPassStats = field(default_factory=SecondPassStats)
+
+    def _needs_retry(self, item: Dict[str, Any], conf_threshold: float) -> bool:
+        return bool(item.get("weak")) or float(item.get("conf", 0.0)) < conf_threshold
+
+    def _prepare(self, crop: Image.Image | np.ndarray) -> np.ndarray:
+        target = max(self.min_width, int(image_size(crop)[0] * self.upscale))
+        # кроп — наша копия, его можно портить на месте; страница уже выровнена, а Хафф
+        # по одной строке угол не оценит — deskew пропускаем
+        return preprocess_for_ocr(crop, mode="binary", target_width=target, add_padding=8,
+                                  do_deskew=False, inplace=True, as_array=True)
+
+    def refine(self, engine, page: Image.Image | np.ndarray, items: List[Dict[str, Any]], *,
+               conf_threshold: float) -> List[Dict[str, Any]]:
+        """
+        Возвращает новый список элементов той же длины; слабые строки заменены
+        более уверенным чтением, если оно нашлось. Метка "weak" остаётся у строк,
+        которые улучшить не удалось, и у новых чтений, которые по-прежнему мусор
+        по engine.is_garbage.
+        """
+        out: List[Dict[str, Any]] = []
+        budget = self.max_items
+        for it in items:
+            if not self._needs_retry(it, conf_threshold):
+                out.append(it)
+                continue
+            self.stats.candidates += 1
+            bb = it.get("bbox")
+            base = {k: v for k, v in it.items() if k != "weak"}
+            keep = {**base, "weak": True} if it.get("weak") else base
+            if budget <= 0 or not bb:
+                self.stats.skipped += 1
+                out.append(keep)
+                continue
+            w, h = bb[2] - bb[0], bb[3] - bb[1]
+            if w <= 0 or h <= 0 or w / h > self.max_aspect:
+                self.stats.skipped += 1
+                out.append(keep)
+                continue
+            budget -= 1
+
+            crop = safe_crop(page, bb, expand=self.expand)
+            if crop is None:
+                self.stats.skipped += 1
+                out.append(keep)
+                continue
+            try:
+                txt, conf = engine.recognize(self._prepare(crop))
+            except Exception:
+                txt, conf = "", 0.0
+
+            old_conf = float(it.get("conf", 0.0))
+            if txt and conf >= old_conf + self.min_gain:
+                refined = {**base, "text": txt, "conf": conf, "refined": True}
+                if engine.is_garbage(txt, conf):
+                    refined["weak"] = True
+                else:
+                    self.stats.improved += 1
+                out.append(refined)
+            else:
+                out.append(keep)
+        return out
@@ -0,0 +1,185 @@
+# src/uploads.py
+from __future__ import annotations
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Optional
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+CHUNK = 1 << 20  # 1 МБ
+_SHA_HEX = frozenset("0123456789abcdef")
+
+
+def _owned(name: str) -> bool:
+    """Файл хранилища: имя начинается с sha256 содержимого («<sha256>.pdf», «<sha256>.<params>.json»)."""
+    stem = name.split(".", 1)[0]
+    return len(stem) == 64 and set(stem) <= _SHA_HEX
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+@dataclass
+class StoredUpload:
+    path: Path
+    sha256: str
+    size: int
+    reused: bool  # такой файл уже лежал в хранилище
+
+
+def params_digest(params: Dict[str, Any]) -> str:
+    """Короткий дайджест параметров пайплайна (порядок ключей не важен)."""
+    blob = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:12]
+
+
+def result_key(sha256: str, params: Dict[str, Any]) -> str:
+    """Ключ кеша результата: содержимое файла + параметры пайплайна."""
+    return f"{sha256}.{params_digest(params)}"
+
+
+class UploadStore:
+    """
+    Хранилище загрузок демо.
+
+    - файл пишется потоково (по 1 МБ) с подсчётом sha256 и лимитом размера —
+      без чтения всей загрузки в память;
+    - имя файла — хэш содержимого: коллизий имён между пользователями нет,
+      повторная загрузка того же файла переиспользует его (и кеш результата);
+    - фоновый janitor удаляет файлы старше ttl и держит каталог в пределах квоты,
+      не трогая файлы, которые сейчас в обработке (in_use), и файлы не из хранилища.
+    """
+
+    def __init__(
+        self,
+        root: str | Path,
+        *,
+        max_bytes: int = 200 << 20,
+        quota_bytes: int = 2 << 30,
+        ttl: float = 6 * 3600,
+        in_use: Optional[Callable[[], Iterable[str]]] = None,
+    ) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        (self.root / ".incoming").mkdir(exist_ok=True)
+        self.max_bytes = max_bytes
+        self.quota_bytes = quota_bytes
+        self.ttl = ttl
+        self.in_use = in_use or (lambda: ())
+        self._lock = threading.Lock()
+        self._janitor: Optional[threading.Thread] = None
+
+    # --- загрузка ---
+    def store(self, fileobj: BinaryIO, name: str, *, size_hint: Optional[int] = None) -> StoredUpload:
+        if size_hint is not None and size_hint > self.max_bytes:
+            raise UploadTooLarge(f"Файл больше {self.max_bytes >> 20} МБ")
+        suffix = Path(name).suffix.lower()
+        part = self.root / ".incoming" / f"{uuid.uuid4().hex}.part"
+        h = hashlib.sha256()
+        size = 0
+        try:
+            with open(part, "wb") as out:
+                while True:
+                    chunk = fileobj.read(CHUNK)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLarge(f"Файл больше {self.max_bytes >> 20} МБ")
+                    h.update(chunk)
+                    out.write(chunk)
+            sha = h.hexdigest()
+            final = self.root / f"{sha}{suffix}"
+            with self._lock:
+                if final.exists():
+                    os.utime(final)  # свежий mtime — janitor не удалит
+                    part.unlink()
+                    return StoredUpload(final, sha, size, reused=True)
+                os.replace(part, final)
+            return StoredUpload(final, sha, size, reused=False)
+        finally:
+            if part.exists():
+                part.unlink()
+
+    # --- кеш результатов (переживает перезапуск процесса) ---
+    def get_result(self, key: str) -> Optional[Dict[str, Any]]:
+        p = self.root / f"{key}.json"
+        try:
+            with open(p, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+            os.utime(p)
+            return data
+        except (OSError, ValueError):
+            return None
+
+    def put_result(self, key: str, result: Dict[str, Any]) -> None:
+        p = self.root / f"{key}.json"
+        tmp = p.with_suffix(".json.part")
+        try:
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump(result, fh, ensure_ascii=False)
+            os.replace(tmp, p)
+        except (OSError, TypeError, ValueError) as e:
+            logging.warning("Failed to cache result %s: %s", key, e)
+
+    # --- уборка ---
+    def cleanup(self) -> int:
+        """Удаляет просроченные файлы и лишнее сверх квоты (старые — первыми). Возвращает число удалённых."""
+        busy = {Path(p).name for p in self.in_use()}
+        busy_sha = {n.split(".", 1)[0] for n in busy}
+        now = time.time()
+        files = []
+        for p in self.root.iterdir():
+            # чужие файлы в каталоге (индекс поиска, заметки) не трогаем и в квоту не считаем
+            if not p.is_file() or not _owned(p.name):
+                continue
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        files.sort()
+
+        removed = 0
+        total = sum(sz for _, sz, _ in files)
+        for mtime, sz, p in files:
+            if p.name.split(".", 1)[0] in busy_sha:
+                continue
+            if now - mtime > self.ttl or total > self.quota_bytes:
+                try:
+                    p.unlink()
+                    removed += 1
+                    total -= sz
+                except OSError:
+                    pass
+        # недописанные .part от упавших загрузок
+        for p in (self.root / ".incoming").iterdir():
+            try:
+                if now - p.stat().st_mtime > 3600:
+                    p.unlink()
+            except OSError:
+                pass
+        return removed
+
+    def start_janitor(self, interval: float = 300.0) -> None:
+        if self._janitor is not None:
+            return
+
+        def loop() -> None:
+            while True:
+                try:
+                    n = self.cleanup()
+                    if n:
+                        logging.info("Upload janitor removed %d files", n)
+                except Exception:
+                    logging.exception("Upload janitor failed")
+                time.sleep(interval)
+
+        self._janitor = threading.Thread(target=loop, name="upload-janitor", daemon=True)
+        self._janitor.start()
@@ -3,7 +3,10 @@ import os
 os.environ.setdefault("TRANSFORMERS_USE_ACCELERATE", "0")
 os.environ.setdefault("TRANSFORMERS_NO_ADVISORY_WARNINGS", "1")
 
-from typing import Optional, List, Dict, Any
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Tuple
+import logging
+import shutil
 from huggingface_hub import list_repo_files, snapshot_download, hf_hub_download
 from safetensors.torch import load_file as safe_load
 from transformers import DonutProcessor, VisionEncoderDecoderModel, VisionEncoderDecoderConfig
@@ -20,6 +23,39 @@ CANDIDATES: List[str] = [
 ]
 
 
+# Режимы инференса (DONUT_MODE):
+#   fp32 — исходные веса;
+#   int8 — динамическая квантизация nn.Linear (веса int8, активации квантуются на лету):
+#          модель в ~3 раза меньше, generate на CPU заметно быстрее;
+#   onnx — экспорт в ONNX Runtime через optimum (пакет optimum[onnxruntime]),
+#          экспорт один раз кладётся в DONUT_ONNX_DIR.
+MODES = ("fp32", "int8", "onnx")
+
+# Ответ DocVQA на вопрос о типе документа → тип, который понимает конвейер
+CLASSIFY_QUESTION = "What type of document is this?"
+DOC_TYPE_WORDS: Dict[str, Tuple[str, ...]] = {
+    "receipt": ("receipt", "check", "чек", "квитанц", "invoice", "счет", "счёт", "bill"),
+    "statement": ("statement", "выписк", "bank"),
+    "contract": ("contract", "agreement", "договор", "контракт"),
+}
+
+
+def doc_type_from_answer(answer: str) -> Optional[str]:
+    a = (answer or "").lower()
+    for dt, words in DOC_TYPE_WORDS.items():
+        if any(w in a for w in words):
+            return dt
+    return None
+
+
+def _parse_size(s: Optional[str]) -> Optional[Tuple[int, int]]:
+    """«1280x960» → (высота, ширина)."""
+    if not s:
+        return None
+    h, _, w = s.lower().partition("x")
+    return int(h), int(w or h)
+
+
 def _find_safetensors_filename(repo_id: str) -> Optional[str]:
     files = list_repo_files(repo_id)
     for name in files:
@@ -29,8 +65,34 @@ def _find_safetensors_filename(repo_id: str) -> Optional[str]:
 
 
 class DonutEngine:
-    def __init__(self, model_id: Optional[str] = None) -> None:
+    """
+    Настройки (аргументы или переменные окружения):
+      mode / DONUT_MODE — fp32 | int8 | onnx (см. MODES);
+      threads / DONUT_THREADS — число потоков intra-op (torch.set_num_threads действует на весь
+        процесс; по умолчанию не больше 4, чтобы не отбирать ядра у PaddleOCR);
+      input_size / DONUT_INPUT_SIZE — «ВxШ» входа энкодера, напр. «1280x960» (у donut-base
+        2560x1920: вчетверо меньше пикселей — энкодер примерно вчетверо быстрее, точность ниже);
+      max_new_tokens / DONUT_MAX_NEW_TOKENS — предел генерации для infer();
+      DONUT_CLASSIFY_TOKENS — предел генерации для classify().
+    """
+
+    def __init__(
+        self,
+        model_id: Optional[str] = None,
+        *,
+        mode: Optional[str] = None,
+        threads: Optional[int] = None,
+        input_size: Optional[str] = None,
+        max_new_tokens: Optional[int] = None,
+    ) -> None:
         self.model_id = model_id or self._pick_model_with_safetensors()
+        self.mode = (mode or os.getenv("DONUT_MODE", "fp32")).lower()
+        if self.mode not in MODES:
+            raise ValueError(f"DONUT_MODE: ожидается одно из {MODES}, получено {self.mode!r}")
+        self.threads = threads or int(os.getenv("DONUT_THREADS", "0")) or min(4, os.cpu_count() or 1)
+        self.max_new_tokens = max_new_tokens or int(os.getenv("DONUT_MAX_NEW_TOKENS", "256"))
+        self.classify_tokens = int(os.getenv("DONUT_CLASSIFY_TOKENS", "16"))
+        torch.set_num_threads(self.threads)
 
         local_dir = snapshot_download(
             repo_id=self.model_id,
@@ -53,6 +115,9 @@ class DonutEngine:
                 self.processor.tokenizer.pad_token = self.processor.tokenizer.eos_token
         except Exception:
             pass
+        size = _parse_size(input_size or os.getenv("DONUT_INPUT_SIZE"))
+        if size:
+            self.processor.image_processor.size = {"height": size[0], "width": size[1]}
 
         st_name = _find_safetensors_filename(self.model_id)
         if st_name is None:
@@ -89,6 +154,36 @@ class DonutEngine:
 
         self.model.eval()
 
+        if self.mode == "int8":
+            self.model = torch.ao.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+        elif self.mode == "onnx":
+            try:
+                self.model = self._onnx_model()
+            except Exception as e:
+                logging.warning("Donut ONNX недоступен (%s), остаётся fp32", e)
+                self.mode = "fp32"
+
+    def _onnx_model(self) -> Any:
+        """ORTModelForVision2Seq из кеша DONUT_ONNX_DIR; при первом запуске — экспорт загруженной модели."""
+        import onnxruntime as ort
+        from optimum.onnxruntime import ORTModelForVision2Seq
+
+        root = Path(os.getenv("DONUT_ONNX_DIR") or Path.home() / ".cache" / "ocr2" / "donut-onnx")
+        out = root / self.model_id.replace("/", "--")
+        so = ort.SessionOptions()
+        so.intra_op_num_threads = self.threads
+        so.inter_op_num_threads = 1
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if not any(out.glob("*.onnx")):
+            # веса грузятся вручную (safetensors, strict=False) — экспортируем уже собранную модель
+            tmp = out / "_pt"
+            self.model.save_pretrained(tmp, safe_serialization=True)
+            ORTModelForVision2Seq.from_pretrained(tmp, export=True).save_pretrained(out)
+            shutil.rmtree(tmp, ignore_errors=True)
+        return ORTModelForVision2Seq.from_pretrained(out, session_options=so, provider="CPUExecutionProvider")
+
     def _pick_model_with_safetensors(self) -> str:
         last_err: Optional[Exception] = None
         for rid in CANDIDATES:
@@ -100,25 +195,32 @@ class DonutEngine:
         hint = f" (последняя ошибка: {last_err})" if last_err else ""
         raise RuntimeError("Не найден DocVQA чекпойнт с *.safetensors." + hint)
 
-    def infer(self, img: Image.Image, question: str = "Extract key fields") -> Dict[str, Any]:
+    def _generate(self, img: Image.Image, question: str, max_new_tokens: int) -> str:
+        """Ответ DocVQA без служебных тегов (то, что внутри <s_answer>)."""
+        tok = self.processor.tokenizer
         prompt = f"<s_docvqa><s_question>{question}</s_question><s_answer>"
+        pixel_values = self.processor(img, return_tensors="pt").pixel_values
+        task_ids = tok(prompt, add_special_tokens=False, return_tensors="pt").input_ids
 
-        enc = self.processor(img, return_tensors="pt")
-        pixel_values = enc.pixel_values
-
-        task_ids = self.processor.tokenizer(
-            prompt, add_special_tokens=False, return_tensors="pt"
-        ).input_ids
-
-        with torch.no_grad():
+        with torch.inference_mode():
             out_ids = self.model.generate(
                 pixel_values,
                 decoder_input_ids=task_ids,
-                max_new_tokens=256,
+                max_new_tokens=max_new_tokens,
                 use_cache=True,
+                eos_token_id=tok.eos_token_id,
+                pad_token_id=tok.pad_token_id,
             )
 
-        text = self.processor.batch_decode(out_ids, skip_special_tokens=True)[0]
+        seq = self.processor.batch_decode(out_ids[:, task_ids.shape[1]:])[0]
+        for t in (tok.eos_token, tok.pad_token, "</s_answer>"):
+            if t:
+                seq = seq.split(t)[0]
+        return re.sub(r"<[^>]+>", " ", seq).strip()
+
+    def infer(self, img: Image.Image, question: str = "Extract key fields",
+              max_new_tokens: Optional[int] = None) -> Dict[str, Any]:
+        text = self._generate(img, question, max_new_tokens or self.max_new_tokens)
         m = re.search(r"\{.*\}", text, flags=re.S)
         if m:
             try:
@@ -126,3 +228,11 @@ class DonutEngine:
             except json.JSONDecodeError:
                 return {"raw": text, "error": "Invalid JSON in output"}
         return {"raw": text}
+
+    def classify(self, img: Image.Image) -> Dict[str, Any]:
+        """
+        Только тип документа: короткий вопрос и DONUT_CLASSIFY_TOKENS токенов вместо
+        256 на «Extract key fields» — декодер, самая дорогая часть, работает в разы меньше.
+        """
+        answer = self._generate(img, CLASSIFY_QUESTION, self.classify_tokens)
+        return {"document_type": doc_type_from_answer(answer), "raw": answer}
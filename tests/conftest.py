@@ -0,0 +1,6 @@
+# tests/conftest.py
+import sys
+from pathlib import Path
+
+# модули импортируются как src.* / utils.*, как при запуске из корня репозитория
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
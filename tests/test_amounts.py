@@ -0,0 +1,33 @@
+# tests/test_amounts.py
+import pytest
+
+from src.amounts import currency_code, parse_number, same_amount, scan_amounts, words_amounts
+
+
+@pytest.mark.parametrize("raw, want", [
+    ("12 500,00 ₸", "12500.00"),
+    ("1 500", "1500"),
+    ("1.234.567,89", "1234567.89"),
+    ("1,234,567.89", "1234567.89"),
+    ("-200,00 руб.", "-200.00"),
+    ("0,5", "0.5"),
+])
+def test_parse_number(raw, want):
+    assert parse_number(raw) == want
+
+
+@pytest.mark.parametrize("raw", ["12.03.2024", "KZ12", "abc", "", None])
+def test_parse_number_rejects_non_amounts(raw):
+    assert parse_number(raw) is None
+
+
+def test_scan_amounts_picks_currency_on_either_side():
+    got = [(a.value, a.currency) for a in scan_amounts("₸ 1 500 и 200 USD, 7 шт")]
+    assert got == [("1500", "KZT"), ("200", "USD"), ("7", None)]
+    assert currency_code("тенге") == "KZT"
+
+
+def test_words_amount_matches_digits():
+    words = words_amounts("1 500 000 (один миллион пятьсот тысяч) тенге")
+    assert words and same_amount("1500000", words[0].value)
+    assert not same_amount("1500000", "150000")
@@ -0,0 +1,106 @@
+# tests/test_dedup.py
+import sqlite3
+
+import numpy as np
+import pytest
+
+pytest.importorskip("msgpack")
+
+from src.dedup import DedupIndex, fingerprint, hamming, page_hashes
+
+TEXT = "Выписка по счёту KZ18722S000012345678 за 01.03.2024 остаток 12 500,00 списано 3 400,00 зачислено 800"
+
+
+def _page(seed=0, w=600, h=800):
+    rng = np.random.default_rng(seed)
+    img = np.full((h, w, 3), 255, np.uint8)
+    for _ in range(40):
+        y, x = rng.integers(20, h - 40), rng.integers(20, w - 200)
+        img[y:y + 12, x:x + rng.integers(40, 180)] = 0
+    return img
+
+
+def _fp(sha, seed=0, text=TEXT):
+    fp = fingerprint([_page(seed)], sha256=sha)
+    fp.set_text(text)
+    return fp
+
+
+def test_page_hash_survives_small_shift():
+    a = _page(1)
+    b = np.full_like(a, 255)
+    b[3:, 2:] = a[:-3, :-2]
+    (ca, _), (cb, _) = page_hashes(a), page_hashes(b)
+    assert hamming(ca, cb) <= 3
+
+
+def test_same_file_is_reused_only_with_same_params():
+    idx = DedupIndex()
+    idx.add("a.p1", _fp("a"), {"fields": {"amount": "1"}}, params="p1")
+    m = idx.find_pages(_fp("a"), params="p1")
+    assert m.kind == "file" and m.reusable and m.result == {"fields": {"amount": "1"}}
+    other = idx.find_pages(_fp("a"), params="p2")
+    assert other.kind == "file" and not other.reusable and other.result is None
+    idx.add("a.p2", _fp("a"), {"fields": {"amount": "2"}}, params="p2")
+    assert idx.find_pages(_fp("a"), params="p2").result == {"fields": {"amount": "2"}}
+    assert idx.stats()["docs"] == 2
+
+
+def test_similar_page_is_only_flagged():
+    idx = DedupIndex()
+    idx.add("a.p", _fp("a", seed=3), {"fields": {}}, params="p")
+    m = idx.find_pages(_fp("b", seed=3), params="p")
+    assert m.kind == "pages" and not m.reusable and m.result is None
+    assert idx.find_pages(_fp("c", seed=4), params="p") is None
+
+
+def test_same_text_other_file_respects_params_and_digits():
+    idx = DedupIndex()
+    idx.add("a.p", _fp("a", seed=5), {"fields": {"amount": "12500.00"}}, params="p")
+    hit = idx.find_text(_fp("b", seed=6), params="p")
+    assert hit.kind == "text" and hit.same_digits and hit.result["fields"] == {"amount": "12500.00"}
+    assert idx.find_text(_fp("b", seed=6), params="q").result is None
+    changed = idx.find_text(_fp("b", seed=6, text=TEXT.replace("800", "900")), params="p")
+    assert changed is None or not changed.reusable
+    assert idx.find_text(_fp("a", seed=5), params="p") is None  # сам файл — не дубликат по тексту
+
+
+def test_old_database_gets_params_column(tmp_path):
+    path = tmp_path / "dedup.sqlite"
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE docs (id INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, sha256 TEXT, "
+               "n_pages INTEGER NOT NULL, simhash INTEGER, digits TEXT, created REAL, result BLOB)")
+    db.commit()
+    db.close()
+    idx = DedupIndex(path)
+    idx.add("a.p", _fp("a"), {"fields": {}}, params="p")
+    assert idx.find_pages(_fp("a"), params="p").reusable
+    idx.close()
+
+
+def test_reused_pages_match_bbox_coordinates():
+    pytest.importorskip("fitz")
+    from src.dedup import Match
+    from src.pipeline import _preprocess_page, _reuse_result
+
+    img = _page(7, w=500, h=700)
+    expected, _ = _preprocess_page(img.copy(), "soft")
+    seen = []
+    dup = Match("a.p", "file", [0], result={"fields": {}, "debug": {"ocr": [[{"text": "x", "bbox": [1, 2, 3, 4]}]]}})
+    result, pages = _reuse_result(dup, [img], preproc_mode="soft", tile_trigger=5000, return_pages=True,
+                                  on_page=lambda i, n, items: seen.append((i, n, len(items))))
+    assert pages[0].size == (expected.shape[1], expected.shape[0]) != (500, 700)
+    assert result["meta"]["dedup"]["reused"] and seen == [(0, 1, 1)]
+
+
+def test_memory_index_caps_stored_results():
+    idx = DedupIndex(max_results=2)
+    for i, sha in enumerate("abc"):
+        idx.add(f"{sha}.p", _fp(sha, seed=10 + i), {"fields": {"n": str(i)}}, params="p")
+        if sha == "b":
+            assert idx.find_pages(_fp("a", seed=10), params="p").result  # «a» использован позже «b»
+    assert idx.stats() == {"docs": 3, "pages": 3, "results": 2}
+    evicted = idx.find_pages(_fp("b", seed=11), params="p")
+    assert evicted.kind == "file" and evicted.result is None
+    assert idx.find_pages(_fp("a", seed=10), params="p").result == {"fields": {"n": "0"}}
+    assert DedupIndex().max_results > 0 and DedupIndex(max_results=0).max_results == 0
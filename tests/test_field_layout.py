@@ -0,0 +1,37 @@
+# tests/test_field_layout.py
+import pytest
+
+from src.field_layout import extract_layout_fields
+from src.field_rules import parse_value
+
+
+def _line(text, y, x1=10, x2=400):
+    return {"text": text, "bbox": [x1, y, x2, y + 20], "conf": 0.99}
+
+
+def test_parse_value_amount_needs_money_context():
+    assert parse_value("amount", "3 позиции") is None
+    assert parse_value("amount", ": 12 500 ₸").score >= 0.85
+    assert parse_value("amount", "12 500,00").score >= 0.85
+    bare = parse_value("amount", "12500")
+    assert bare.value == "12500" and bare.score < 0.85
+    assert parse_value("amount", "3 шт на 1 500 тенге").value == "1500"
+
+
+def test_item_count_line_gives_no_layout_amount():
+    assert "amount" not in extract_layout_fields([[_line("ИТОГО 3 позиции", 10)]])
+
+
+def test_tax_lines_do_not_replace_total():
+    page = [_line("Итого к оплате: 12 500 ₸", 10), _line("Сумма НДС: 1 339,29", 40), _line("Итого НДС: 1 339,29", 70)]
+    assert extract_layout_fields([page])["amount"].value == "12500"
+
+
+def test_layout_does_not_beat_rules_on_tie(monkeypatch):
+    post_llm = pytest.importorskip("src.post_llm")
+    from src.field_rules import FieldCandidate
+
+    monkeypatch.setattr(post_llm, "extract_layout_fields",
+                        lambda layout: {"amount": FieldCandidate("1", 0.92, source="layout")})
+    text = "ИТОГО: 12 500 ₸"
+    assert post_llm.LLMClient._candidates(text, [[_line(text, 10)]])["amount"].value == "12500"
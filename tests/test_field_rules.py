@@ -0,0 +1,49 @@
+# tests/test_field_rules.py
+from datetime import date
+
+import pytest
+
+from src.field_rules import confident_fields, extract_rule_fields, parse_value
+
+TODAY = date(2026, 1, 1)
+
+
+def _fields(text):
+    return extract_rule_fields(text, today=TODAY)
+
+
+def test_item_count_after_total_is_not_an_amount():
+    assert "amount" not in _fields("ИТОГО 3 позиции")
+    assert _fields("Итого 3 позиции\nИТОГО: 12 500 ₸")["amount"].value == "12500"
+
+
+def test_total_needs_currency_or_decimals():
+    assert _fields("Итого: 12 500,00")["amount"].score >= 0.85
+    assert _fields("Итого (KZT): 12500")["amount"].score >= 0.85
+    bare = _fields("Итого 12500")["amount"]
+    assert bare.value == "12500" and "amount" not in confident_fields({"amount": bare})
+
+
+def test_unlabeled_date_is_not_confident():
+    labeled = _fields("Чек № 42 от 15.03.2024")["date"]
+    assert labeled.value == "2024-03-15" and labeled.score >= 0.85
+    got = _fields("Годен до 15.03.2025")
+    assert got["date"].value == "2025-03-15" and "date" not in confident_fields(got)
+
+
+@pytest.mark.parametrize("text, want", [
+    ("Счёт: KZ86125KZT5004100100", None),
+    ("Номер счёта: KZ86125KZT5004100100", None),
+    ("Счет на оплату № 123 от 01.02.2024", "123"),
+    ("Счёт-фактура 45/2024", "45/2024"),
+    ("Invoice No. INV-0042", "INV-0042"),
+    ("Счет № АБВ, счет № 77", "77"),
+])
+def test_invoice_number(text, want):
+    got = _fields(text).get("invoice_no")
+    assert (got.value if got else None) == want
+
+
+def test_labelled_invoice_value_is_not_an_iban():
+    assert parse_value("invoice_no", ": KZ86125KZT5004100100") is None
+    assert parse_value("invoice_no", "№ 123").value == "123"
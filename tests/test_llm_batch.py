@@ -0,0 +1,49 @@
+# tests/test_llm_batch.py
+import threading
+import time
+
+import pytest
+
+from src.llm_batch import MicroBatcher
+
+
+def test_batches_and_fallback_singles():
+    b = MicroBatcher(lambda xs: [x * 10 if x != 2 else None for x in xs], lambda x: -x, max_size=4, max_wait=0.2)
+    futs = [b.submit(i) for i in range(1, 4)]
+    assert [f.result(timeout=2) for f in futs] == [10, -2, 30]
+
+
+def test_slow_batch_does_not_block_next_one():
+    release = threading.Event()
+    started = []
+
+    def run_batch(xs):
+        started.append(xs)
+        if xs[0] == "slow":
+            release.wait(2)
+        return [x.upper() for x in xs]
+
+    b = MicroBatcher(run_batch, str.upper, max_size=2, max_wait=0.05, workers=2)
+    slow = [b.submit("slow"), b.submit("slow2")]
+    time.sleep(0.1)
+    fast = [b.submit("a"), b.submit("b")]
+    assert [f.result(timeout=1) for f in fast] == ["A", "B"]
+    release.set()
+    assert [f.result(timeout=2) for f in slow] == ["SLOW", "SLOW2"]
+
+
+def test_cancelled_and_expired_items_are_not_sent():
+    sent = []
+
+    def run_batch(xs):
+        sent.extend(xs)
+        return list(xs)
+
+    b = MicroBatcher(run_batch, lambda x: sent.append(x) or x, max_size=8, max_wait=0.2,
+                     expired=lambda x: x == "late")
+    gone, late, ok = b.submit("gone"), b.submit("late"), b.submit("ok")
+    assert gone.cancel()
+    assert ok.result(timeout=2) == "ok"
+    with pytest.raises(TimeoutError):
+        late.result(timeout=2)
+    assert sent == ["ok"]
@@ -0,0 +1,52 @@
+# tests/test_llm_providers.py
+import time
+
+import pytest
+
+from src.llm_providers import BreakerOpen, CircuitBreaker, LLMError, LLMProvider, RateLimiter
+
+
+class _Fake(LLMProvider):
+    name = "fake"
+
+    def __init__(self, answers, **kw):
+        super().__init__("m", **kw)
+        self.answers = list(answers)
+        self.sent = 0
+
+    def _complete(self, system, parts, schema, *, model, max_tokens, timeout):
+        self.sent += 1
+        a = self.answers.pop(0)
+        if isinstance(a, Exception):
+            raise a
+        return a, 10, 2
+
+
+def test_complete_json_accounts_calls():
+    p = _Fake(['{"amount": "1"}'], limiter=RateLimiter(0))
+    got = []
+    assert p.complete_json("s", ["u"], {}, collect=got) == {"amount": "1"}
+    assert got[0].ok and p.usage()["prompt_tokens"] == 10
+
+
+def test_open_breaker_skips_rate_limit_wait():
+    p = _Fake([LLMError("boom")] * 2, breaker=CircuitBreaker(threshold=1, cooldown=60), limiter=RateLimiter(rpm=2))
+    with pytest.raises(LLMError):
+        p.complete_json("s", ["u"], {})
+    t = time.monotonic()
+    with pytest.raises(BreakerOpen):
+        p.complete_json("s", ["u"], {}, timeout=5)
+    assert time.monotonic() - t < 0.5 and p.sent == 1
+
+
+def test_rate_limit_refusal_returns_half_open_probe():
+    br = CircuitBreaker(threshold=1, cooldown=0.0)
+    br.record(False)
+    assert br.allow()  # пробный вызов half_open
+    br.release()
+    assert br.allow()
+
+
+def test_base_provider_is_abstract():
+    with pytest.raises(TypeError):
+        LLMProvider("m")
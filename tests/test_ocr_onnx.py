@@ -0,0 +1,122 @@
+# tests/test_ocr_onnx.py
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+onnx = pytest.importorskip("onnx")
+from onnx import TensorProto, helper, numpy_helper
+
+from src.ocr_onnx import OnnxOCR
+from src.ocr_paddle import PaddleEngine
+
+CHARS = ["А", "Б", "В"]
+# CTC-выход «rec»: А А _ Б Б В (индексы словаря со сдвигом на blank=0)
+SEQ, PROBS = [1, 1, 0, 2, 2, 3], [0.9, 0.9, 0.95, 0.8, 0.8, 0.7]
+
+
+def _det_model():
+    # тёмные пиксели → карта вероятностей ≈1, белый фон → ≈0
+    nodes = [
+        helper.make_node("ReduceMean", ["x"], ["m"], axes=[1], keepdims=1),
+        helper.make_node("Mul", ["m", "k"], ["z"]),
+        helper.make_node("Sigmoid", ["z"], ["y"]),
+    ]
+    graph = helper.make_graph(
+        nodes, "det",
+        [helper.make_tensor_value_info("x", TensorProto.FLOAT, [1, 3, None, None])],
+        [helper.make_tensor_value_info("y", TensorProto.FLOAT, [1, 1, None, None])],
+        [numpy_helper.from_array(np.array(-5.0, np.float32), "k")],
+    )
+    return helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)], ir_version=8)
+
+
+def _rec_model():
+    # вход не важен: фиксированные логиты [T, C], размноженные на батч
+    probs = np.full((len(SEQ), len(CHARS) + 2), 0.01, np.float32)  # blank + словарь + пробел
+    probs[np.arange(len(SEQ)), SEQ] = PROBS
+    nodes = [
+        helper.make_node("ReduceMean", ["x"], ["m"], axes=[1, 2], keepdims=0),  # [N, W]
+        helper.make_node("ReduceMean", ["m"], ["s"], axes=[1], keepdims=1),  # [N, 1]
+        helper.make_node("Unsqueeze", ["s", "ax"], ["s3"]),  # [N, 1, 1]
+        helper.make_node("Mul", ["s3", "zero"], ["z"]),
+        helper.make_node("Add", ["z", "probs"], ["y"]),  # [N, T, C]
+    ]
+    graph = helper.make_graph(
+        nodes, "rec",
+        [helper.make_tensor_value_info("x", TensorProto.FLOAT, [None, 3, 48, None])],
+        [helper.make_tensor_value_info("y", TensorProto.FLOAT, [None, len(SEQ), probs.shape[1]])],
+        [numpy_helper.from_array(np.array([2], np.int64), "ax"),
+         numpy_helper.from_array(np.array(0.0, np.float32), "zero"),
+         numpy_helper.from_array(probs, "probs")],
+    )
+    return helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)], ir_version=8)
+
+
+@pytest.fixture(scope="module")
+def model_dir(tmp_path_factory):
+    d = tmp_path_factory.mktemp("ppocr")
+    onnx.save(_det_model(), str(d / "det.onnx"))
+    onnx.save(_rec_model(), str(d / "rec.onnx"))
+    (d / "dict.txt").write_text("\n".join(CHARS), encoding="utf-8")
+    return d
+
+
+def _page():
+    img = np.full((200, 400, 3), 255, np.uint8)
+    img[60:90, 100:300] = 0
+    return img
+
+
+def test_ctc_decode_collapses_repeats_and_blanks(model_dir):
+    ocr = OnnxOCR(model_dir, threads=1)
+    preds = np.zeros((2, 4, 5), np.float32)
+    preds[0, np.arange(4), [3, 0, 3, 3]] = [0.6, 0.9, 0.8, 0.7]
+    preds[1, :, 0] = 1.0
+    assert ocr._ctc_decode(preds) == [("ВВ", pytest.approx(0.7)), ("", 0.0)]
+
+
+def test_ocr_matches_paddleocr_format(model_dir):
+    ocr = OnnxOCR(model_dir, threads=1)
+    res = ocr.ocr(_page(), cls=True)
+    assert len(res) == 1 and len(res[0]) == 1
+    box, (text, conf) = res[0][0]
+    assert np.array(box).shape == (4, 2)
+    xs, ys = [p[0] for p in box], [p[1] for p in box]
+    assert min(xs) <= 100 and max(xs) >= 299 and min(ys) <= 60 and max(ys) >= 89
+    assert text == "АБВ" and conf == pytest.approx(np.mean([0.9, 0.8, 0.7]))
+    assert ocr.ocr(np.full((64, 64, 3), 255, np.uint8)) == [None]
+    line = ocr.ocr(_page()[50:100, 90:310], det=False)
+    assert line[0][0][0] == "АБВ"
+
+
+def test_engine_runs_onnx_backend(model_dir, monkeypatch):
+    monkeypatch.setenv("OCR_ONNX_DIR", str(model_dir))
+    eng = PaddleEngine(backend="onnx", cpu_threads=1)
+    items = eng.run(_page())
+    assert [it["text"] for it in items] == ["АБВ"]
+    x1, y1, x2, y2 = items[0]["bbox"]
+    assert x1 <= 100 < 299 <= x2 and y1 <= 60 < 89 <= y2
+    assert eng.recognize(_page()[50:100, 90:310])[0] == "АБВ"
+
+
+def test_onnx_matches_paddle():
+    pytest.importorskip("paddleocr")
+    model_dir = Path(os.getenv("OCR_ONNX_DIR", "models/ppocr-ru"))
+    if not (model_dir / "det.onnx").exists():
+        pytest.skip(f"нет экспортированных моделей: python -m src.ocr_onnx export {model_dir}")
+    from PIL import Image, ImageDraw, ImageFont
+
+    img = Image.new("RGB", (900, 200), "white")
+    font = ImageFont.load_default(size=40)
+    draw = ImageDraw.Draw(img)
+    draw.text((30, 30), "ИТОГО 12 500,00", fill="black", font=font)
+    draw.text((30, 110), "Счёт № 123", fill="black", font=font)
+    paddle = PaddleEngine(backend="paddle").run(img)
+    onnx_items = PaddleEngine(backend="onnx").run(img)
+    assert [it["text"] for it in onnx_items] == [it["text"] for it in paddle]
+    for a, b in zip(onnx_items, paddle):
+        assert np.abs(np.array(a["bbox"]) - np.array(b["bbox"])).max() <= 3
+        assert abs(a["conf"] - b["conf"]) < 0.02
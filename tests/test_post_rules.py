@@ -0,0 +1,49 @@
+# tests/test_post_rules.py
+from src.post_rules import fix_fields, fix_fields_bulk, norm_date, norm_iban, normalize_column
+
+
+def test_norm_iban_accepts_letters_in_account():
+    assert norm_iban("IBAN KZ48125KZT1001300336") == "KZ48125KZT1001300336"
+    assert norm_iban("iban: kz18 722s 0000 1234 5678, БИК CASPKZKA") == "KZ18722S000012345678"
+
+
+def test_norm_iban_rejects_bad_checksum():
+    assert norm_iban("KZ19722S000012345678") is None
+    assert norm_iban("KZ00 0000 0000 0000 0000") is None
+    assert norm_iban("") is None and norm_iban(None) is None
+
+
+def test_norm_iban_skips_invalid_candidate():
+    assert norm_iban("KZ19722S000012345678 или KZ18722S000012345678") == "KZ18722S000012345678"
+
+
+def test_norm_date_ru_months():
+    assert norm_date("от 5 марта 2024 г.") == "2024-03-05"
+    assert norm_date("31 Декабря 2023") == "2023-12-31"
+    assert norm_date("30 февраля 2024") is None
+
+
+def test_fix_fields_keeps_non_string_values():
+    got = fix_fields({"amount": 12500, "currency": "тенге", "lines": [{"a": 1}]})
+    assert got == {"amount": "12500", "currency": "KZT", "lines": [{"a": 1}]}
+    assert fix_fields({"amount": 12500.5})["amount"] == "12500.5"
+    assert fix_fields({"iban": ["KZ18722S000012345678"]})["iban"] == ["KZ18722S000012345678"]
+
+
+def test_normalize_column_counts_only_real_changes():
+    vals, changed = normalize_column("amount", ["12500", "12 500,00 ₸", None, "", 12500.0, 12500, [1]])
+    assert vals == ["12500", "12500.00", None, None, "12500.0", "12500", [1]]
+    assert changed == 3
+    assert normalize_column("note", ["x", None]) == (["x", None], 0)
+
+
+def test_fix_fields_bulk_matches_fix_fields():
+    records = [
+        {"amount": "12 500,00", "date": "5 марта 2024", "iban": "KZ19722S000012345678"},
+        {"amount": 300, "currency": "руб.", "note": "оплата"},
+        None,
+    ]
+    rows, counts = fix_fields_bulk(records)
+    assert rows == [fix_fields(r) for r in records]
+    assert rows[0] == {"amount": "12500.00", "date": "2024-03-05"}
+    assert counts == {"amount": 2, "date": 1, "iban": 1, "currency": 1, "bic": 0, "iin_bin": 0}
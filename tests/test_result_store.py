@@ -0,0 +1,59 @@
+# tests/test_result_store.py
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip("msgpack")
+
+from src.result_store import MAGIC, ResultLog, dumps, from_jsonl, packb, to_jsonl, unpackb
+
+RESULT = {
+    "docType": "receipt",
+    "fields": {"amount": "12500.00", "currency": "KZT", "date": "2024-03-15"},
+    "needs_review": False,
+    "debug": {
+        "ocr": [[
+            {"text": "ИТОГО", "bbox": [10, 20, 110, 40], "conf": 0.98},
+            {"text": "12 500,00 ₸", "bbox": [[1.5, 2], [3, 4], [5, 6], [7, 8]], "conf": 0.91, "weak": True},
+            {"text": "без рамки", "bbox": None, "conf": 0.5, "page_no": 1},
+        ]],
+        "timings": {"ocr_ms": 120},
+    },
+}
+
+
+def test_packb_roundtrip():
+    assert unpackb(packb(RESULT)) == RESULT
+
+
+def test_packb_accepts_numpy_values():
+    res = {"fields": {}, "debug": {"scores": np.array([0.5, 0.25]), "n": np.int64(3)}}
+    assert unpackb(packb(res))["debug"] == {"scores": [0.5, 0.25], "n": 3}
+
+
+def test_result_log_append_and_reopen(tmp_path):
+    path = tmp_path / "archive.ocrpack"
+    with ResultLog(path) as log:
+        assert log.append(RESULT, file="a.pdf") == 0
+        assert log.append({"fields": {"amount": "1"}}, file="b.png") == 1
+        assert len(log) == 2
+    assert path.read_bytes().startswith(MAGIC)
+    with ResultLog(path) as log:
+        assert log[0] == RESULT and log.record(1)["file"] == "b.png"
+        assert [r["fields"] for r in log] == [RESULT["fields"], {"amount": "1"}]
+
+
+def test_jsonl_roundtrip_and_dumps(tmp_path):
+    log = ResultLog(tmp_path / "a.ocrpack")
+    log.append(RESULT, file="a.pdf")
+    out = tmp_path / "a.jsonl"
+    assert to_jsonl(log, out) == 1
+    assert json.loads(out.read_text(encoding="utf-8").splitlines()[0])["result"] == RESULT
+    copy = ResultLog(tmp_path / "b.ocrpack")
+    assert from_jsonl(out, copy) == 1 and copy[0] == RESULT
+    blob = tmp_path / "c.ocrpack"
+    blob.write_bytes(dumps([{"result": RESULT, "file": "a.pdf"}]))
+    assert ResultLog(blob)[0] == RESULT
+    for lg in (log, copy):
+        lg.close()
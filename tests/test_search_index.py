@@ -0,0 +1,73 @@
+# tests/test_search_index.py
+import pytest
+
+pytest.importorskip("msgpack")
+
+from src.search_index import SearchIndex
+
+
+def _result(amount="12500.00", iban="KZ18722S000012345678", text="Договор поставки оборудования"):
+    return {
+        "docType": "contract",
+        "meta": {"pages": 1},
+        "fields": {"amount": amount, "iban": iban, "date": "2024-03-15", "iin_bin": "900105300128"},
+        "needs_review": False,
+        "sections": [{"title": "Предмет", "content": "Поставка насосов", "page_from": 1}],
+        "debug": {"ocr": [[{"text": text, "bbox": [0, 0, 10, 10], "conf": 0.9}]]},
+    }
+
+
+def _fts_count(idx, word):
+    # сам индекс FTS, без JOIN с lines: устаревшие записи иначе не видны
+    return idx._db.execute("SELECT count(*) FROM lines_fts WHERE lines_fts MATCH ?", (f'"{word}"',)).fetchone()[0]
+
+
+@pytest.fixture
+def idx():
+    i = SearchIndex()
+    i.add(_result(), key="a", file="a.pdf")
+    i.add(_result(amount="3400", iban="KZ48125KZT1001300336", text="Счет на оплату"), key="b", file="b.pdf")
+    yield i
+    i.close()
+
+
+def test_find_exact_values(idx):
+    assert [h.key for h in idx.find("iban", "kz18 722s 0000 1234 5678")] == ["a"]
+    assert [h.key for h in idx.find("iin_bin", "900105300128")] == ["b", "a"]
+    assert idx.find("iban", "KZ00000000000000000000") == []
+
+
+@pytest.mark.parametrize("q", ["12500", "12 500", "12 500,00 ₸", "12500.0"])
+def test_find_amount_by_number(idx, q):
+    hits = idx.find("amount", q)
+    assert [h.key for h in hits] == ["a"] and hits[0].matches == [{"field": "amount", "value": "12500.00"}]
+
+
+def test_query_routes_by_value_shape(idx):
+    assert [h.key for h in idx.query("12 500")] == ["a"]
+    assert idx.query("12 500")[0].matches[0]["field"] == "amount"
+    assert [h.key for h in idx.query("KZ48125KZT1001300336")] == ["b"]
+    assert [h.key for h in idx.query("15.03.2024")] == ["b", "a"]
+    assert [h.key for h in idx.query("iban: KZ18722S000012345678")] == ["a"]
+    full = idx.query("поставки")
+    assert [h.key for h in full] == ["a"] and "[поставки]" in full[0].matches[0]["snippet"]
+
+
+def test_find_range(idx):
+    assert [h.key for h in idx.find_range("amount", 1000, 5000)] == ["b"]
+    assert [h.key for h in idx.find_range("amount", lo="10 000")] == ["a"]
+    assert len(idx.find_range("date", "2024-01-01", "2024-12-31")) == 2
+
+
+def test_readd_replaces_fields_and_lines(idx):
+    idx.add(_result(amount="99", text="Акт сверки"), key="a", file="a.pdf")
+    assert idx.search("поставки") == [] and [h.key for h in idx.search("сверки")] == ["a"]
+    assert idx.find("amount", "12500") == [] and [h.key for h in idx.find("amount", "99")] == ["a"]
+    assert idx.stats()["docs"] == 2
+    assert _fts_count(idx, "поставки") == 0
+
+
+def test_remove(idx):
+    assert idx.remove("b") and not idx.remove("b")
+    assert _fts_count(idx, "оплату") == 0 and idx.find("amount", "3400") == []
+    assert idx.stats() == {"docs": 1, "fields": 4, "lines": 2, "needs_review": 0}
@@ -0,0 +1,38 @@
+# tests/test_second_pass.py
+import numpy as np
+
+from src.ocr_paddle import PaddleEngine
+from src.second_pass import SecondPass
+
+
+class _Engine:
+    is_garbage = staticmethod(PaddleEngine.is_garbage)
+
+    def __init__(self, text, conf):
+        self.read, self.crops = (text, conf), []
+
+    def recognize(self, crop):
+        self.crops.append(crop)
+        return self.read
+
+
+PAGE = np.full((100, 300, 3), 255, np.uint8)
+WEAK = {"text": "l2", "bbox": [10, 10, 60, 30], "conf": 0.3, "weak": True}
+
+
+def test_refined_line_is_rechecked_for_garbage():
+    sp = SecondPass()
+    got = sp.refine(_Engine("12", 0.5), PAGE, [WEAK], conf_threshold=0.6)
+    assert got[0]["text"] == "12" and got[0]["weak"] and got[0]["refined"]
+    assert sp.stats.improved == 0
+
+    got = sp.refine(_Engine("Итого", 0.5), PAGE, [WEAK], conf_threshold=0.6)
+    assert got[0]["text"] == "Итого" and "weak" not in got[0]
+    assert sp.stats.improved == 1
+
+
+def test_weak_line_kept_when_not_improved():
+    eng = _Engine("l2", 0.31)
+    got = SecondPass().refine(eng, PAGE, [WEAK, {"text": "ok", "bbox": [0, 40, 50, 60], "conf": 0.9}],
+                              conf_threshold=0.6)
+    assert got[0] == WEAK and got[1]["text"] == "ok" and len(eng.crops) == 1
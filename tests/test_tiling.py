@@ -0,0 +1,57 @@
+# tests/test_tiling.py
+import numpy as np
+
+from src.ocr_paddle import PaddleEngine
+from utils.image_tools import safe_crop
+from utils.tiling import dedup_boxes, tile_grid, touches_inner_edge
+
+
+def test_tile_grid_covers_page_with_overlap():
+    boxes = tile_grid(5000, 3000, tile=2048, overlap=192)
+    assert boxes[0] == (0, 0, 2048, 2048)
+    assert max(b[2] for b in boxes) == 5000 and max(b[3] for b in boxes) == 3000
+    xs = sorted({b[0] for b in boxes})
+    assert all(b - a <= 2048 - 192 for a, b in zip(xs, xs[1:]))
+
+
+def test_tile_grid_small_page_is_one_tile():
+    assert tile_grid(800, 600) == [(0, 0, 800, 600)]
+
+
+def test_touches_inner_edge_ignores_page_border():
+    tile = (0, 0, 2048, 2048)
+    assert not touches_inner_edge([0, 0, 100, 30], tile, 2048, 5000)
+    assert touches_inner_edge([100, 2030, 300, 2048], tile, 2048, 5000)
+
+
+def test_dedup_boxes_prefers_unclipped_copy():
+    boxes = [[100, 2030, 400, 2048], [100, 2030, 400, 2070], [900, 10, 1000, 40]]
+    keep = dedup_boxes(boxes, clipped=[True, False, False], confs=[0.99, 0.8, 0.9])
+    assert keep == [1, 2]
+
+
+def test_safe_crop_returns_copy_for_full_width_slice():
+    img = np.zeros((100, 50, 3), np.uint8)
+    crop = safe_crop(img, [0, 10, 50, 40], expand=0)
+    assert not np.shares_memory(crop, img)
+    crop[:] = 255
+    assert img.max() == 0
+
+
+class _NoOCR:
+    def ocr(self, arr, cls=True):
+        return [None]
+
+
+def test_run_tile_does_not_mutate_page_through_full_width_tile():
+    # длинный узкий чек: тайл на всю ширину страницы — непрерывный срез
+    eng = PaddleEngine.__new__(PaddleEngine)
+    eng.ocr, eng.tile_workers = _NoOCR(), 1
+    page = np.full((5000, 600, 3), 200, np.uint8)
+
+    def preprocess(tile):
+        tile[:] = 0  # как preprocess_for_ocr(..., inplace=True)
+        return tile
+
+    eng._run_tile(page, (0, 1800, 600, 3848), preprocess)
+    assert page.min() == 200
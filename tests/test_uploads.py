@@ -0,0 +1,31 @@
+# tests/test_uploads.py
+import io
+import os
+import time
+
+from src.uploads import UploadStore, result_key
+
+
+def test_janitor_removes_only_its_own_files(tmp_path):
+    store = UploadStore(tmp_path, ttl=60)
+    up = store.store(io.BytesIO(b"%PDF-1.4 test"), "scan.PDF")
+    key = result_key(up.sha256, {"lang": "ru"})
+    store.put_result(key, {"fields": {}})
+    foreign = [tmp_path / "index.sqlite", tmp_path / "index.sqlite-wal", tmp_path / "notes.txt"]
+    old = time.time() - 3600
+    for p in foreign:
+        p.write_bytes(b"x")
+    for p in [up.path, tmp_path / f"{key}.json", *foreign]:
+        os.utime(p, (old, old))
+
+    assert up.path.name == f"{up.sha256}.pdf"
+    assert store.cleanup() == 2
+    assert not up.path.exists() and store.get_result(key) is None
+    assert all(p.exists() for p in foreign)
+
+
+def test_janitor_keeps_files_in_use(tmp_path):
+    store = UploadStore(tmp_path, ttl=0)
+    up = store.store(io.BytesIO(b"data"), "a.png")
+    store.in_use = lambda: [str(up.path)]
+    assert store.cleanup() == 0 and up.path.exists()
@@ -0,0 +1,91 @@
+# tests/test_validate.py
+from datetime import date
+
+from src.field_rules import iban_checksum_ok, iin_checksum_ok
+from src.post_validate import TEXT_RULES, needs_review, validate_batch, validate_fields
+
+IBAN = "KZ18722S000012345678"
+IIN = "900105300128"
+BIN = "040605500128"
+
+RECEIPT = {"date": "2024-03-15", "amount": "12500.00", "currency": "KZT"}
+RECEIPT_TEXT = "ТОО Магазин\nЧек № 42 от 15.03.2024\nИТОГО: 12 500,00 ₸"
+
+
+def _rules(checks):
+    return {c["rule"]: c for c in checks}
+
+
+def test_iban_checksum():
+    assert iban_checksum_ok(IBAN)
+    assert iban_checksum_ok("KZ48125KZT1001300336")
+    assert not iban_checksum_ok("KZ19722S000012345678")
+    assert not iban_checksum_ok("KZ18722S00001234567")
+
+
+def test_iin_checksum():
+    assert iin_checksum_ok(IIN) and iin_checksum_ok(BIN)
+    assert not iin_checksum_ok("900105300129")
+    assert not iin_checksum_ok("90010530012")
+
+
+def test_receipt_without_iban_is_not_flagged():
+    checks = validate_fields(RECEIPT, RECEIPT_TEXT)
+    assert "iban_present_in_text" not in _rules(checks)
+    assert not needs_review(checks)
+    assert not validate_batch([RECEIPT]).needs_review[0]
+
+
+def test_iban_in_text_but_not_extracted_is_informational():
+    checks = _rules(validate_fields(RECEIPT, RECEIPT_TEXT + f"\nIBAN {IBAN}"))
+    hint = checks["iban_candidate_in_text"]
+    assert hint["info"] and IBAN in hint["details"]
+    assert not needs_review(list(checks.values()))
+
+
+def test_extracted_iban_must_be_in_text():
+    fields = dict(RECEIPT, iban=IBAN)
+    ok = _rules(validate_fields(fields, RECEIPT_TEXT + "\nIBAN KZ18 722S 0000 1234 5678"))
+    assert ok["iban_checksum"]["ok"] and ok["iban_present_in_text"]["ok"]
+    bad = validate_fields(fields, RECEIPT_TEXT)
+    assert not _rules(bad)["iban_present_in_text"]["ok"] and needs_review(bad)
+
+
+def test_validate_batch_matches_scalar_checksums():
+    rows = [
+        {"iban": IBAN, "iin_bin": IIN},
+        {"iban": "KZ19722S000012345678", "iin_bin": BIN},
+        {"iban": "", "iin_bin": "900105300129"},
+        {},
+    ]
+    rep = validate_batch(rows, today=date(2026, 1, 1))
+    assert rep.checks["iban_checksum"].tolist() == [True, False, True, True]
+    assert rep.checks["iin_checksum"].tolist() == [True, True, False, True]
+    assert rep.present["iban_checksum"].tolist() == [True, True, False, False]
+    assert rep.needs_review.tolist() == [False, True, True, False]
+    assert rep.failed_rules(1) == ["iban_checksum"]
+
+
+def test_scalar_and_batch_validation_agree():
+    today = date(2026, 1, 1)
+    results = [
+        {"docType": "receipt", "fields": RECEIPT},
+        {"docType": "receipt", "fields": {"amount": "12500.00"}},  # нет валюты и даты
+        {"docType": "receipt", "fields": {"date": "15.03.2024", "amount": "abc", "currency": "тнг"}},
+        {"docType": "receipt", "fields": dict(RECEIPT, date="2031-01-01", amount="-5")},
+        {"docType": "invoice", "fields": {"iban": "KZ19722S000012345678", "bic": "HSBKKZKX", "iin_bin": "901305300128"}},
+        {"docType": "invoice", "fields": {"iban": IBAN, "bic": "casp kz", "iin_bin": BIN}},
+    ]
+    rep = validate_batch(results, today=today)
+    for i, r in enumerate(results):
+        checks = validate_fields(r["fields"], "", doc_type=r["docType"], today=today)
+        scalar = {c["rule"] for c in checks if not c["ok"] and not c.get("info")} - set(TEXT_RULES)
+        assert scalar == set(rep.failed_rules(i)), i
+        assert bool(rep.needs_review[i]) == (needs_review(checks) or bool(scalar))
+
+
+def test_missing_fields_are_not_format_failures():
+    rules = _rules(validate_fields({"amount": "12500.00"}, "", doc_type="receipt"))
+    assert not {"date_iso", "currency_iso"} & set(rules)
+    assert not rules["amount_currency"]["ok"]
+    assert not rules["missing_required"]["ok"] and "date" in rules["missing_required"]["details"]
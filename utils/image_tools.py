@@ -1,5 +1,6 @@
 # src/utils/image_tools.py
 from typing import Sequence, Tuple, Union, Dict
+import numpy as np
 from PIL import Image
 
 BBox = Union[Sequence[float], Dict[str, float], Sequence[Sequence[float]]]
@@ -37,13 +38,17 @@ def _bbox_to_ltrb(bbox: BBox, img_w: int, img_h: int) -> Tuple[int, int, int, in
     return l, t, r, b
 
 
-def safe_crop(image: Image.Image, bbox: BBox, expand: int = 2) -> Image.Image | None:
+def safe_crop(image: Image.Image | np.ndarray, bbox: BBox, expand: int = 2) -> Image.Image | np.ndarray | None:
     """
     Возвращает обрезанный фрагмент изображения по bbox или None, если рамка некорректна.
+    Для массива (H, W, C) возвращается копия фрагмента (не вид на исходник).
     """
     if image is None or bbox is None:
         return None
-    w, h = image.size
+    if isinstance(image, np.ndarray):
+        h, w = image.shape[:2]
+    else:
+        w, h = image.size
     try:
         l, t, r, b = _bbox_to_ltrb(bbox, w, h)
     except Exception:
@@ -56,4 +61,6 @@ def safe_crop(image: Image.Image, bbox: BBox, expand: int = 2) -> Image.Image |
 
     if r <= l or b <= t:
         return None
+    if isinstance(image, np.ndarray):
+        return image[t:b, l:r].copy()  # ascontiguousarray отдал бы вид на полосу во всю ширину
     return image.crop((l, t, r, b))
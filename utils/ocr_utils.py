@@ -2,17 +2,31 @@
 import cv2
 import numpy as np
 from PIL import Image
-from typing import Literal, Tuple
+from dataclasses import dataclass
+from typing import Literal, Tuple, Optional, Dict, Any
+
+from utils.page_buffer import PageBuffer, as_array as _as_array
 
 Mode = Literal["soft", "binary"]
 
-def _to_rgb(pil: Image.Image) -> np.ndarray:
-    return cv2.cvtColor(np.array(pil.convert("RGB")), cv2.COLOR_RGB2BGR)
+def _to_rgb(rgb: np.ndarray, *, inplace: bool = False) -> np.ndarray:
+    """RGB → BGR. inplace=True — конвертация в том же буфере, без новой копии."""
+    if inplace:
+        return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR, dst=rgb)
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+def _from_rgb(bgr: np.ndarray, gray: bool = False, *, as_array: bool = False) -> Image.Image | np.ndarray:
+    # bgr здесь всегда «наш» рабочий буфер — переводим обратно в RGB на месте
+    out = bgr if gray else cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=bgr)
+    return out if as_array else Image.fromarray(out)
 
-def _from_rgb(bgr: np.ndarray, gray: bool = False) -> Image.Image:
-    if gray:
-        return Image.fromarray(bgr)
-    return Image.fromarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))
+def rotate_image(img: Image.Image | np.ndarray, angle_deg: float) -> np.ndarray:
+    """Поворот страницы (RGB-массив) с белым фоном; размер не меняется."""
+    arr = _as_array(img)
+    h, w = arr.shape[:2]
+    M = cv2.getRotationMatrix2D((w/2, h/2), angle_deg, 1.0)
+    return cv2.warpAffine(arr, M, (w, h), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=(255, 255, 255))
 
 def _auto_invert_if_needed(gray: np.ndarray) -> np.ndarray:
     # если фон тёмный — инвертируем
@@ -22,18 +36,14 @@ def _auto_invert_if_needed(gray: np.ndarray) -> np.ndarray:
 
 def _clahe_rgb(bgr: np.ndarray) -> np.ndarray:
     # CLAHE по Y-каналу (лучше для шрифтов)
-    yuv = cv2.cvtColor(bgr, cv2.COLOR_BGR2YUV)
-    y, u, v = cv2.split(yuv)
+    # преобразования на месте: без split/merge и промежуточных трёхканальных копий
+    yuv = cv2.cvtColor(bgr, cv2.COLOR_BGR2YUV, dst=bgr)
     clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    y = clahe.apply(y)
-    yuv = cv2.merge([y, u, v])
-    return cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR)
+    yuv[:, :, 0] = clahe.apply(np.ascontiguousarray(yuv[:, :, 0]))
+    return cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR, dst=yuv)
 
-def _deskew(gray: np.ndarray, max_angle: float = 10.0) -> Tuple[np.ndarray, float]:
-    """
-    Грубый deskew по Хаффу. Возвращает (выравненное изображение, угол).
-    Работает быстро и достаточно для типовых договоров.
-    """
+def _estimate_skew(gray: np.ndarray, max_angle: float = 10.0) -> float:
+    """Оценка угла наклона по Хаффу (градусы). 0.0 — если линий не нашли."""
     h, w = gray.shape[:2]
     edges = cv2.Canny(gray, 50, 150)
     lines = cv2.HoughLines(edges, 1, np.pi/180, threshold=max(120, int(0.15*max(h, w))))
@@ -50,19 +60,123 @@ def _deskew(gray: np.ndarray, max_angle: float = 10.0) -> Tuple[np.ndarray, floa
                 angles.append(a)
         if angles:
             angle_deg = float(np.median(angles))
-            M = cv2.getRotationMatrix2D((w/2, h/2), angle_deg, 1.0)
-            gray = cv2.warpAffine(gray, M, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return angle_deg
+
+def _rotate(img: np.ndarray, angle_deg: float) -> np.ndarray:
+    h, w = img.shape[:2]
+    M = cv2.getRotationMatrix2D((w/2, h/2), angle_deg, 1.0)
+    return cv2.warpAffine(img, M, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+def _deskew(gray: np.ndarray, max_angle: float = 10.0) -> Tuple[np.ndarray, float]:
+    """
+    Грубый deskew по Хаффу. Возвращает (выравненное изображение, угол).
+    Работает быстро и достаточно для типовых договоров.
+    """
+    angle_deg = _estimate_skew(gray, max_angle=max_angle)
+    if angle_deg:
+        gray = _rotate(gray, angle_deg)
     return gray, angle_deg
 
+# --- Триаж страницы: дешёвые метрики по миниатюре → профиль препроцессинга ---
+
+# Профили: от самого дешёвого к самому тяжёлому. Ключи — kwargs для preprocess_for_ocr.
+PREPROC_PROFILES: Dict[str, Dict[str, Any]] = {
+    "clean": dict(mode="soft", use_clahe=False, do_denoise=False, do_deskew=False, do_unsharp=False),
+    "light": dict(mode="soft", use_clahe=True, do_denoise=False, do_unsharp=True),
+    "soft": dict(mode="soft"),
+    "binary": dict(mode="binary"),
+}
+
+@dataclass
+class PageTriage:
+    blur: float          # дисперсия Лапласиана (больше — резче)
+    contrast: float      # разброс яркости p95 - p5
+    skew: float          # оценка наклона, градусы
+    ink: float           # доля «чернильных» пикселей (плотность текста)
+    blank: bool
+    profile: str         # "skip" | ключ PREPROC_PROFILES
+
+    def preprocess_kwargs(self) -> Dict[str, Any]:
+        kw = dict(PREPROC_PROFILES.get(self.profile, PREPROC_PROFILES["soft"]))
+        # угол уже известен по миниатюре — повторный Хафф на полном разрешении не нужен
+        if abs(self.skew) >= 0.3:
+            kw.update(do_deskew=True, deskew_angle=self.skew)
+        elif kw.get("mode") == "soft":
+            kw["do_deskew"] = False
+        return kw
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "blur": round(self.blur, 1),
+            "contrast": round(self.contrast, 1),
+            "skew": round(self.skew, 2),
+            "ink": round(self.ink, 4),
+            "blank": self.blank,
+            "profile": self.profile,
+        }
+
+def triage_page(
+    pil: Image.Image | np.ndarray,
+    *,
+    thumb_side: int = 800,
+    blank_ink: float = 0.002,
+    clean_contrast: float = 120.0,
+    clean_blur: float = 150.0,
+    poor_contrast: float = 60.0,
+    poor_blur: float = 40.0,
+) -> PageTriage:
+    """
+    Быстрая оценка качества страницы по миниатюре (~миллисекунды):
+    размытие, контраст, наклон, плотность текста, пустая страница.
+    По метрикам выбирается самый дешёвый достаточный профиль препроцессинга.
+    """
+    if isinstance(pil, Image.Image):
+        thumb = pil.convert("L")
+        thumb.thumbnail((thumb_side, thumb_side))
+        gray = np.asarray(thumb)
+    else:
+        # массив: сначала уменьшаем (INTER_AREA), потом серый — без полноразмерных копий
+        arr = _as_array(pil)
+        h, w = arr.shape[:2]
+        k = thumb_side / float(max(h, w))
+        if k < 1.0:
+            arr = cv2.resize(arr, (max(1, int(w * k)), max(1, int(h * k))), interpolation=cv2.INTER_AREA)
+        gray = arr if arr.ndim == 2 else cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY)
+
+    p5, p50, p95 = np.percentile(gray, (5, 50, 95))
+    contrast = float(p95 - p5)
+    # «чернила» — всё, что заметно отличается от фона (фон может быть и тёмным)
+    ink = float(np.mean(np.abs(gray.astype(np.int16) - int(p50)) > 60))
+    blank = ink < blank_ink
+
+    blur = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    skew = 0.0 if blank else _estimate_skew(gray, max_angle=10.0)
+
+    if blank:
+        profile = "skip"
+    elif contrast < poor_contrast or blur < poor_blur:
+        profile = "soft"
+    elif contrast >= clean_contrast and blur >= clean_blur:
+        profile = "clean"
+    else:
+        profile = "light"
+    return PageTriage(blur=blur, contrast=contrast, skew=float(skew), ink=ink, blank=blank, profile=profile)
+
 def preprocess_for_ocr(
-    pil: Image.Image,
+    pil: Image.Image | np.ndarray | PageBuffer,
     *,
     mode: Mode = "soft",            # "soft" — для PaddleOCR (рекомендуется), "binary" — как было
     target_width: int = 2400,       # апскейл для мелких шрифтов (1.6–2.4k обычно ок)
     add_padding: int = 8,
     do_unsharp: bool = True,
+    use_clahe: bool = True,
+    do_denoise: bool = True,
+    do_deskew: bool = True,
+    deskew_angle: Optional[float] = None,
     return_rgb: bool = True,
-) -> Image.Image:
+    inplace: bool = False,
+    as_array: bool = False,
+) -> Image.Image | np.ndarray:
     """
     Подготовка изображений под OCR.
 
@@ -70,36 +184,56 @@ def preprocess_for_ocr(
         Лучшее качество для PaddleOCR по русскому.
 
     mode="binary": старый путь (бинаризация, морфология) — пригодится для пост-обработки/масок.
+
+    use_clahe / do_denoise / do_deskew отключают отдельные шаги (см. PREPROC_PROFILES).
+    deskew_angle — заранее известный угол (например, из triage_page): Хафф не запускается.
+
+    На вход можно подать RGB-массив / PageBuffer: inplace=True разрешает портить входной
+    буфер (цветовые преобразования идут на месте), as_array=True возвращает RGB-массив
+    вместо PIL — страница проходит цепочку без лишних копий.
     """
-    bgr = _to_rgb(pil)
+    rgb = _as_array(pil)
+    owned = isinstance(pil, Image.Image)  # массив из PIL — уже наша копия
+    if rgb.ndim == 2:
+        rgb = cv2.cvtColor(rgb, cv2.COLOR_GRAY2RGB)
+        owned = True
 
-    # --- Универсальный апскейл до target_width ---
-    h, w = bgr.shape[:2]
+    # --- Универсальный апскейл до target_width (до смены порядка каналов — ему всё равно) ---
+    h, w = rgb.shape[:2]
     if w < target_width:
         scale = target_width / float(w)
-        bgr = cv2.resize(bgr, (int(w*scale), int(h*scale)), interpolation=cv2.INTER_CUBIC)
+        rgb = cv2.resize(rgb, (int(w*scale), int(h*scale)), interpolation=cv2.INTER_CUBIC)
+        owned = True
+
+    bgr = _to_rgb(rgb, inplace=owned or inplace)
 
     if mode == "soft":
         # 1) Контраст (CLAHE по Y)
-        bgr = _clahe_rgb(bgr)
+        if use_clahe:
+            bgr = _clahe_rgb(bgr)
 
         # 2) Мягкое шумоподавление (сохраняем границы букв)
-        bgr = cv2.bilateralFilter(bgr, d=7, sigmaColor=50, sigmaSpace=50)
+        if do_denoise:
+            bgr = cv2.bilateralFilter(bgr, d=7, sigmaColor=50, sigmaSpace=50)
 
-        # 3) Deskew (по серому)
-        gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (3, 3), 0)
-        gray, _ = _deskew(gray, max_angle=10.0)
+        # 3) Deskew (угол по серому, поворачиваем и цвет, и серый)
+        if do_deskew or do_unsharp:
+            gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+            gray = cv2.GaussianBlur(gray, (3, 3), 0)
+        if do_deskew:
+            angle = deskew_angle if deskew_angle is not None else _estimate_skew(gray, max_angle=10.0)
+            if angle:
+                bgr = _rotate(bgr, angle)
+                gray = _rotate(gray, angle)
 
         # 4) Лёгкая нерезкая маска, чуть повышаем чёткость
         if do_unsharp:
             blur = cv2.GaussianBlur(gray, (0, 0), 1.0)
             sharp = cv2.addWeighted(gray, 1.5, blur, -0.5, 0)
             # вставим обратно как Y-канал
-            yuv = cv2.cvtColor(bgr, cv2.COLOR_BGR2YUV)
-            y, u, v = cv2.split(yuv)
-            y = sharp
-            bgr = cv2.cvtColor(cv2.merge([y, u, v]), cv2.COLOR_YUV2BGR)
+            yuv = cv2.cvtColor(bgr, cv2.COLOR_BGR2YUV, dst=bgr)
+            yuv[:, :, 0] = sharp
+            bgr = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR, dst=yuv)
 
         # 5) Паддинг
         if add_padding > 0:
@@ -107,16 +241,20 @@ def preprocess_for_ocr(
                                      borderType=cv2.BORDER_CONSTANT, value=(255, 255, 255))
 
         # Возвращаем RGB (для PaddleOCR лучше RGB)
-        return _from_rgb(bgr, gray=False) if return_rgb else Image.fromarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY))
+        if return_rgb:
+            return _from_rgb(bgr, gray=False, as_array=as_array)
+        return _from_rgb(cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY), gray=True, as_array=as_array)
 
     # ===== mode == "binary" =====
     gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
 
     # CLAHE
-    gray = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(gray)
+    if use_clahe:
+        gray = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(gray)
 
     # Мягкое шумоподавление
-    gray = cv2.bilateralFilter(gray, d=5, sigmaColor=25, sigmaSpace=25)
+    if do_denoise:
+        gray = cv2.bilateralFilter(gray, d=5, sigmaColor=25, sigmaSpace=25)
 
     # Адаптивная бинаризация
     bw = cv2.adaptiveThreshold(
@@ -128,7 +266,11 @@ def preprocess_for_ocr(
     bw = cv2.morphologyEx(bw, cv2.MORPH_OPEN, kernel, iterations=1)
 
     # Deskew
-    bw, _ = _deskew(bw, max_angle=10.0)
+    if do_deskew:
+        if deskew_angle is not None:
+            bw = _rotate(bw, deskew_angle) if deskew_angle else bw
+        else:
+            bw, _ = _deskew(bw, max_angle=10.0)
 
     # Авто-инверсия (текст всегда тёмный на светлом)
     bw = _auto_invert_if_needed(bw)
@@ -145,5 +287,5 @@ def preprocess_for_ocr(
 
     # RGB или GRAY
     if return_rgb:
-        return Image.fromarray(cv2.cvtColor(bw, cv2.COLOR_GRAY2RGB))
-    return Image.fromarray(bw)
+        bw = cv2.cvtColor(bw, cv2.COLOR_GRAY2RGB)
+    return bw if as_array else Image.fromarray(bw)
@@ -0,0 +1,61 @@
+# utils/page_buffer.py
+from __future__ import annotations
+from typing import Tuple
+
+import numpy as np
+from PIL import Image
+
+
+class PageBuffer:
+    """
+    Один RGB-массив (H, W, 3) uint8 на всю цепочку: загрузка → препроцессинг → OCR → Donut.
+
+    PIL-объект создаётся только там, где он реально нужен (to_pil), цветовые
+    преобразования делаются на месте (preprocess_for_ocr(..., inplace=True)).
+    """
+
+    def __init__(self, array: np.ndarray) -> None:
+        self.array = array
+
+    # --- конструкторы ---
+    @classmethod
+    def from_pil(cls, img: Image.Image) -> "PageBuffer":
+        return cls(np.array(img.convert("RGB")))
+
+    @classmethod
+    def from_pixmap(cls, pix) -> "PageBuffer":
+        """fitz.Pixmap → массив одной копией (samples неизменяемы, нужен writable-буфер)."""
+        arr = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+        if pix.n == 4:
+            arr = arr[:, :, :3]
+        return cls(np.ascontiguousarray(arr).copy())
+
+    # --- свойства ---
+    @property
+    def size(self) -> Tuple[int, int]:
+        """(W, H) — как у PIL.Image.size."""
+        return int(self.array.shape[1]), int(self.array.shape[0])
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.array.nbytes)
+
+    def to_pil(self) -> Image.Image:
+        return Image.fromarray(self.array)
+
+
+def as_array(img: Image.Image | np.ndarray | PageBuffer) -> np.ndarray:
+    """RGB-массив без лишней копии, если на входе уже массив/буфер."""
+    if isinstance(img, PageBuffer):
+        return img.array
+    if isinstance(img, np.ndarray):
+        return img
+    return np.array(img.convert("RGB"))
+
+
+def image_size(img: Image.Image | np.ndarray | PageBuffer) -> Tuple[int, int]:
+    """(W, H) для PIL/массива/буфера."""
+    if isinstance(img, Image.Image):
+        return img.size
+    arr = as_array(img)
+    return int(arr.shape[1]), int(arr.shape[0])
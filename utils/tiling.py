@@ -0,0 +1,93 @@
+# utils/tiling.py
+from typing import List, Tuple, Sequence, Dict
+
+Box = Tuple[int, int, int, int]  # x1, y1, x2, y2
+
+
+def tile_grid(width: int, height: int, tile: int = 2048, overlap: int = 192) -> List[Box]:
+    """
+    Разбивает страницу на перекрывающиеся тайлы.
+    Перекрытие должно быть больше высоты самой крупной строки, иначе строка
+    на шве не попадёт целиком ни в один тайл.
+    """
+    tile = max(tile, overlap * 2 + 1)
+    step = tile - overlap
+
+    def starts(size: int) -> List[int]:
+        if size <= tile:
+            return [0]
+        xs = list(range(0, size - tile, step))
+        xs.append(size - tile)  # последний тайл прижат к краю
+        return xs
+
+    return [(x, y, min(x + tile, width), min(y + tile, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def touches_inner_edge(bbox: Sequence[int], tile: Box, page_w: int, page_h: int, margin: int = 2) -> bool:
+    """True, если бокс упирается во внутренний шов тайла (скорее всего обрезан)."""
+    x1, y1, x2, y2 = bbox
+    tx1, ty1, tx2, ty2 = tile
+    return ((tx1 > 0 and x1 <= tx1 + margin) or
+            (ty1 > 0 and y1 <= ty1 + margin) or
+            (tx2 < page_w and x2 >= tx2 - margin) or
+            (ty2 < page_h and y2 >= ty2 - margin))
+
+
+def _area(b: Sequence[int]) -> int:
+    return max(0, b[2] - b[0]) * max(0, b[3] - b[1])
+
+
+def _overlap(a: Sequence[int], b: Sequence[int]) -> Tuple[float, float]:
+    """(IoU, пересечение / площадь меньшего)."""
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    if inter == 0:
+        return 0.0, 0.0
+    aa, bb = _area(a), _area(b)
+    return inter / float(aa + bb - inter), inter / float(max(1, min(aa, bb)))
+
+
+def dedup_boxes(
+    boxes: Sequence[Sequence[int]],
+    *,
+    clipped: Sequence[bool],
+    confs: Sequence[float],
+    iou_thr: float = 0.5,
+    contain_thr: float = 0.8,
+    bucket: int = 128,
+) -> List[int]:
+    """
+    Индексы боксов, оставшихся после удаления дублей на швах.
+    Приоритет: не обрезанный швом → больший по площади → более уверенный.
+    Кандидаты на пересечение ищутся через сетку с шагом bucket (не O(n²) по странице).
+    """
+    order = sorted(range(len(boxes)),
+                   key=lambda i: (clipped[i], -_area(boxes[i]), -confs[i]))
+    grid: Dict[Tuple[int, int], List[int]] = {}
+    kept: List[int] = []
+    for i in order:
+        b = boxes[i]
+        cells = [(cx, cy)
+                 for cx in range(b[0] // bucket, b[2] // bucket + 1)
+                 for cy in range(b[1] // bucket, b[3] // bucket + 1)]
+        seen = set()
+        dup = False
+        for c in cells:
+            for j in grid.get(c, ()):
+                if j in seen:
+                    continue
+                seen.add(j)
+                iou, contain = _overlap(b, boxes[j])
+                if iou >= iou_thr or contain >= contain_thr:
+                    dup = True
+                    break
+            if dup:
+                break
+        if dup:
+            continue
+        kept.append(i)
+        for c in cells:
+            grid.setdefault(c, []).append(i)
+    return sorted(kept)